@@ -1,10 +1,12 @@
 from __future__ import annotations
 
+import asyncio
 from datetime import date
 
 import litellm
 import typer
 
+from bulkllm.limiter_server import DEFAULT_PORT, serve
 from bulkllm.llm_configs import create_model_configs, model_resolver
 from bulkllm.model_registration.canonical import _canonical_model_name, get_canonical_models
 from bulkllm.model_registration.main import register_models
@@ -171,6 +173,18 @@ def list_missing_model_configs() -> None:
             typer.echo(model)
 
 
+@app.command("limiter-server")
+def limiter_server(
+    host: str = typer.Option("127.0.0.1", "--host", help="Interface to listen on"),
+    port: int = typer.Option(DEFAULT_PORT, "--port", "-p", help="TCP port to listen on"),
+    unix_socket: str | None = typer.Option(None, "--unix-socket", help="Listen on a Unix socket instead of TCP"),
+) -> None:
+    """Serve shared rate limits to bulkllm clients on other processes or machines."""
+    address = unix_socket or f"{host}:{port}"
+    typer.echo(f"Serving rate limits on {address}")
+    asyncio.run(serve(host=host, port=port, path=unix_socket))
+
+
 def main() -> None:  # pragma: no cover - CLI entry point
     app()
 
@@ -0,0 +1,169 @@
+"""
+Persistent per-day usage counters for :class:`bulkllm.rate_limiter.ModelRateLimit`.
+
+Daily quotas (``rpd``, ``tpd``, ``daily_cost_usd``) must survive restarts,
+so each limit's running totals for the current day are kept in a small
+SQLite database.  Recording a request only adds to an in-memory buffer, so
+the event loop never waits on SQLite; a background thread writes the buffer
+to the database every ``flush_interval`` seconds (and at exit) in one
+transaction and reads back the stored totals, which also picks up usage
+recorded by other processes sharing the file.
+"""
+
+from __future__ import annotations
+
+import atexit
+import functools
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DAILY_QUOTA_PATH = Path.home() / ".cache" / "bulkllm" / "daily_quotas.sqlite"
+
+
+class DailyUsage(NamedTuple):
+    """Requests, tokens and cost recorded against a limit on one day."""
+
+    requests: int = 0
+    tokens: int = 0
+    cost_usd: float = 0.0
+
+
+def _combine(*usages: DailyUsage) -> DailyUsage:
+    """Add *usages* field by field."""
+    return DailyUsage(*(sum(field) for field in zip(*usages, strict=True)))
+
+
+class DailyQuotaStore:
+    """SQLite-backed daily usage counters, keyed by limit key and day, with buffered writes."""
+
+    def __init__(self, path: str | Path, *, busy_timeout: float = 30.0, flush_interval: float = 1.0):
+        """Create the database at *path* if needed; buffered usage is written every *flush_interval* seconds."""
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.busy_timeout = busy_timeout
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (key, day) -> totals last read from the database / added since / being written
+        self._stored: dict[tuple[str, str], DailyUsage] = {}
+        self._pending: dict[tuple[str, str], DailyUsage] = {}
+        self._flushing: dict[tuple[str, str], DailyUsage] = {}
+        self._flusher: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._pid = os.getpid()
+        self._connection().execute(
+            """
+            CREATE TABLE IF NOT EXISTS daily_usage (
+                limit_key TEXT NOT NULL,
+                day TEXT NOT NULL,
+                requests INTEGER NOT NULL,
+                tokens INTEGER NOT NULL,
+                cost_usd REAL NOT NULL,
+                PRIMARY KEY (limit_key, day)
+            )
+            """
+        )
+
+    @classmethod
+    @functools.cache
+    def default(cls) -> DailyQuotaStore:
+        """Return the store shared by limits that were not given one."""
+        return cls(DEFAULT_DAILY_QUOTA_PATH)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, reopening it after a fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _read(self, key: str, day: str) -> DailyUsage:
+        query = "SELECT requests, tokens, cost_usd FROM daily_usage WHERE limit_key = ? AND day = ?"
+        row = self._connection().execute(query, (key, day)).fetchone()
+        return DailyUsage(*row) if row else DailyUsage()
+
+    def usage(self, key: str, day: str) -> DailyUsage:
+        """Return the usage for *key* on *day*, including increments not yet written."""
+        with self._lock:
+            stored = self._stored.get((key, day))
+        if stored is None:
+            stored = self._read(key, day)
+        with self._lock:
+            stored = self._stored.setdefault((key, day), stored)
+            return _combine(
+                stored, self._flushing.get((key, day), DailyUsage()), self._pending.get((key, day), DailyUsage())
+            )
+
+    def add(self, key: str, day: str, requests: int, tokens: int, cost_usd: float) -> DailyUsage:
+        """Buffer an increment to the usage for *key* on *day* and return the new totals."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # The parent process still owns whatever it had buffered
+                self._pending, self._flushing, self._flusher, self._pid = {}, {}, None, os.getpid()
+            increment = DailyUsage(requests, tokens, cost_usd)
+            self._pending[key, day] = _combine(self._pending.get((key, day), DailyUsage()), increment)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, name="daily-quota-flush", daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+        return self.usage(key, day)
+
+    def _flush_periodically(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered increments to the database and refresh the stored totals."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._flushing, self._pending = self._pending, {}
+            stored = {}
+            conn = self._connection()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for (key, day), usage in self._flushing.items():
+                    row = conn.execute(
+                        """
+                        INSERT INTO daily_usage (limit_key, day, requests, tokens, cost_usd) VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (limit_key, day) DO UPDATE SET
+                            requests = requests + excluded.requests,
+                            tokens = tokens + excluded.tokens,
+                            cost_usd = cost_usd + excluded.cost_usd
+                        RETURNING requests, tokens, cost_usd
+                        """,
+                        (key, day, *usage),
+                    ).fetchone()
+                    stored[key, day] = DailyUsage(*row)
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                logger.warning("Could not write daily quota usage to %s; will retry", self.path, exc_info=True)
+                with self._lock:
+                    for key, usage in self._flushing.items():
+                        self._pending[key] = _combine(usage, self._pending.get(key, DailyUsage()))
+                    self._flushing = {}
+                return
+            with self._lock:
+                self._stored.update(stored)
+                self._flushing = {}
+
+    def close(self) -> None:
+        """Stop the background writer and flush what is left."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
@@ -0,0 +1,504 @@
+"""
+Network-shared rate limiting.
+
+``LimiterServer`` holds a :class:`~bulkllm.rate_limiter.RateLimiter` and
+serves reservations to any number of machines over TCP or a Unix socket
+(``bulkllm limiter-server``).  ``LimiterClient`` is the matching asyncio client:
+
+    async with LimiterClient(host="limiter.internal", port=8765) as client:
+        async with await client.reserve_capacity("openai/gpt-4o", 100, 200) as ctx:
+            ...
+            await ctx.record_usage(input_tokens, output_tokens)
+
+Protocol
+--------
+Newline-delimited JSON.  Each line holds one message object or a JSON array
+of them (a batch).  Messages carrying an ``"id"`` get a reply with the same
+``id``; messages without one are fire-and-forget.  Replies may arrive out of
+order, so clients can pipeline as many requests as they like.
+
+* ``{"op": "reserve", "model", "input_tokens", "output_tokens", "count", "priority", "lease_ttl"}``
+  waits for one reservation, then grabs up to ``count - 1`` more that fit
+  right now, up to the server's lease cap; replies ``{"request_ids": [...]}``.
+* ``{"op": "claim", "request_id"}`` marks a leased reservation as in use.
+* ``{"op": "record", "request_id", "input_tokens", "output_tokens", "cached_hit", "cost_usd"}``
+* ``{"op": "cancel", "request_id"}``
+* ``{"op": "status", "model"}`` replies with the model's window usage, after
+  expiring requests that aged out of the window.
+
+A request that fails gets ``{"error": message, "error_type": name}``; the
+client re-raises :class:`~bulkllm.rate_limiter.DailyQuotaExceededError` as
+itself and everything else as :class:`LimiterServerError`.
+
+The extra reservations returned by ``reserve`` are held by the client as
+local *leases*: later requests for the same model that fit inside a leased
+estimate are served without a round trip, sending a fire-and-forget
+``claim``.  The server cancels any lease not claimed within ``lease_ttl``
+seconds (plus ``LEASE_GRACE_SECONDS`` for messages still in transit), so an
+idle client does not hold capacity, and everything a connection still holds
+is cancelled when it disconnects.  A single ``reserve`` never leases more
+than ``lease_fraction`` of the tightest limit it touches, so one busy client
+cannot crowd out the others.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Self
+
+from bulkllm.rate_limiter import (
+    DailyQuotaExceededError,
+    ModelRateLimit,
+    RateLimitChain,
+    RateLimitContext,
+    RateLimiter,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+LEASE_GRACE_SECONDS = 1.0
+DEFAULT_LEASE_FRACTION = 0.1
+
+
+class LimiterServerError(RuntimeError):
+    """Raised by the client when the server rejects a request."""
+
+
+# ---------------------------------------------------------------------------
+# Server
+# ---------------------------------------------------------------------------
+
+
+class LimiterServer:
+    """Serve :class:`RateLimiter` reservations to remote clients."""
+
+    def __init__(self, rate_limiter: RateLimiter | None = None, *, lease_fraction: float = DEFAULT_LEASE_FRACTION):
+        """Wrap *rate_limiter* (default limits if omitted), leasing at most *lease_fraction* of a limit at once."""
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.lease_fraction = lease_fraction
+        # request id -> limit it was reserved against
+        self._owners: dict[int, ModelRateLimit | RateLimitChain] = {}
+        # request id -> timer that cancels the lease unless it is claimed first
+        self._lease_timers: dict[int, asyncio.TimerHandle] = {}
+        self._expiring: set[asyncio.Task] = set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT, path: str | None = None):
+        """Start listening on *path* (Unix socket) or *host*:*port* and return the ``asyncio.Server``."""
+        if path is not None:
+            return await asyncio.start_unix_server(self._handle_connection, path=path)
+        return await asyncio.start_server(self._handle_connection, host=host, port=port)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        owned: set[int] = set()
+        tasks: set[asyncio.Task] = set()
+
+        def send(reply: dict[str, Any]) -> None:
+            writer.write(json.dumps(reply).encode() + b"\n")
+
+        try:
+            while line := await reader.readline():
+                try:
+                    payload = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Ignoring malformed limiter message: %r", line[:100])
+                    continue
+                for message in payload if isinstance(payload, list) else [payload]:
+                    if not isinstance(message, dict):
+                        logger.warning("Ignoring malformed limiter message: %r", message)
+                        continue
+                    task = asyncio.create_task(self._dispatch(message, owned, send), name=str(message.get("op")))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            logger.debug("Limiter client disconnected")
+        finally:
+            # Reservations may wait indefinitely; records and cancels are left to finish.
+            for task in tasks:
+                if task.get_name() == "reserve":
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for request_id in list(owned):
+                await self._cancel(request_id, owned)
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _dispatch(self, message: dict[str, Any], owned: set[int], send) -> None:
+        try:
+            reply = await self._handle(message, owned)
+        except (DailyQuotaExceededError, KeyError, TypeError, ValueError) as e:
+            reply = {"error": str(e), "error_type": type(e).__name__}
+        except Exception as e:
+            # Anything else still gets a reply so the client is not left waiting
+            logger.exception("Limiter request %r failed", message.get("op"))
+            reply = {"error": str(e), "error_type": type(e).__name__}
+        if "id" in message:
+            send({"id": message["id"], **reply})
+
+    async def _handle(self, message: dict[str, Any], owned: set[int]) -> dict[str, Any]:
+        op = message["op"]
+        if op == "reserve":
+            limit = self.rate_limiter.get_limiter_for_model(message["model"])
+            in_tok, out_tok = int(message["input_tokens"]), int(message["output_tokens"])
+            request_ids = [await limit.acquire_blocking(in_tok, out_tok, int(message.get("priority", 0)))]
+            self._track(request_ids[0], limit, owned)
+            for _ in range(min(int(message.get("count", 1)) - 1, self._lease_cap(limit, in_tok, out_tok))):
+                try:
+                    request_id = await limit.acquire(in_tok, out_tok)
+                except DailyQuotaExceededError:
+                    break
+                if request_id is None:
+                    break
+                self._track(request_id, limit, owned)
+                request_ids.append(request_id)
+            if len(request_ids) > 1:
+                delay = float(message.get("lease_ttl", 5.0)) + LEASE_GRACE_SECONDS
+                loop = asyncio.get_running_loop()
+                for request_id in request_ids[1:]:
+                    self._lease_timers[request_id] = loop.call_later(delay, self._expire_lease, request_id, owned)
+            return {"request_ids": request_ids}
+        if op == "claim":
+            self._stop_lease_timer(message["request_id"])
+            return {}
+        if op == "record":
+            request_id = message["request_id"]
+            owned.discard(request_id)
+            self._stop_lease_timer(request_id)
+            if (limit := self._owners.pop(request_id, None)) is not None:
+                await limit.record_actual_usage(
+                    request_id,
+                    int(message["input_tokens"]),
+                    int(message["output_tokens"]),
+                    cached_hit=bool(message.get("cached_hit", False)),
+                    cost_usd=float(message.get("cost_usd", 0.0)),
+                )
+            return {}
+        if op == "cancel":
+            await self._cancel(message["request_id"], owned)
+            return {}
+        if op == "status":
+            usage = await self.rate_limiter.get_rate_limit_for_model(message["model"]).window_usage()
+            return usage._asdict()
+        msg = f"Unknown op {op!r}"
+        raise ValueError(msg)
+
+    def _lease_cap(self, limit: ModelRateLimit | RateLimitChain, in_tok: int, out_tok: int) -> int:
+        """Return how many extra reservations fit in ``lease_fraction`` of every limit on *limit*'s levels."""
+        cap = sys.maxsize
+        for level in limit.limits if isinstance(limit, RateLimitChain) else [limit]:
+            for allowed, per_request in (
+                (level.rpm, 1),
+                (level.max_concurrency, 1),
+                (level.itpm, in_tok),
+                (level.otpm, out_tok),
+                (level.tpm, in_tok + out_tok),
+            ):
+                if allowed and per_request:
+                    cap = min(cap, int(allowed * self.lease_fraction) // per_request)
+        return cap
+
+    def _track(self, request_id: int, limit: ModelRateLimit | RateLimitChain, owned: set[int]) -> None:
+        self._owners[request_id] = limit
+        owned.add(request_id)
+
+    def _stop_lease_timer(self, request_id: int) -> None:
+        if (timer := self._lease_timers.pop(request_id, None)) is not None:
+            timer.cancel()
+
+    def _expire_lease(self, request_id: int, owned: set[int]) -> None:
+        self._lease_timers.pop(request_id, None)
+        task = asyncio.create_task(self._cancel(request_id, owned))
+        self._expiring.add(task)
+        task.add_done_callback(self._expiring.discard)
+
+    async def _cancel(self, request_id: int, owned: set[int]) -> None:
+        owned.discard(request_id)
+        self._stop_lease_timer(request_id)
+        if (limit := self._owners.pop(request_id, None)) is not None:
+            await limit._cancel_pending(request_id)
+
+
+async def serve(host: str = "127.0.0.1", port: int = DEFAULT_PORT, path: str | None = None) -> None:
+    """Run a :class:`LimiterServer` with the default rate limits until cancelled."""
+    server = await LimiterServer().start(host=host, port=port, path=path)
+    async with server:
+        await server.serve_forever()
+
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+
+@dataclass(slots=True)
+class Lease:
+    """A reservation held by the client for a future request."""
+
+    request_id: int
+    input_tokens: int
+    output_tokens: int
+    expires_at: float
+
+
+class LimiterClient:
+    """Pipelining asyncio client for :class:`LimiterServer`."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = DEFAULT_PORT,
+        *,
+        path: str | None = None,
+        lease_size: int = 8,
+        lease_ttl: float = 5.0,
+    ):
+        """Configure the server address and leasing behaviour (``lease_size=1`` disables leases)."""
+        self.host = host
+        self.port = port
+        self.path = path
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+        self.round_trips = 0
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._reader_task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._ids = itertools.count()
+        self._futures: dict[int, asyncio.Future] = {}
+        self._outbox: list[dict[str, Any]] = []
+        self._limits: dict[str, RemoteModelRateLimit] = {}
+
+    # ----------------------------- lifecycle ------------------------------ #
+    async def connect(self) -> None:
+        """Open the connection to the server."""
+        if self.path is not None:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._loop = asyncio.get_running_loop()
+        self._reader_task = asyncio.create_task(self._read_replies())
+
+    async def aclose(self) -> None:
+        """Return unused leases and close the connection."""
+        for limit in self._limits.values():
+            limit._release_leases()
+        self._flush()
+        if self._writer is not None:
+            await self._writer.drain()
+            self._writer.close()
+            with contextlib.suppress(ConnectionError):
+                await self._writer.wait_closed()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._reader_task
+
+    async def __aenter__(self) -> Self:
+        """Connect on entering the context."""
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        """Close on leaving the context."""
+        await self.aclose()
+
+    # ----------------------------- messaging ------------------------------ #
+    def _send_nowait(self, message: dict[str, Any]) -> None:
+        """Queue *message*; everything queued in the same loop iteration is sent as one batch."""
+        if not self._outbox:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._outbox.append(message)
+
+    def _connected_loop(self) -> asyncio.AbstractEventLoop:
+        """Return the client's event loop, raising if the client is not connected."""
+        if self._loop is None or self._loop.is_closed():
+            msg = "LimiterClient is not connected"
+            raise LimiterServerError(msg)
+        return self._loop
+
+    def _on_own_loop(self) -> bool:
+        """Return True when called from the thread running the client's event loop."""
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def _send_threadsafe(self, message: dict[str, Any]) -> None:
+        """Queue *message* from any thread, handing it to the client's event loop if needed."""
+        loop = self._connected_loop()
+        if self._on_own_loop():
+            self._send_nowait(message)
+        else:
+            loop.call_soon_threadsafe(self._send_nowait, message)
+
+    def _flush(self) -> None:
+        if not self._outbox or self._writer is None:
+            return
+        batch, self._outbox = self._outbox, []
+        self._writer.write(json.dumps(batch if len(batch) > 1 else batch[0]).encode() + b"\n")
+
+    async def _call(self, message: dict[str, Any]) -> dict[str, Any]:
+        """Send *message* and wait for its reply."""
+        message_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._futures[message_id] = future
+        self.round_trips += 1
+        self._send_nowait({"id": message_id, **message})
+        reply = await future
+        if "error" in reply:
+            if reply.get("error_type") == DailyQuotaExceededError.__name__:
+                raise DailyQuotaExceededError(reply["error"])
+            msg = f"{reply.get('error_type', 'Error')}: {reply['error']}"
+            raise LimiterServerError(msg)
+        return reply
+
+    async def _read_replies(self) -> None:
+        try:
+            while line := await self._reader.readline():
+                reply = json.loads(line)
+                if (future := self._futures.pop(reply.get("id"), None)) is not None and not future.done():
+                    future.set_result(reply)
+        finally:
+            error = LimiterServerError("Connection to limiter server closed")
+            for future in self._futures.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._futures.clear()
+
+    # ----------------------------- public API ----------------------------- #
+    def get_rate_limit_for_model(self, model_name: str) -> RemoteModelRateLimit:
+        """Return the remote limit handle for *model_name*."""
+        if model_name not in self._limits:
+            self._limits[model_name] = RemoteModelRateLimit(self, model_name)
+        return self._limits[model_name]
+
+    async def reserve_capacity(
+        self, model_name: str, input_tokens: int, output_tokens: int, priority: int = 0
+    ) -> RateLimitContext:
+        """Reserve capacity on the server, mirroring :meth:`RateLimiter.reserve_capacity`."""
+        return await self.get_rate_limit_for_model(model_name).reserve_capacity(input_tokens, output_tokens, priority)
+
+    def reserve_capacity_sync(
+        self, model_name: str, input_tokens: int, output_tokens: int, priority: int = 0
+    ) -> RateLimitContext:
+        """Blocking version of :meth:`reserve_capacity`, mirroring :meth:`RateLimiter.reserve_capacity_sync`."""
+        return self.get_rate_limit_for_model(model_name).reserve_capacity_sync(input_tokens, output_tokens, priority)
+
+    async def status(self, model_name: str) -> dict[str, int]:
+        """Return the server-side window usage for *model_name*."""
+        reply = await self._call({"op": "status", "model": model_name})
+        reply.pop("id")
+        return reply
+
+
+class RemoteModelRateLimit:
+    """
+    Client-side stand-in for a :class:`ModelRateLimit` living on the server.
+
+    Implements the methods :class:`RateLimitContext` relies on.  Sync code in
+    any thread other than the client's event loop can reserve with
+    :meth:`reserve_capacity_sync`, and a context can be recorded or cancelled
+    from any thread: those messages are fire-and-forget and are handed to the
+    client's event loop.
+    """
+
+    def __init__(self, client: LimiterClient, model_name: str):
+        """Bind to *client* for *model_name*."""
+        self._client = client
+        self.model_name = model_name
+        self._leases: list[Lease] = []
+        self._outstanding: set[int] = set()
+
+    def _take_lease(self, input_tokens: int, output_tokens: int) -> int | None:
+        now = time.monotonic()
+        for lease in [lease for lease in self._leases if lease.expires_at <= now]:
+            self._leases.remove(lease)
+            self._client._send_nowait({"op": "cancel", "request_id": lease.request_id})
+        for i, lease in enumerate(self._leases):
+            if lease.input_tokens >= input_tokens and lease.output_tokens >= output_tokens:
+                request_id = self._leases.pop(i).request_id
+                self._client._send_nowait({"op": "claim", "request_id": request_id})
+                return request_id
+        return None
+
+    def _release_leases(self) -> None:
+        for lease in self._leases:
+            self._client._send_nowait({"op": "cancel", "request_id": lease.request_id})
+        self._leases.clear()
+
+    async def reserve_capacity(self, est_in: int, est_out: int, priority: int = 0) -> RateLimitContext:
+        """Use a matching lease if one is held, otherwise reserve a new chunk from the server."""
+        request_id = self._take_lease(est_in, est_out)
+        if request_id is None:
+            # Measured from before the request, so the client's leases lapse before the server's timers
+            expires_at = time.monotonic() + self._client.lease_ttl
+            reply = await self._client._call(
+                {
+                    "op": "reserve",
+                    "model": self.model_name,
+                    "input_tokens": est_in,
+                    "output_tokens": est_out,
+                    "count": self._client.lease_size,
+                    "priority": priority,
+                    "lease_ttl": self._client.lease_ttl,
+                }
+            )
+            request_id, *extra = reply["request_ids"]
+            self._leases.extend(Lease(extra_id, est_in, est_out, expires_at) for extra_id in extra)
+        self._outstanding.add(request_id)
+        return RateLimitContext(self, request_id)  # type: ignore[arg-type]
+
+    def reserve_capacity_sync(self, est_in: int, est_out: int, priority: int = 0) -> RateLimitContext:
+        """
+        Blocking version of :meth:`reserve_capacity`.
+
+        The reservation runs on the client's event loop, so this cannot be
+        called from that loop's own thread; ``await`` :meth:`reserve_capacity`
+        there instead.
+        """
+        loop = self._client._connected_loop()
+        if self._client._on_own_loop():
+            msg = "reserve_capacity_sync would block the LimiterClient's own event loop; await reserve_capacity instead"
+            raise LimiterServerError(msg)
+        return asyncio.run_coroutine_threadsafe(self.reserve_capacity(est_in, est_out, priority), loop).result()
+
+    async def record_actual_usage(
+        self, request_id: int, input_tokens: int, output_tokens: int, cached_hit: bool = False, cost_usd: float = 0.0
+    ) -> None:
+        """Send the actual usage without waiting for a reply."""
+        self.record_actual_usage_sync(request_id, input_tokens, output_tokens, cached_hit, cost_usd)
+
+    async def _cancel_pending(self, request_id: int) -> None:
+        """Cancel a reservation that was handed out but never recorded."""
+        self._cancel_pending_sync(request_id)
+
+    def record_actual_usage_sync(
+        self, request_id: int, input_tokens: int, output_tokens: int, cached_hit: bool = False, cost_usd: float = 0.0
+    ) -> None:
+        """Sync version of :meth:`record_actual_usage`, callable from any thread."""
+        self._outstanding.discard(request_id)
+        self._client._send_threadsafe(
+            {
+                "op": "record",
+                "request_id": request_id,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "cached_hit": cached_hit,
+                "cost_usd": cost_usd,
+            }
+        )
+
+    def _cancel_pending_sync(self, request_id: int) -> None:
+        """Sync version of :meth:`_cancel_pending`, callable from any thread."""
+        if request_id in self._outstanding:
+            self._outstanding.discard(request_id)
+            self._client._send_threadsafe({"op": "cancel", "request_id": request_id})
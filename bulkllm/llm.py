@@ -1,18 +1,26 @@
+import concurrent.futures
 import functools
 import inspect
 import logging
 import os
+import threading
 import time
 from asyncio import CancelledError
 from pathlib import Path
 
+import anyio
+import anyio.lowlevel
 import litellm
 import litellm.exceptions
 import tenacity
 from litellm.cost_calculator import completion_cost
+from litellm.utils import convert_to_model_response_object
 
-from bulkllm.rate_limiter import RateLimiter
-from bulkllm.usage_tracker import convert_litellm_usage_to_usage_record, track_usage
+from bulkllm.output_estimator import OutputTokenEstimator
+from bulkllm.rate_limiter import RateLimitContext, RateLimiter
+from bulkllm.response_cache import ShardedSQLiteCache, TieredCache
+from bulkllm.stream_stats import UsageStat
+from bulkllm.usage_tracker import UsageRecord, convert_litellm_usage_to_usage_record, track_usage
 
 logger = logging.getLogger(__name__)
 
@@ -59,6 +67,15 @@ def _scrubbing_callback(m):
         return m.value
 
 
+def _legacy_disk_cache():
+    """Return the diskcache store earlier versions wrote to ``CACHE_PATH``, if there is one."""
+    if not (CACHE_PATH / "cache.db").exists():
+        return None
+    from litellm.caching.disk_cache import DiskCache
+
+    return DiskCache(disk_cache_dir=str(CACHE_PATH))
+
+
 @functools.lru_cache
 def initialize_litellm(enable_logfire=False):
     """Initialise LiteLLM and optional Logfire instrumentation."""
@@ -83,8 +100,8 @@ def initialize_litellm(enable_logfire=False):
         # litellm.failure_callback = ["logfire"]
         litellm.callbacks = ["logfire"]
 
-    disk_cache_dir = CACHE_PATH
-    litellm.cache = litellm.Cache(type="disk", disk_cache_dir=disk_cache_dir)  # type: ignore
+    litellm.cache = litellm.Cache(type="local")  # type: ignore
+    litellm.cache.cache = TieredCache(ShardedSQLiteCache(CACHE_PATH / "responses", fallback=_legacy_disk_cache()))
     litellm.enable_cache()
     litellm.suppress_debug_info = True
 
@@ -96,8 +113,27 @@ def rate_limiter() -> RateLimiter:
     return RateLimiter()
 
 
-def _estimate_tokens(bound_args):
-    """Estimate input and output token counts from bound args."""
+@functools.cache
+def output_estimator() -> OutputTokenEstimator:
+    """Return the process-wide estimator of output tokens to reserve."""
+    return OutputTokenEstimator()
+
+
+# Coalesced acompletion calls in flight, keyed by event loop token and cache key
+_in_flight: dict[tuple[anyio.lowlevel.EventLoopToken, str], "_Flight"] = {}
+# Leader futures of coalesced completion calls from threads, keyed by cache key
+_in_flight_sync: dict[str, concurrent.futures.Future] = {}
+_in_flight_sync_lock = threading.Lock()
+_ABANDONED = object()
+
+
+def _estimate_tokens(bound_args, estimate_key: str | None = None):
+    """
+    Estimate input and output token counts from bound args.
+
+    Output is estimated from the lengths observed for *estimate_key* (e.g. an
+    LLMConfig slug) or the model, capped at the request's max tokens.
+    """
     model_name = bound_args.get("model")
     if model_name is None:
         msg = "Model name must be supplied as first positional arg or 'model' kwarg."
@@ -109,11 +145,87 @@ def _estimate_tokens(bound_args):
     else:
         input_tokens = litellm.token_counter(model=model_name, messages=messages)
 
-    max_completion = bound_args.get("max_completion_tokens") or bound_args.get("max_tokens") or 1
-    output_tokens = max_completion
+    max_completion = bound_args.get("max_completion_tokens") or bound_args.get("max_tokens")
+    output_tokens = output_estimator().estimate(max_completion, estimate_key, model_name)
     return input_tokens, output_tokens, model_name
 
 
+def _call_kwargs(args: tuple, kwargs: dict) -> dict:
+    """Return the arguments of a ``litellm.completion`` call as one dict of keyword arguments."""
+    arguments = inspect.signature(litellm.completion).bind_partial(*args, **kwargs).arguments
+    extra = arguments.pop("kwargs", {})
+    return {**arguments, **extra}
+
+
+def _cache_lookup_allowed(call_kwargs: dict, call_type: str) -> bool:
+    """True if the response cache may answer this *call_type* call before it is rate limited."""
+    cache = litellm.cache
+    cache_control = call_kwargs.get("cache") or {}
+    return (
+        cache is not None
+        and call_type in cache.supported_call_types
+        and call_kwargs.get("model") is not None
+        and call_kwargs.get("caching") is not False
+        and not call_kwargs.get("stream")
+        and not cache_control.get("no-cache")
+    )
+
+
+def _skip_cache_read(kwargs: dict) -> dict:
+    """Return *kwargs* telling LiteLLM not to read the cache again after a checked miss; it still writes."""
+    return {**kwargs, "cache": {**(kwargs.get("cache") or {}), "no-cache": True}}
+
+
+def _cached_response(cached_result) -> litellm.ModelResponse | None:
+    """Convert a result read from the response cache into a response marked as a cache hit."""
+    if not isinstance(cached_result, dict):
+        return None
+    response = convert_to_model_response_object(
+        response_object=cached_result, model_response_object=litellm.ModelResponse()
+    )
+    response.is_cached_hit = True  # type: ignore[attr-defined]
+    return response
+
+
+def _track_cached_hit(response, model_name: str, duration_ms: float):
+    """Track a response served from the cache without entering the rate limiter."""
+    usage_record = convert_litellm_usage_to_usage_record(
+        litellm_usage=getattr(response, "usage", {}) or {},
+        model=model_name,
+        time_ms=duration_ms,
+        cost_usd=_response_cost(response, model_name),
+        is_cached_hit=True,
+    )
+    track_usage(model=model_name, record=usage_record)
+    response.standardized_usage = usage_record
+    return response
+
+
+def _response_headers(response) -> dict:
+    """Return the provider response headers LiteLLM attached to *response*."""
+    return (getattr(response, "_hidden_params", {}) or {}).get("additional_headers") or {}
+
+
+def _response_cost(response, model_name: str) -> float:
+    """Return the USD cost LiteLLM reported for *response*, computing it if missing."""
+    cost_usd = getattr(response, "_hidden_params", {}).get("response_cost", None)
+    if cost_usd is None:
+        response.model = model_name
+        try:
+            cost_usd = completion_cost(completion_response=response)
+        except Exception:  # noqa - best effort for mocks
+            cost_usd = 0.0
+    return cost_usd
+
+
+def _error_headers(exception) -> dict:
+    """Return the provider response headers carried by a LiteLLM exception."""
+    headers = getattr(exception, "litellm_response_headers", None)
+    if headers is None:
+        headers = getattr(getattr(exception, "response", None), "headers", None)
+    return dict(headers or {})
+
+
 @functools.wraps(litellm.acompletion)
 async def acompletion(*args, retry_cfg: dict | None = None, **kwargs):
     """
@@ -123,6 +235,16 @@ async def acompletion(*args, retry_cfg: dict | None = None, **kwargs):
     ----------
     retry_cfg : dict | None
         Tenacity config (stop, wait, retry …).  Uses _DEFAULT_RETRY_CFG if None.
+    estimate_key : str | None
+        Key (e.g. an LLMConfig slug) under which output lengths are learned
+        to size rate-limit reservations; the model name is always used too.
+    coalesce : bool | None
+        Share one in-flight call among concurrent identical requests (same
+        cache key); each follower gets its own copy of the response, marked
+        as a cache hit.  By default only deterministic requests
+        (``temperature`` 0 or unset) coalesce; pass ``False`` to opt out or
+        ``True`` to coalesce sampled requests too.  Requests that bypass the
+        cache never coalesce.
     """
     retry_cfg = retry_cfg or _DEFAULT_RETRY_CFG
     retrying = tenacity.AsyncRetrying(**retry_cfg)
@@ -138,12 +260,87 @@ async def acompletion(*args, retry_cfg: dict | None = None, **kwargs):
 
 
 @functools.wraps(litellm.acompletion)
-async def _acompletion(*args, **kwargs):
-    """Asynchronous wrapper with rate limiting via global RateLimiter."""
+async def _acompletion(*args, estimate_key: str | None = None, coalesce: bool | None = None, **kwargs):
+    """
+    Asynchronous wrapper with rate limiting via global RateLimiter.
+
+    The response cache is consulted first, so cache hits return without
+    waiting for rate-limit capacity; only misses reserve it.  Concurrent
+    misses for the same cache key share one call; see :func:`_should_coalesce`.
+    """
     initialize_litellm()
-    bound_args = inspect.signature(litellm.completion).bind_partial(*args, **kwargs).arguments
-    input_tokens, output_tokens, model_name = _estimate_tokens(bound_args)
-    # kwargs["cache"] = {"no-cache": True}
+    call_kwargs = _call_kwargs(args, kwargs)
+    if not _cache_lookup_allowed(call_kwargs, "acompletion"):
+        return await _acompletion_uncached(args, kwargs, call_kwargs, estimate_key)
+    start_ms = time.monotonic()
+    if (response := _cached_response(await litellm.cache.async_get_cache(**call_kwargs))) is not None:
+        return _track_cached_hit(response, call_kwargs["model"], (time.monotonic() - start_ms) * 1000)
+    kwargs = _skip_cache_read(kwargs)
+    if not _should_coalesce(coalesce, call_kwargs):
+        return await _acompletion_uncached(args, kwargs, call_kwargs, estimate_key)
+    return await _coalesced(
+        litellm.cache.get_cache_key(**call_kwargs),
+        functools.partial(_acompletion_uncached, args, kwargs, call_kwargs, estimate_key),
+        call_kwargs["model"],
+        start_ms,
+    )
+
+
+def _should_coalesce(coalesce: bool | None, call_kwargs: dict) -> bool:
+    """Return *coalesce*, defaulting to True only for deterministic (``temperature`` 0 or unset) requests."""
+    if coalesce is None:
+        return call_kwargs.get("temperature") in (0, None)
+    return coalesce
+
+
+def _follower_hit(response, model_name: str, start_ms: float):
+    """Track and return a copy of a leader's *response* for a coalesced follower, as a cache hit."""
+    response = response.model_copy(deep=True)
+    response.is_cached_hit = True
+    return _track_cached_hit(response, model_name, (time.monotonic() - start_ms) * 1000)
+
+
+class _Flight:
+    """A coalesced call in flight; followers wait on ``done`` for its response or error."""
+
+    __slots__ = ("done", "error", "response")
+
+    def __init__(self):
+        self.done = anyio.Event()
+        self.response = _ABANDONED
+        self.error: Exception | None = None
+
+
+async def _coalesced(cache_key: str, call, model_name: str, start_ms: float):
+    """
+    Await *call* once for all concurrent callers with the same *cache_key*.
+
+    The first caller leads and makes the call; callers arriving while it is in
+    flight follow, receiving a copy of its response (tracked as a cache hit)
+    or its exception.  If the leader is cancelled, a follower takes over.
+    """
+    flight_key = (anyio.lowlevel.current_token(), cache_key)
+    while (flight := _in_flight.get(flight_key)) is not None:
+        await flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        if flight.response is not _ABANDONED:
+            return _follower_hit(flight.response, model_name, start_ms)
+    flight = _in_flight[flight_key] = _Flight()
+    try:
+        flight.response = await call()
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        del _in_flight[flight_key]
+        flight.done.set()
+    return flight.response
+
+
+async def _acompletion_uncached(args: tuple, kwargs: dict, call_kwargs: dict, estimate_key: str | None):
+    """Reserve capacity, call ``litellm.acompletion`` and record the usage."""
+    input_tokens, output_tokens, model_name = _estimate_tokens(call_kwargs, estimate_key)
 
     async with await rate_limiter().reserve_capacity(model_name, input_tokens, output_tokens) as ctx:
         start_ms = time.monotonic()
@@ -151,6 +348,8 @@ async def _acompletion(*args, **kwargs):
             response = await litellm.acompletion(*args, **kwargs)
         except Exception as e:
             e.bulkllm_model_name = model_name  # type: ignore[attr-defined]
+            if isinstance(e, litellm.exceptions.RateLimitError):
+                await rate_limiter().record_rate_limit_error(model_name, _error_headers(e))
             raise
 
         duration_ms = (time.monotonic() - start_ms) * 1000
@@ -159,19 +358,16 @@ async def _acompletion(*args, **kwargs):
         cached_hit = getattr(response, "is_cached_hit", False)
         prompt_tokens = usage.get("prompt_tokens", 0)
         completion_tokens = usage.get("completion_tokens", 0)
+        cost_usd = _response_cost(response, model_name)
 
         await ctx.record_usage(
             prompt_tokens,
             completion_tokens,
             cached_hit=cached_hit,
+            cost_usd=cost_usd,
         )
-    cost_usd = getattr(response, "_hidden_params", {}).get("response_cost", None)
-    if cost_usd is None:
-        response.model = model_name
-        try:
-            cost_usd = completion_cost(completion_response=response)
-        except Exception:  # noqa - best effort for mocks
-            cost_usd = 0.0
+        if not cached_hit:
+            await rate_limiter().update_from_headers(model_name, _response_headers(response))
 
     usage_record = convert_litellm_usage_to_usage_record(
         litellm_usage=usage,
@@ -185,6 +381,7 @@ async def _acompletion(*args, **kwargs):
         model=model_name,
         record=usage_record,
     )
+    output_estimator().observe_record(usage_record, estimate_key, model_name)
 
     response.is_cached_hit = cached_hit
     response.standardized_usage = usage_record
@@ -192,11 +389,58 @@ async def _acompletion(*args, **kwargs):
 
 
 @functools.wraps(litellm.completion)
-def _completion(*args, **kwargs):
-    """Synchronous wrapper with rate limiting via global RateLimiter."""
+def _completion(*args, estimate_key: str | None = None, coalesce: bool | None = None, **kwargs):
+    """
+    Synchronous wrapper with rate limiting via global RateLimiter; cache hits skip the limiter.
+
+    Concurrent misses for the same cache key from other threads share one
+    call, as in :func:`_acompletion`.
+    """
     initialize_litellm()
-    bound = inspect.signature(litellm.completion).bind_partial(*args, **kwargs)
-    input_tokens, output_tokens, model_name = _estimate_tokens(bound.arguments)
+    call_kwargs = _call_kwargs(args, kwargs)
+    if not _cache_lookup_allowed(call_kwargs, "completion"):
+        return _completion_uncached(args, kwargs, call_kwargs, estimate_key)
+    start_ms = time.monotonic()
+    if (response := _cached_response(litellm.cache.get_cache(**call_kwargs))) is not None:
+        return _track_cached_hit(response, call_kwargs["model"], (time.monotonic() - start_ms) * 1000)
+    kwargs = _skip_cache_read(kwargs)
+    if not _should_coalesce(coalesce, call_kwargs):
+        return _completion_uncached(args, kwargs, call_kwargs, estimate_key)
+    return _coalesced_sync(
+        litellm.cache.get_cache_key(**call_kwargs),
+        functools.partial(_completion_uncached, args, kwargs, call_kwargs, estimate_key),
+        call_kwargs["model"],
+        start_ms,
+    )
+
+
+def _coalesced_sync(cache_key: str, call, model_name: str, start_ms: float):
+    """Thread-safe version of :func:`_coalesced` for :func:`_completion`."""
+    while True:
+        with _in_flight_sync_lock:
+            if (flight := _in_flight_sync.get(cache_key)) is None:
+                flight = _in_flight_sync[cache_key] = concurrent.futures.Future()
+                break
+        if (response := flight.result()) is not _ABANDONED:
+            return _follower_hit(response, model_name, start_ms)
+    try:
+        response = call()
+    except Exception as e:
+        flight.set_exception(e)
+        raise
+    except BaseException:
+        flight.set_result(_ABANDONED)
+        raise
+    finally:
+        with _in_flight_sync_lock:
+            del _in_flight_sync[cache_key]
+    flight.set_result(response)
+    return response
+
+
+def _completion_uncached(args: tuple, kwargs: dict, call_kwargs: dict, estimate_key: str | None):
+    """Reserve capacity, call ``litellm.completion`` and record the usage."""
+    input_tokens, output_tokens, model_name = _estimate_tokens(call_kwargs, estimate_key)
 
     with rate_limiter().reserve_capacity_sync(model_name, input_tokens, output_tokens) as ctx:
         start_ms = time.monotonic()
@@ -204,6 +448,8 @@ def _completion(*args, **kwargs):
             response = litellm.completion(*args, **kwargs)
         except Exception as e:
             logger.error(f"Failed to complete request for model '{model_name}': {e}")
+            if isinstance(e, litellm.exceptions.RateLimitError):
+                rate_limiter().record_rate_limit_error_sync(model_name, _error_headers(e))
             raise
 
         duration_ms = (time.monotonic() - start_ms) * 1000
@@ -212,19 +458,17 @@ def _completion(*args, **kwargs):
         cached_hit = getattr(response, "is_cached_hit", False)
         prompt_tokens = usage.get("prompt_tokens", 0)
         completion_tokens = usage.get("completion_tokens", 0)
+        cost_usd = _response_cost(response, model_name)
 
         ctx.record_usage_sync(
             prompt_tokens,
             completion_tokens,
             cached_hit=cached_hit,
+            cost_usd=cost_usd,
         )
-    cost_usd = getattr(response, "_hidden_params", {}).get("response_cost", None)
-    if cost_usd is None:
-        response.model = model_name
-        try:
-            cost_usd = completion_cost(completion_response=response)
-        except Exception:  # noqa - best effort for mocks
-            cost_usd = 0.0
+        if not cached_hit:
+            rate_limiter().update_from_headers_sync(model_name, _response_headers(response))
+
     usage_record = convert_litellm_usage_to_usage_record(
         litellm_usage=usage,
         model=model_name,
@@ -237,6 +481,7 @@ def _completion(*args, **kwargs):
         model=model_name,
         record=usage_record,
     )
+    output_estimator().observe_record(usage_record, estimate_key, model_name)
 
     response.is_cached_hit = getattr(response, "is_cached_hit", False)
     return response
@@ -253,6 +498,189 @@ def completion(*args, retry_cfg: dict | None = None, **kwargs):
             return _completion(*args, **kwargs)
 
 
+class CompletionStream:
+    """
+    Async iterator over the chunks of a streamed completion.
+
+    Returned by :func:`astream`.  The stream holds its rate-limit reservation
+    until it is exhausted, fails or is closed, then records usage: the counts
+    from the terminal chunk (sent when ``stream_options`` has
+    ``include_usage``), or else an estimate from the reserved input tokens and
+    the text received.  Time to first token and the gaps between content
+    chunks are kept on the stream and added to its :class:`UsageRecord`.
+    Use it as an async context manager so an early exit still releases the
+    reservation::
+
+        async with await astream(model=..., messages=...) as stream:
+            async for chunk in stream:
+                ...
+    """
+
+    def __init__(
+        self,
+        stream,
+        ctx: RateLimitContext,
+        *,
+        model_name: str,
+        input_tokens: int,
+        estimate_key: str | None,
+        start: float,
+    ):
+        """Wrap litellm's *stream*, which was started at monotonic time *start* under *ctx*."""
+        self._stream = stream
+        self._chunks = stream.__aiter__()
+        self._ctx = ctx
+        self.model_name = model_name
+        self._input_tokens = input_tokens
+        self._estimate_key = estimate_key
+        self._start = start
+        self._last_token_at: float | None = None
+        self._text: list[str] = []
+        self._usage = None
+        self._closed = False
+        self.time_to_first_token_ms: float | None = None
+        self.inter_token_ms = UsageStat(round_to=1)
+        self.usage_record: UsageRecord | None = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        try:
+            chunk = await self._chunks.__anext__()
+        except BaseException:
+            with anyio.CancelScope(shield=True):
+                await self._finish()
+            raise
+        self._observe(chunk)
+        return chunk
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Stop reading, record usage for what was received and release the reservation."""
+        if self._closed:
+            return
+        try:
+            if (aclose := getattr(self._stream, "aclose", None)) is not None:
+                await aclose()
+        finally:
+            # Release the reservation even if closing the stream fails or is cancelled
+            with anyio.CancelScope(shield=True):
+                await self._finish()
+
+    def _observe(self, chunk) -> None:
+        """Note the arrival of *chunk*: its text, its timing, and usage if it carries any."""
+        if usage := getattr(chunk, "usage", None):
+            self._usage = usage
+        delta = chunk.choices[0].delta if getattr(chunk, "choices", None) else None
+        content = getattr(delta, "content", None) or getattr(delta, "reasoning_content", None)
+        if not content:
+            return
+        now = time.monotonic()
+        if self._last_token_at is None:
+            self.time_to_first_token_ms = (now - self._start) * 1000
+        else:
+            self.inter_token_ms.add((now - self._last_token_at) * 1000)
+        self._last_token_at = now
+        self._text.append(content)
+
+    def _final_usage(self) -> litellm.Usage:
+        """Return the terminal chunk's usage, or an estimate when the stream ended without one."""
+        if self._usage:
+            return self._usage
+        output_tokens = litellm.token_counter(model=self.model_name, text="".join(self._text)) if self._text else 0
+        return litellm.Usage(
+            prompt_tokens=self._input_tokens,
+            completion_tokens=output_tokens,
+            total_tokens=self._input_tokens + output_tokens,
+        )
+
+    async def _finish(self) -> None:
+        """Record usage once, with the limiter, the usage trackers and the output estimator."""
+        if self._closed:
+            return
+        self._closed = True
+        duration_ms = (time.monotonic() - self._start) * 1000
+        usage = self._final_usage()
+        cost_usd = _usage_cost(self.model_name, usage)
+        await self._ctx.record_usage(usage.prompt_tokens, usage.completion_tokens, cost_usd=cost_usd)
+        await rate_limiter().update_from_headers(self.model_name, _response_headers(self._stream))
+
+        usage_record = convert_litellm_usage_to_usage_record(
+            litellm_usage=usage, model=self.model_name, time_ms=duration_ms, cost_usd=cost_usd
+        )
+        usage_record.time_to_first_token_ms = self.time_to_first_token_ms
+        if self.inter_token_ms.count:
+            usage_record.inter_token_latency_ms = self.inter_token_ms.total / self.inter_token_ms.count
+        track_usage(model=self.model_name, record=usage_record)
+        output_estimator().observe_record(usage_record, self._estimate_key, self.model_name)
+        self.usage_record = usage_record
+
+
+def _usage_cost(model_name: str, usage: litellm.Usage) -> float:
+    """Return the USD cost of *usage* tokens on *model_name*, or 0 if the model is not priced."""
+    try:
+        prompt_cost, completion_cost_usd = litellm.cost_per_token(
+            model=model_name,
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+        )
+    except Exception:  # noqa - best effort, as in _response_cost
+        return 0.0
+    return prompt_cost + completion_cost_usd
+
+
+async def astream(*args, retry_cfg: dict | None = None, **kwargs) -> CompletionStream:
+    """
+    Start a streamed ``litellm.acompletion`` under the global RateLimiter.
+
+    Takes the same arguments as :func:`acompletion`.  Opening the stream is
+    retried with *retry_cfg*; failures after the first chunk are not, since
+    part of the response has already been delivered.
+    """
+    retry_cfg = retry_cfg or _DEFAULT_RETRY_CFG
+    retrying = tenacity.AsyncRetrying(**retry_cfg)
+
+    try:
+        async for attempt in retrying:
+            with attempt:
+                return await _astream(*args, **kwargs)
+    except Exception as e:
+        if hasattr(e, "bulkllm_model_name"):
+            logger.error(f"Failed to stream request for model '{e.bulkllm_model_name}': {str(e)[:50]}")
+        raise
+
+
+async def _astream(*args, estimate_key: str | None = None, **kwargs) -> CompletionStream:
+    """Reserve capacity and open the stream, releasing the reservation if that fails."""
+    initialize_litellm()
+    kwargs = {**kwargs, "stream": True, "stream_options": kwargs.get("stream_options") or {"include_usage": True}}
+    call_kwargs = _call_kwargs(args, kwargs)
+    input_tokens, output_tokens, model_name = _estimate_tokens(call_kwargs, estimate_key)
+
+    ctx = await rate_limiter().reserve_capacity(model_name, input_tokens, output_tokens)
+    start = time.monotonic()
+    try:
+        stream = await litellm.acompletion(*args, **kwargs)
+    except BaseException as e:
+        if isinstance(e, Exception):
+            e.bulkllm_model_name = model_name  # type: ignore[attr-defined]
+            if isinstance(e, litellm.exceptions.RateLimitError):
+                await rate_limiter().record_rate_limit_error(model_name, _error_headers(e))
+        await ctx.__aexit__(type(e), e, e.__traceback__)
+        raise
+    return CompletionStream(
+        stream, ctx, model_name=model_name, input_tokens=input_tokens, estimate_key=estimate_key, start=start
+    )
+
+
 def should_retry_error(exception):
     """Determine if an error from litellm.acompletion should be retried."""
     model_name = getattr(exception, "bulkllm_model_name", getattr(exception, "model", None))
@@ -1962,12 +1962,10 @@ def current_model_configs() -> list[LLMConfig]:
 def for_benchmarking() -> list[LLMConfig]:
     """Return all configs that are not deprecated and have a rate limit."""
     configs = current_model_configs()
-    excluded_for_daily_limit = {
-        # "gemini/gemini-2.5-pro-preview-06-05",
-    }
+    # Daily request/token caps are enforced by the rate limiter (rpd/tpd), so
+    # daily-limited models no longer need to be excluded here.
     excluded_for_openrouter = {"xai/grok-4-0709"}
     excluded_configs = {"openai/codex-mini-latest", "openai/chatgpt-4o-latest", "openai/o3-pro-2025-06-10"}
-    configs = [config for config in configs if config.litellm_model_name not in excluded_for_daily_limit]
     configs = [config for config in configs if config.litellm_model_name not in excluded_configs]
     configs = [config for config in configs if config.litellm_model_name not in excluded_for_openrouter]
     return configs
@@ -0,0 +1,120 @@
+"""
+Online estimates of completion length, used to size rate-limit reservations.
+
+Reserving ``max_tokens`` as output books far more TPM/OTPM than a typical
+response uses, leaving most of a quota idle.  :class:`OutputTokenEstimator`
+instead learns the output lengths actually observed per model (and per config
+slug) and reserves a high quantile of them; the limiter's
+``record_actual_usage`` then reconciles the reservation with the real count.
+
+Until a key has ``warmup`` observations the estimator falls back to the
+caller's ``max_tokens``, so new models start out conservative.
+"""
+
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+from collections import deque
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from bulkllm.usage_tracker import UsageRecord
+
+
+class _Window:
+    """The most recent observations, kept both in arrival order and sorted."""
+
+    __slots__ = ("recent", "sorted")
+
+    def __init__(self, size: int):
+        self.recent: deque[int] = deque(maxlen=size)
+        self.sorted: list[int] = []
+
+    def add(self, value: int) -> None:
+        if len(self.recent) == self.recent.maxlen:
+            del self.sorted[bisect.bisect_left(self.sorted, self.recent[0])]
+        self.recent.append(value)
+        bisect.insort(self.sorted, value)
+
+    def quantile(self, q: float) -> int:
+        return self.sorted[min(len(self.sorted) - 1, math.ceil(q * len(self.sorted)) - 1)]
+
+
+class OutputTokenEstimator:
+    """
+    Per-key sliding-window quantile of observed output tokens.
+
+    ``estimate`` returns ``quantile`` of the last ``window`` observations,
+    scaled by ``headroom`` and clamped to ``[min_tokens, max_tokens]``.  Keys
+    with fewer than ``warmup`` observations fall back to the next key given,
+    and finally to ``max_tokens``.
+    """
+
+    def __init__(
+        self,
+        quantile: float = 0.95,
+        *,
+        window: int = 512,
+        warmup: int = 20,
+        headroom: float = 1.1,
+        min_tokens: int = 1,
+    ):
+        """Configure the estimate; see the class docstring."""
+        if not 0 < quantile <= 1:
+            msg = f"quantile must be in (0, 1], got {quantile}"
+            raise ValueError(msg)
+        if window < 1 or warmup > window:
+            msg = f"window ({window}) must be positive and at least warmup ({warmup})"
+            raise ValueError(msg)
+        self.quantile = quantile
+        self.window = window
+        self.warmup = warmup
+        self.headroom = headroom
+        self.min_tokens = min_tokens
+        self._windows: dict[str, _Window] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, output_tokens: int, *keys: str | None) -> None:
+        """Record a response of *output_tokens* against every key in *keys*."""
+        with self._lock:
+            for key in keys:
+                if key is None:
+                    continue
+                if (window := self._windows.get(key)) is None:
+                    window = self._windows[key] = _Window(self.window)
+                window.add(max(0, output_tokens))
+
+    def observe_record(self, record: UsageRecord, *keys: str | None) -> None:
+        """Record a :class:`UsageRecord`'s ``output_tokens_total``; cache hits are skipped."""
+        if not record.is_cached_hit:
+            self.observe(record.output_tokens_total, *keys)
+
+    def learned(self, *keys: str | None) -> int | None:
+        """Return the learned quantile for the first warmed-up key, or ``None``."""
+        with self._lock:
+            for key in keys:
+                window = self._windows.get(key) if key is not None else None
+                if window is not None and len(window.recent) >= self.warmup:
+                    return window.quantile(self.quantile)
+        return None
+
+    def estimate(self, max_tokens: int | None, *keys: str | None) -> int:
+        """
+        Return how many output tokens to reserve for a request.
+
+        *max_tokens* caps the estimate (a response can never be longer) and is
+        returned as-is while no key has warmed up.  Without *max_tokens* the
+        estimate is uncapped, and a single token is reserved during warm-up.
+        """
+        learned = self.learned(*keys)
+        if learned is None:
+            return max_tokens or self.min_tokens
+        estimate = max(self.min_tokens, math.ceil(learned * self.headroom))
+        return min(estimate, max_tokens) if max_tokens else estimate
+
+    def reset(self) -> None:
+        """Forget every observation."""
+        with self._lock:
+            self._windows.clear()
@@ -0,0 +1,306 @@
+"""
+Shared state backends for :class:`bulkllm.rate_limiter.ModelRateLimit`.
+
+By default every ``ModelRateLimit`` keeps its sliding window in process
+memory, so several worker processes sharing one API key each believe they own
+the full budget.  Passing a backend moves the window into shared storage that
+all processes on the host reserve and release against atomically:
+
+    backend = SQLiteRateLimitBackend("/tmp/bulkllm-rate-limits.sqlite")
+    limit = ModelRateLimit(model_names=["openai/gpt-4o"], rpm=500, backend=backend)
+
+Backends store wall-clock (``time.time()``) timestamps because monotonic
+clocks are not guaranteed to share a reference point between processes.
+"""
+
+from __future__ import annotations
+
+import abc
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import NamedTuple
+
+
+class WindowUsage(NamedTuple):
+    """Requests and tokens currently counted in a shared window (pending + completed)."""
+
+    requests: int
+    input_tokens: int
+    output_tokens: int
+
+
+# Callback deciding whether a request fits: (usage, desired_input, desired_output) -> bool
+FitsFn = Callable[[WindowUsage, int, int], bool]
+
+
+class RateLimitBackend(abc.ABC):
+    """Storage for one or more shared sliding windows, keyed by limit key."""
+
+    #: How often the head waiter re-checks capacity, since releases made by
+    #: other processes cannot notify local waiters.
+    poll_interval: float = 0.05
+
+    @abc.abstractmethod
+    def try_reserve(
+        self,
+        key: str,
+        request_id: str,
+        input_tokens: int,
+        output_tokens: int,
+        fits: FitsFn,
+        *,
+        window_seconds: float,
+        pending_timeout_seconds: float,
+    ) -> bool:
+        """
+        Atomically expire old entries, check *fits* and record a pending reservation.
+
+        Must not wait for other processes: if the shared state is busy, return
+        ``False`` and the caller tries again after ``poll_interval``.
+        """
+
+    @abc.abstractmethod
+    def record(self, key: str, request_id: str, input_tokens: int, output_tokens: int, cached_hit: bool) -> None:
+        """Replace a pending reservation with its actual usage (or drop it for cached hits)."""
+
+    @abc.abstractmethod
+    def cancel(self, key: str, request_id: str) -> None:
+        """Drop a pending reservation without recording usage."""
+
+    @abc.abstractmethod
+    def usage(self, key: str, *, window_seconds: float, pending_timeout_seconds: float) -> WindowUsage:
+        """Expire old entries and return the current window totals."""
+
+    @abc.abstractmethod
+    def seconds_until_expiry(self, key: str, *, window_seconds: float, pending_timeout_seconds: float) -> float | None:
+        """Return seconds until the oldest entry for *key* leaves the window, if any."""
+
+
+class SQLiteRateLimitBackend(RateLimitBackend):
+    """
+    Single-host backend storing shared windows in a SQLite database in WAL mode.
+
+    Every reservation runs in a ``BEGIN IMMEDIATE`` transaction, so the
+    expire/check/insert sequence is atomic across processes.  Reservations do
+    not wait for the write lock - one held by another process counts as no
+    capacity yet - so the transaction never stalls the caller.  Running totals
+    are kept in a separate table so a reservation costs O(expired + log n)
+    rather than re-summing the window.
+    """
+
+    def __init__(self, path: str | Path, *, busy_timeout: float = 30.0, poll_interval: float = 0.05):
+        """Create the database at *path* if needed."""
+        self.path = Path(path)
+        self.busy_timeout = busy_timeout
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._connection().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS reservations (
+                limit_key TEXT NOT NULL,
+                request_id TEXT NOT NULL,
+                acquired_at REAL,
+                completed_at REAL,
+                input_tokens INTEGER NOT NULL,
+                output_tokens INTEGER NOT NULL,
+                PRIMARY KEY (limit_key, request_id)
+            );
+            CREATE INDEX IF NOT EXISTS reservations_completed
+                ON reservations (limit_key, completed_at) WHERE completed_at IS NOT NULL;
+            CREATE INDEX IF NOT EXISTS reservations_pending
+                ON reservations (limit_key, acquired_at) WHERE completed_at IS NULL;
+            CREATE TABLE IF NOT EXISTS totals (
+                limit_key TEXT PRIMARY KEY,
+                requests INTEGER NOT NULL,
+                input_tokens INTEGER NOT NULL,
+                output_tokens INTEGER NOT NULL
+            );
+            """
+        )
+
+    # ---------------------------- connections ------------------------------ #
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, reopening it after a fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self, *, wait: bool = True) -> _Transaction:
+        return _Transaction(self._connection(), None if wait else self.busy_timeout)
+
+    # ----------------------------- internals ------------------------------- #
+    @staticmethod
+    def _adjust_totals(
+        conn: sqlite3.Connection, key: str, requests: int, input_tokens: int, output_tokens: int
+    ) -> None:
+        conn.execute(
+            """
+            INSERT INTO totals (limit_key, requests, input_tokens, output_tokens) VALUES (?, ?, ?, ?)
+            ON CONFLICT (limit_key) DO UPDATE SET
+                requests = MAX(0, requests + excluded.requests),
+                input_tokens = MAX(0, input_tokens + excluded.input_tokens),
+                output_tokens = MAX(0, output_tokens + excluded.output_tokens)
+            """,
+            (key, requests, input_tokens, output_tokens),
+        )
+
+    def _expire(
+        self, conn: sqlite3.Connection, key: str, window_seconds: float, pending_timeout_seconds: float
+    ) -> None:
+        now = time.time()
+        for where, cutoff in (
+            ("completed_at IS NOT NULL AND completed_at < ?", now - window_seconds),
+            ("completed_at IS NULL AND acquired_at < ?", now - pending_timeout_seconds),
+        ):
+            count, inputs, outputs = conn.execute(
+                f"SELECT COUNT(*), TOTAL(input_tokens), TOTAL(output_tokens) FROM reservations WHERE limit_key = ? AND {where}",
+                (key, cutoff),
+            ).fetchone()
+            if count:
+                conn.execute(f"DELETE FROM reservations WHERE limit_key = ? AND {where}", (key, cutoff))
+                self._adjust_totals(conn, key, -count, -int(inputs), -int(outputs))
+
+    @staticmethod
+    def _totals(conn: sqlite3.Connection, key: str) -> WindowUsage:
+        row = conn.execute(
+            "SELECT requests, input_tokens, output_tokens FROM totals WHERE limit_key = ?", (key,)
+        ).fetchone()
+        return WindowUsage(*row) if row else WindowUsage(0, 0, 0)
+
+    # ----------------------------- public API ------------------------------ #
+    def try_reserve(
+        self,
+        key: str,
+        request_id: str,
+        input_tokens: int,
+        output_tokens: int,
+        fits: FitsFn,
+        *,
+        window_seconds: float,
+        pending_timeout_seconds: float,
+    ) -> bool:
+        """Atomically expire old entries, check *fits* and record a pending reservation, without waiting."""
+        try:
+            with self._transaction(wait=False) as conn:
+                self._expire(conn, key, window_seconds, pending_timeout_seconds)
+                if not fits(self._totals(conn, key), input_tokens, output_tokens):
+                    return False
+                conn.execute(
+                    "INSERT INTO reservations VALUES (?, ?, ?, NULL, ?, ?)",
+                    (key, request_id, time.time(), input_tokens, output_tokens),
+                )
+                self._adjust_totals(conn, key, 1, input_tokens, output_tokens)
+                return True
+        except sqlite3.OperationalError as e:
+            if e.sqlite_errorcode != sqlite3.SQLITE_BUSY:
+                raise
+            return False
+
+    def record(self, key: str, request_id: str, input_tokens: int, output_tokens: int, cached_hit: bool) -> None:
+        """Replace a pending reservation with its actual usage (or drop it for cached hits)."""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT input_tokens, output_tokens FROM reservations "
+                "WHERE limit_key = ? AND request_id = ? AND completed_at IS NULL",
+                (key, request_id),
+            ).fetchone()
+            if row is not None:
+                est_in, est_out = row
+                if cached_hit:
+                    conn.execute("DELETE FROM reservations WHERE limit_key = ? AND request_id = ?", (key, request_id))
+                    self._adjust_totals(conn, key, -1, -est_in, -est_out)
+                else:
+                    conn.execute(
+                        "UPDATE reservations SET completed_at = ?, input_tokens = ?, output_tokens = ? "
+                        "WHERE limit_key = ? AND request_id = ?",
+                        (time.time(), input_tokens, output_tokens, key, request_id),
+                    )
+                    self._adjust_totals(conn, key, 0, input_tokens - est_in, output_tokens - est_out)
+            elif not cached_hit:
+                conn.execute(
+                    "INSERT OR REPLACE INTO reservations VALUES (?, ?, NULL, ?, ?, ?)",
+                    (key, request_id, time.time(), input_tokens, output_tokens),
+                )
+                self._adjust_totals(conn, key, 1, input_tokens, output_tokens)
+
+    def cancel(self, key: str, request_id: str) -> None:
+        """Drop a pending reservation without recording usage."""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "DELETE FROM reservations WHERE limit_key = ? AND request_id = ? AND completed_at IS NULL "
+                "RETURNING input_tokens, output_tokens",
+                (key, request_id),
+            ).fetchone()
+            if row is not None:
+                self._adjust_totals(conn, key, -1, -row[0], -row[1])
+
+    def usage(self, key: str, *, window_seconds: float, pending_timeout_seconds: float) -> WindowUsage:
+        """Expire old entries and return the current window totals."""
+        with self._transaction() as conn:
+            self._expire(conn, key, window_seconds, pending_timeout_seconds)
+            return self._totals(conn, key)
+
+    def seconds_until_expiry(self, key: str, *, window_seconds: float, pending_timeout_seconds: float) -> float | None:
+        """Return seconds until the oldest entry for *key* leaves the window, if any."""
+        conn = self._connection()
+        completed, pending = conn.execute(
+            """
+            SELECT
+                (SELECT MIN(completed_at) FROM reservations WHERE limit_key = ? AND completed_at IS NOT NULL),
+                (SELECT MIN(acquired_at) FROM reservations WHERE limit_key = ? AND completed_at IS NULL)
+            """,
+            (key, key),
+        ).fetchone()
+        expiries = []
+        if completed is not None:
+            expiries.append(completed + window_seconds)
+        if pending is not None:
+            expiries.append(pending + pending_timeout_seconds)
+        if not expiries:
+            return None
+        return max(0.0, min(expiries) - time.time())
+
+
+class _Transaction:
+    """
+    ``BEGIN IMMEDIATE`` … ``COMMIT``/``ROLLBACK`` around a SQLite connection.
+
+    With *restore_timeout* set, ``BEGIN`` fails at once with ``SQLITE_BUSY``
+    instead of waiting for another writer, and the connection's busy timeout
+    (in seconds) is restored afterwards.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, restore_timeout: float | None = None):
+        self.conn = conn
+        self.restore_timeout = restore_timeout
+
+    def __enter__(self) -> sqlite3.Connection:
+        if self.restore_timeout is None:
+            self.conn.execute("BEGIN IMMEDIATE")
+            return self.conn
+        self.conn.execute("PRAGMA busy_timeout = 0")
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self._restore()
+            raise
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            if self.restore_timeout is not None:
+                self._restore()
+
+    def _restore(self) -> None:
+        self.conn.execute(f"PRAGMA busy_timeout = {int(self.restore_timeout * 1000)}")
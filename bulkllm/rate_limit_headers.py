@@ -0,0 +1,113 @@
+"""
+Parsing of provider rate-limit response headers.
+
+LiteLLM exposes the provider's response headers on
+``response._hidden_params["additional_headers"]``, both in OpenAI's
+normalised form (``x-ratelimit-limit-requests``) and as raw headers prefixed
+with ``llm_provider-`` (``llm_provider-anthropic-ratelimit-input-tokens-limit``).
+:func:`parse_rate_limit_headers` folds either style into one
+:class:`RateLimitHeaders` that :meth:`ModelRateLimit.update_from_headers
+<bulkllm.rate_limiter.ModelRateLimit.update_from_headers>` can act on.
+"""
+
+from __future__ import annotations
+
+import re
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+# Limit kinds, matching the ModelRateLimit fields they drive
+LIMIT_FIELDS = {"requests": "rpm", "tokens": "tpm", "input_tokens": "itpm", "output_tokens": "otpm"}
+
+_PROVIDER_PREFIX = "llm_provider-"
+
+# (header pattern, naming style) - the attribute and kind are captured from the header name
+_HEADER_PATTERNS = [
+    (re.compile(r"x-ratelimit-(limit|remaining|reset)-(requests|tokens|input-tokens|output-tokens)"), "openai"),
+    (
+        re.compile(r"anthropic-ratelimit-(requests|tokens|input-tokens|output-tokens)-(limit|remaining|reset)"),
+        "anthropic",
+    ),
+]
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+@dataclass
+class RateLimitHeaders:
+    """Per-minute limits, remaining counts and reset delays reported by a provider."""
+
+    limits: dict[str, int] = field(default_factory=dict)
+    remaining: dict[str, int] = field(default_factory=dict)
+    # Seconds from now until the corresponding remaining count resets
+    reset_seconds: dict[str, float] = field(default_factory=dict)
+    retry_after_seconds: float | None = None
+
+    def __bool__(self) -> bool:
+        """Return True if any rate-limit information was found."""
+        return bool(self.limits or self.remaining or self.reset_seconds or self.retry_after_seconds is not None)
+
+
+def parse_duration(value: str, now: float | None = None) -> float | None:
+    """
+    Parse a reset or retry delay into seconds from now.
+
+    Accepts plain seconds (``"1.5"``), Go-style durations (``"6m0s"``,
+    ``"20ms"``), RFC 3339 timestamps and HTTP dates.  Returns ``None`` for
+    anything unrecognised.
+    """
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    if (parts := _DURATION_PART.findall(value)) and "".join(n + u for n, u in parts) == value:
+        return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+    now = time.time() if now is None else now
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            moment = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if moment.tzinfo is None:
+        return None
+    return max(0.0, moment.timestamp() - now)
+
+
+def parse_rate_limit_headers(headers: Mapping[str, object] | None, now: float | None = None) -> RateLimitHeaders:
+    """Extract rate-limit information from *headers*; unknown or malformed values are ignored."""
+    parsed = RateLimitHeaders()
+    for raw_name, raw_value in (headers or {}).items():
+        if raw_value is None:
+            continue
+        name = str(raw_name).lower().removeprefix(_PROVIDER_PREFIX)
+        value = str(raw_value)
+        if name in ("retry-after", "retry-after-ms"):
+            seconds = parse_duration(value, now)
+            if seconds is not None and name == "retry-after-ms":
+                seconds /= 1000
+            if seconds is not None:
+                parsed.retry_after_seconds = max(parsed.retry_after_seconds or 0.0, seconds)
+            continue
+        for pattern, style in _HEADER_PATTERNS:
+            if (match := pattern.fullmatch(name)) is None:
+                continue
+            attr, kind = match.groups() if style == "openai" else reversed(match.groups())
+            kind = kind.replace("-", "_")
+            if attr == "reset":
+                if (seconds := parse_duration(value, now)) is not None:
+                    parsed.reset_seconds[kind] = seconds
+            else:
+                try:
+                    number = int(float(value))
+                except ValueError:
+                    break
+                (parsed.limits if attr == "limit" else parsed.remaining)[kind] = number
+            break
+    return parsed
@@ -27,30 +27,107 @@ async with limiter.reserve_capacity("openai/gpt-4o", estimated_input_tokens, est
     data, input_tokens, output_tokens = await my_task()
     await context.record_usage(input_tokens, output_tokens)
 
-
+Limits are enforced over a sliding window and waited for in a shared
+priority queue that sync threads and async callers on any event loop can
+join.  :class:`ModelRateLimit` describes the window modes, admission
+algorithms, concurrency caps, over-commit, adaptive limits, daily quotas and
+shared backends it supports; :class:`RateLimiter` covers routing, batched
+reservations, timeouts and hierarchical (provider/key/org) limits.
 """
 
+import asyncio
+import contextlib
+import functools
+import heapq
+import itertools
 import logging
+import math
+import os
 import re
 import threading
 import time
 import types
 import uuid
-from collections import deque
-from dataclasses import dataclass
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 from re import Pattern
+from typing import Literal, NamedTuple, TypeVar
+from zoneinfo import ZoneInfo
 
 import anyio
-from pydantic import BaseModel, Field, PrivateAttr
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
+
+from bulkllm.daily_quotas import DailyQuotaStore, DailyUsage
+from bulkllm.rate_limit_backends import RateLimitBackend, WindowUsage
+from bulkllm.rate_limit_headers import LIMIT_FIELDS, RateLimitHeaders, parse_rate_limit_headers
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Request ids are unique within the process and never reused
+_request_ids = itertools.count(1)
+# Spare Request records kept per limit for reuse
+REQUEST_POOL_SIZE = 1024
+
+
+@functools.cache
+def _process_token(pid: int) -> str:
+    """Random token distinguishing this process's request ids from other processes'."""
+    return uuid.uuid4().hex
+
+
+def _shared_request_id(request_id: int) -> str:
+    """Globally unique form of a local request id, for shared backends."""
+    return f"{_process_token(os.getpid())}-{request_id}"
+
+
+# Upper bound on how long the head waiter parks before re-checking capacity.
+# Wakeups normally come from usage/cancel notifications or the computed expiry
+# time; this only guards against wakeups that cannot cross threads (async
+# waiters on event loops other than asyncio).
+MAX_WAIT_SECONDS = 1.0
+
+# Slack for floating-point drift in refilling-bucket arithmetic
+_BUCKET_EPSILON = 1e-9
+
+# Hierarchy levels, innermost first
+LimitLevel = Literal["model", "provider", "key", "org"]
+LIMIT_LEVELS: tuple[LimitLevel, ...] = ("model", "provider", "key", "org")
+
+# Global creation order of ModelRateLimits - the order chains take their locks in
+_limit_order = itertools.count()
+
+
+class DailyQuotaExceededError(RuntimeError):
+    """Raised when a request would exceed a model's daily quota."""
 
-@dataclass
+
+class RateLimitTimeoutError(TimeoutError):
+    """Raised when capacity could not be reserved before a timeout or deadline."""
+
+
+def _deadline(timeout: float | None, deadline: float | None) -> float | None:
+    """Combine a relative *timeout* and an absolute ``time.monotonic()`` *deadline* into the earlier deadline."""
+    if timeout is not None:
+        deadline = time.monotonic() + timeout if deadline is None else min(deadline, time.monotonic() + timeout)
+    return deadline
+
+
+@dataclass(slots=True)
 class Request:
-    """Represents a single request tracked by the rate limiter."""
+    """
+    Represents a single request tracked by the rate limiter.
 
-    id: str
+    Records are recycled through a per-limit pool once nothing refers to
+    them any more, so the hot path rarely allocates.
+    """
+
+    id: int
     lock_acquisition_timestamp: float | None
     request_completion_timestamp: float | None
     input_tokens: int
@@ -62,6 +139,46 @@ class Request:
         return self.input_tokens + self.output_tokens
 
 
+@dataclass(order=True)
+class Waiter:
+    """
+    A caller queued inside :class:`ModelRateLimit` waiting for capacity.
+
+    Waiters are ordered by ``(priority, seq)``: lower priorities are served
+    first and equal priorities are served FIFO.
+    """
+
+    priority: int
+    seq: int
+    event: anyio.Event | threading.Event | None = field(default=None, compare=False)
+    cancelled: bool = field(default=False, compare=False)
+    # Thread and asyncio scheduling hook of an async waiter's event loop
+    thread: int = field(default=0, compare=False)
+    call_soon: Callable[..., object] | None = field(default=None, compare=False)
+
+    def wake(self) -> None:
+        """Signal the waiter to re-check its turn; safe to call from any thread."""
+        event = self.event
+        if event is None:
+            return
+        if isinstance(event, threading.Event) or self.thread == threading.get_ident():
+            event.set()
+        elif self.call_soon is not None:
+            # The loop may have closed since the waiter parked; it is gone then anyway
+            with contextlib.suppress(RuntimeError):
+                self.call_soon(event.set)
+        # Otherwise the waiter re-checks after at most MAX_WAIT_SECONDS
+
+
+def _async_waiter(priority: int, seq: int) -> Waiter:
+    """Return a :class:`Waiter` for the running event loop, wakeable from other threads under asyncio."""
+    try:
+        call_soon = asyncio.get_running_loop().call_soon_threadsafe
+    except RuntimeError:
+        call_soon = None
+    return Waiter(priority, seq, thread=threading.get_ident(), call_soon=call_soon)
+
+
 class RateLimitContext:
     """
     Context manager returned by :pymeth:`ModelRateLimit.reserve_capacity`
@@ -72,29 +189,37 @@ class RateLimitContext:
     token usage.
     """
 
-    def __init__(self, limiter: "ModelRateLimit", request_id: str):
+    def __init__(self, limiter: "ModelRateLimit", request_id: int):
         """Store the owning limiter and pending request id."""
         self._limiter = limiter
         self.request_id = request_id
         self._usage_recorded = False
 
     # ----------------------------- record usage ---------------------------- #
-    async def record_usage(self, input_tokens: int, output_tokens: int, cached_hit: bool = False) -> None:
+    async def record_usage(
+        self, input_tokens: int, output_tokens: int, cached_hit: bool = False, cost_usd: float = 0.0
+    ) -> None:
         """Async version."""
         if self._usage_recorded:
             logger.warning("Usage for request %s already recorded.", self.request_id)
             return
 
-        await self._limiter.record_actual_usage(self.request_id, input_tokens, output_tokens, cached_hit=cached_hit)
+        await self._limiter.record_actual_usage(
+            self.request_id, input_tokens, output_tokens, cached_hit=cached_hit, cost_usd=cost_usd
+        )
         self._usage_recorded = True
 
-    def record_usage_sync(self, input_tokens: int, output_tokens: int, cached_hit: bool = False) -> None:
+    def record_usage_sync(
+        self, input_tokens: int, output_tokens: int, cached_hit: bool = False, cost_usd: float = 0.0
+    ) -> None:
         """Sync version."""
         if self._usage_recorded:
             logger.warning("Usage for request %s already recorded.", self.request_id)
             return
 
-        self._limiter.record_actual_usage_sync(self.request_id, input_tokens, output_tokens, cached_hit=cached_hit)
+        self._limiter.record_actual_usage_sync(
+            self.request_id, input_tokens, output_tokens, cached_hit=cached_hit, cost_usd=cost_usd
+        )
         self._usage_recorded = True
 
     # ------------------------ async context methods ------------------------ #
@@ -199,37 +324,514 @@ class RateLimitContext:
         return self._exit_common(exc_type, exc_val, is_cancellation=is_cancellation)
 
 
+class _UnlimitedContext(RateLimitContext):
+    """
+    Shared no-op context handed out by limits with nothing to enforce.
+
+    It holds no per-request state, so one instance serves every reservation.
+    """
+
+    def __init__(self):
+        """Create the context without an owning limiter."""
+        self._limiter = None
+        self.request_id = 0
+        self._usage_recorded = False
+
+    async def record_usage(
+        self, input_tokens: int, output_tokens: int, cached_hit: bool = False, cost_usd: float = 0.0
+    ) -> None:
+        """Do nothing."""
+
+    def record_usage_sync(
+        self, input_tokens: int, output_tokens: int, cached_hit: bool = False, cost_usd: float = 0.0
+    ) -> None:
+        """Do nothing."""
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        """Let any exception propagate."""
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        """Let any exception propagate."""
+
+
+_UNLIMITED_CONTEXT = _UnlimitedContext()
+
+
+class RateLimitBatch:
+    """
+    Reservations granted together by :pymeth:`ModelRateLimit.reserve_many`.
+
+    ``batch[i]`` is the :class:`RateLimitContext` for the *i*-th granted
+    estimate; record each item's usage through it (or via
+    :pymeth:`record_usage`).  Leaving the batch's context cancels every
+    reservation whose usage was not recorded.
+    """
+
+    def __init__(self, limiter: "ModelRateLimit | RateLimitChain", request_ids: list[int]):
+        """Store the owning limiter and the granted request ids."""
+        self._limiter = limiter
+        self.request_ids = request_ids
+        self._contexts: list[RateLimitContext | None] = [None] * len(request_ids)
+
+    def __len__(self) -> int:
+        """Return the number of granted reservations."""
+        return len(self.request_ids)
+
+    def __getitem__(self, index: int) -> RateLimitContext:
+        """Return the context for the *index*-th reservation."""
+        if (ctx := self._contexts[index]) is None:
+            ctx = self._contexts[index] = RateLimitContext(self._limiter, self.request_ids[index])  # type: ignore[arg-type]
+        return ctx
+
+    def __iter__(self):
+        """Iterate over the per-reservation contexts."""
+        return (self[i] for i in range(len(self)))
+
+    async def record_usage(
+        self, index: int, input_tokens: int, output_tokens: int, cached_hit: bool = False, cost_usd: float = 0.0
+    ) -> None:
+        """Record usage for the *index*-th reservation."""
+        await self[index].record_usage(input_tokens, output_tokens, cached_hit=cached_hit, cost_usd=cost_usd)
+
+    def record_usage_sync(
+        self, index: int, input_tokens: int, output_tokens: int, cached_hit: bool = False, cost_usd: float = 0.0
+    ) -> None:
+        """Sync version of :pymeth:`record_usage`."""
+        self[index].record_usage_sync(input_tokens, output_tokens, cached_hit=cached_hit, cost_usd=cost_usd)
+
+    def _unrecorded(self) -> list[int]:
+        return [
+            request_id
+            for request_id, ctx in zip(self.request_ids, self._contexts, strict=True)
+            if ctx is None or not ctx._usage_recorded
+        ]
+
+    async def release(self) -> None:
+        """Cancel every reservation whose usage was not recorded."""
+        await self._limiter._cancel_many(self._unrecorded())
+
+    def release_sync(self) -> None:
+        """Sync version of :pymeth:`release`."""
+        self._limiter._cancel_many_sync(self._unrecorded())
+
+    async def __aenter__(self):
+        """Enter async context."""
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        """Cancel unrecorded reservations."""
+        with anyio.CancelScope(shield=True):
+            await self.release()
+
+    def __enter__(self):
+        """Enter sync context."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        """Cancel unrecorded reservations."""
+        self.release_sync()
+
+
+def _batch_estimates(estimates: Iterable[tuple[int, int]], max_n: int | None) -> list[tuple[int, int]]:
+    """Materialise at most *max_n* ``(input_tokens, output_tokens)`` estimates."""
+    return list(itertools.islice(estimates, max_n))
+
+
+class BucketedWindow:
+    """
+    Fixed-memory sliding window of completed-request totals.
+
+    Completions are summed into ``bucket_seconds`` wide slots of a preallocated
+    ring.  The ring holds one slot more than the window spans, and a slot is
+    only expired once every completion it holds is at least ``window_seconds``
+    old, so counts are conservative relative to an exact sliding log.
+    """
+
+    __slots__ = ("_inputs", "_oldest", "_outputs", "_requests", "bucket_seconds", "size")
+
+    def __init__(self, window_seconds: float, bucket_seconds: float):
+        """Preallocate the ring for *window_seconds* at *bucket_seconds* resolution."""
+        if bucket_seconds <= 0:
+            msg = "bucket_seconds must be positive"
+            raise ValueError(msg)
+        self.bucket_seconds = bucket_seconds
+        self.size = math.ceil(window_seconds / bucket_seconds) + 1
+        self._requests = array("q", [0]) * self.size
+        self._inputs = array("q", [0]) * self.size
+        self._outputs = array("q", [0]) * self.size
+        # Absolute index of the oldest slot that may still hold counts
+        self._oldest: int | None = None
+
+    def _slot(self, now: float) -> int:
+        return int(now // self.bucket_seconds)
+
+    def add(self, now: float, input_tokens: int, output_tokens: int) -> None:
+        """Count a completion that finished at *now*."""
+        slot = self._slot(now)
+        if self._oldest is None:
+            self._oldest = slot
+        idx = slot % self.size
+        self._requests[idx] += 1
+        self._inputs[idx] += input_tokens
+        self._outputs[idx] += output_tokens
+
+    def expire(self, now: float) -> tuple[int, int, int]:
+        """Clear slots that left the window, returning the removed (requests, input, output)."""
+        if self._oldest is None:
+            return 0, 0, 0
+        current = self._slot(now)
+        first_live = current - self.size + 1
+        if self._oldest >= first_live:
+            return 0, 0, 0
+
+        removed_requests = removed_inputs = removed_outputs = 0
+        # After a long idle period every slot is stale; never visit a slot twice.
+        for slot in range(max(self._oldest, first_live - self.size), first_live):
+            idx = slot % self.size
+            removed_requests += self._requests[idx]
+            removed_inputs += self._inputs[idx]
+            removed_outputs += self._outputs[idx]
+            self._requests[idx] = self._inputs[idx] = self._outputs[idx] = 0
+        self._oldest = first_live
+        self._skip_empty(current)
+        return removed_requests, removed_inputs, removed_outputs
+
+    def _skip_empty(self, current: int) -> None:
+        """Advance ``_oldest`` past empty slots so :meth:`next_expiry` is accurate."""
+        while self._oldest is not None and self._oldest <= current and not self._requests[self._oldest % self.size]:
+            self._oldest += 1
+        if self._oldest is not None and self._oldest > current:
+            self._oldest = None
+
+    def next_expiry(self) -> float | None:
+        """Return the monotonic time at which the oldest non-empty slot expires."""
+        if self._oldest is None:
+            return None
+        return (self._oldest + self.size) * self.bucket_seconds
+
+    def slots(self) -> Iterator[tuple[float, int, int, int]]:
+        """Yield ``(expires_at, requests, input, output)`` for every non-empty slot, oldest first."""
+        if self._oldest is None:
+            return
+        for slot in range(self._oldest, self._oldest + self.size):
+            idx = slot % self.size
+            if self._requests[idx]:
+                yield (
+                    (slot + self.size) * self.bucket_seconds,
+                    self._requests[idx],
+                    self._inputs[idx],
+                    self._outputs[idx],
+                )
+
+
+class TokenBucket:
+    """
+    Continuously refilling bucket for one limit dimension.
+
+    A request is admitted if the bucket holds enough tokens for it, or if the
+    bucket is full - so requests larger than the burst size are still served,
+    leaving the bucket in debt until it refills.
+    """
+
+    __slots__ = ("capacity", "level", "rate", "updated_at")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        """Start a full bucket refilling at *rate* tokens per second."""
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated_at = now
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Return seconds until *cost* can be admitted (0 if it can be now)."""
+        self._refill(now)
+        shortfall = min(cost, self.capacity) - self.level
+        return 0.0 if shortfall <= _BUCKET_EPSILON else shortfall / self.rate
+
+    def consume(self, cost: float, now: float) -> None:
+        """Take *cost* tokens, possibly driving the bucket negative."""
+        self._refill(now)
+        self.level -= cost
+
+    def refund(self, amount: float, now: float) -> None:
+        """Return *amount* previously consumed tokens."""
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+    def set_rate(self, rate: float, capacity: float, now: float) -> None:
+        """Change the refill rate and burst size, keeping the current level."""
+        self._refill(now)
+        self.rate = rate
+        self.capacity = capacity
+        self.level = min(capacity, self.level)
+
+
+class GCRA:
+    """
+    Generic cell rate algorithm for one limit dimension.
+
+    Equivalent to :class:`TokenBucket` but tracks only the theoretical arrival
+    time (TAT): the moment the bucket would be full again.
+    """
+
+    __slots__ = ("interval", "tat", "tolerance")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        """Start with no backlog, emitting one unit every ``1 / rate`` seconds."""
+        self.interval = 1 / rate
+        self.tolerance = capacity * self.interval
+        self.tat = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Return seconds until *cost* can be admitted (0 if it can be now)."""
+        backlog = max(0.0, self.tat - now)
+        allowed_backlog = max(0.0, self.tolerance - cost * self.interval)
+        excess = backlog - allowed_backlog
+        return 0.0 if excess <= _BUCKET_EPSILON else excess
+
+    def consume(self, cost: float, now: float) -> None:
+        """Advance the TAT by *cost* units."""
+        self.tat = max(self.tat, now) + cost * self.interval
+
+    def refund(self, amount: float, now: float) -> None:
+        """Move the TAT back by *amount* units, never past *now*."""
+        self.tat = max(now, self.tat - amount * self.interval)
+
+    def set_rate(self, rate: float, capacity: float, now: float) -> None:
+        """Change the emission rate and burst size, keeping the current backlog in units."""
+        backlog_units = max(0.0, self.tat - now) / self.interval
+        self.interval = 1 / rate
+        self.tolerance = capacity * self.interval
+        self.tat = now + backlog_units * self.interval
+
+
 class ModelRateLimit(BaseModel):
-    """Manages rate limits for a specific model or group of models."""
+    """
+    Manages rate limits for a specific model or group of models.
+
+    All state sits behind one short ``threading.RLock`` that is never held
+    across an ``await``, so sync threads and async callers on any number of
+    event loops can share a limit.  Sync and async waiters queue together;
+    a release from any thread wakes the head waiter directly.
+
+    ``window_mode="exact"`` keeps every completed request until it leaves the
+    window.  ``"bucketed"`` keeps per-slot totals in a ring of
+    ``bucket_seconds`` slots instead, so memory is constant; a request then
+    stays counted up to one bucket longer, never admitting more than the
+    exact mode would.
+
+    ``algorithm="sliding_log"`` admits whenever the window totals leave room,
+    so a minute's budget can be spent in its first second.  ``"token_bucket"``
+    and ``"gcra"`` refill each limit continuously at ``limit / window_seconds``
+    per second with bursts of at most ``burst_seconds`` of refill; both make
+    the same decisions, GCRA storing a single theoretical arrival time.
+
+    ``max_concurrency`` caps the reservations in flight in this process, from
+    grant until recorded, cancelled or timed out, for backends bound by
+    concurrent requests rather than per-minute volume.
+
+    ``overcommit=k`` charges token estimates at ``1/k`` of their size on
+    admission, since estimates are upper bounds.  Recorded usage counts in
+    full, so an underestimate delays later admissions until it leaves the
+    window (or refills) and long-run usage stays within the limit.
+
+    With ``adaptive`` the effective limits follow the provider's
+    ``x-ratelimit-*`` headers (see :meth:`update_from_headers`) and back off
+    on rate-limit errors (see :meth:`record_rate_limit_error`).
+
+    ``rpd``, ``tpd`` and ``daily_cost_usd`` cap each calendar day in
+    ``quota_timezone``.  Usage is persisted in a
+    :class:`~bulkllm.daily_quotas.DailyQuotaStore` so restarts do not reset
+    it, and requests that would exceed a quota raise
+    :class:`DailyQuotaExceededError` instead of waiting.
+
+    A ``backend`` such as :class:`~bulkllm.rate_limit_backends.SQLiteRateLimitBackend`
+    shares the window between processes; its reads and writes happen outside
+    the lock, and off the event loop on async paths.
+    """
 
     model_names: list[str] = Field(..., description="Models that share this rate limit")
     rpm: int = Field(0, description="Requests per minute")
     tpm: int = Field(0, description="Total tokens per minute")
     itpm: int = Field(0, description="Input tokens per minute")
     otpm: int = Field(0, description="Output tokens per minute")
+    max_concurrency: int = Field(
+        0, description="Reservations in flight at once in this process, until recorded or cancelled (0 = no cap)"
+    )
     is_regex: bool = Field(False, description="If *model_names* are regex patterns")
+    level: LimitLevel = Field("model", description="Hierarchy level; non-model limits apply on top of a model's own")
+    rpd: int = Field(0, description="Requests per day")
+    tpd: int = Field(0, description="Total tokens per day")
+    daily_cost_usd: float = Field(0.0, description="Spend per day in USD")
+    quota_timezone: str = Field("UTC", description="Timezone whose midnight resets the daily quotas")
+    daily_quota_store: DailyQuotaStore | None = Field(
+        None, exclude=True, description="Where daily usage is persisted; None uses DailyQuotaStore.default()"
+    )
     window_seconds: int = Field(60, description="Window size in seconds")
     pending_timeout_seconds: int = Field(300, description="Pending request timeout in seconds")
-
-    # Locks
-    _lock: anyio.Lock = PrivateAttr(default_factory=anyio.Lock)
-    _thread_lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+    window_mode: Literal["exact", "bucketed"] = Field(
+        "exact", description="Track completed requests individually or in fixed time buckets"
+    )
+    bucket_seconds: float = Field(1.0, description="Bucket width when window_mode is 'bucketed'")
+    algorithm: Literal["sliding_log", "token_bucket", "gcra"] = Field(
+        "sliding_log", description="Admission algorithm used to enforce the limits"
+    )
+    burst_seconds: float = Field(
+        1.0, description="Burst size for token_bucket/gcra, in seconds' worth of refill at the limit rate"
+    )
+    overcommit: float = Field(
+        1.0, ge=1.0, description="Charge token estimates at 1/overcommit of their size; actual usage counts in full"
+    )
+    backend: RateLimitBackend | None = Field(
+        None, exclude=True, description="Shared state backend; None keeps the window in process memory"
+    )
+    adaptive: bool = Field(True, description="Adjust limits from provider rate-limit response headers")
+    adaptive_min_factor: float = Field(0.1, description="Lowest effective limit, as a fraction of the configured one")
+    adaptive_max_factor: float = Field(10.0, description="Highest effective limit, as a multiple of the configured one")
+    adaptive_hysteresis: float = Field(
+        0.1, description="Ignore reported limits within this fraction of the current ceiling"
+    )
+    aimd_decrease_factor: float = Field(0.5, description="Multiply effective limits by this on a rate-limit error")
+    aimd_increase_fraction: float = Field(
+        0.05, description="Fraction of the ceiling added back after each run of successes"
+    )
+    aimd_probe_successes: int = Field(20, description="Successful requests needed before each increase")
+    aimd_cooldown_seconds: float = Field(2.0, description="Ignore further rate-limit errors this long after a cut")
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    # Guards all bookkeeping for sync and async callers alike; never held across an await
+    _lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+
+    # Ordered queue of sync and async waiters (a heap of Waiter, lazily pruned of cancelled entries)
+    _waiters: list[Waiter] = PrivateAttr(default_factory=list)
+    _waiter_seq: itertools.count = PrivateAttr(default_factory=itertools.count)
+    _order: int = PrivateAttr(default_factory=lambda: next(_limit_order))
 
     # Requests
-    _pending_requests: dict[str, Request] = PrivateAttr(default_factory=dict)
+    _pending_requests: dict[int, Request] = PrivateAttr(default_factory=dict)
+    # Pending request ids in acquisition order.  Ids that were recorded or
+    # cancelled are left in place and skipped lazily when they reach the front.
+    _pending_by_age: deque[int] = PrivateAttr(default_factory=deque)
     _completed_requests: deque[Request] = PrivateAttr(default_factory=deque)
+    # Released records, reused by _new_request
+    _request_pool: list[Request] = PrivateAttr(default_factory=list)
+    _bucket_window: BucketedWindow | None = PrivateAttr(None)
+    # Per-limit refilling buckets keyed by "requests"/"input"/"output"/"total"
+    _buckets: dict[str, TokenBucket | GCRA] | None = PrivateAttr(None)
 
     # Running totals
     _pending_input_tokens: int = PrivateAttr(0)
     _pending_output_tokens: int = PrivateAttr(0)
     _completed_input_tokens: int = PrivateAttr(0)
     _completed_output_tokens: int = PrivateAttr(0)
+    _completed_request_count: int = PrivateAttr(0)
+
+    # Adaptive limits: configured values of rpm/tpm/itpm/otpm, the ceilings
+    # reported by the provider (AIMD never grows past these), and the
+    # monotonic time until which provider back-off pauses admissions
+    _configured_limits: dict[str, int] = PrivateAttr(default_factory=dict)
+    _limit_ceilings: dict[str, int] = PrivateAttr(default_factory=dict)
+    _paused_until: float = PrivateAttr(0.0)
+    _backed_off: bool = PrivateAttr(False)
+    _aimd_successes: int = PrivateAttr(0)
+    _last_cut_at: float = PrivateAttr(-math.inf)
+
+    # Shared backend: the last window totals read and the monotonic time its oldest entry expires
+    _shared_usage: WindowUsage = PrivateAttr(default_factory=lambda: WindowUsage(0, 0, 0))
+    _shared_expiry: float | None = PrivateAttr(None)
+
+    # Daily quotas: today's persisted usage and when (wall clock) today ends
+    _daily_usage: DailyUsage = PrivateAttr(default_factory=DailyUsage)
+    _day: str = PrivateAttr("")
+    _day_ends_at: float = PrivateAttr(-math.inf)
+
+    def model_post_init(self, context, /) -> None:
+        """Allocate window buckets and refilling buckets for the configured modes."""
+        if self.backend is not None and (self.algorithm != "sliding_log" or self.window_mode != "exact"):
+            msg = "Shared backends only support the exact sliding_log window"
+            raise ValueError(msg)
+        if self.backend is not None and self.overcommit > 1:
+            msg = "Shared backends do not support overcommit"
+            raise ValueError(msg)
+        self._configured_limits = {name: getattr(self, name) for name in LIMIT_FIELDS.values()}
+        self._limit_ceilings = dict(self._configured_limits)
+        if self.window_mode == "bucketed":
+            self._bucket_window = BucketedWindow(self.window_seconds, self.bucket_seconds)
+        if self.algorithm != "sliding_log":
+            bucket_cls = TokenBucket if self.algorithm == "token_bucket" else GCRA
+            now = time.monotonic()
+            limits = {"requests": self.rpm, "input": self.itpm, "output": self.otpm, "total": self.tpm}
+            self._buckets = {}
+            for name, limit in limits.items():
+                if limit:
+                    rate = limit / self.window_seconds
+                    self._buckets[name] = bucket_cls(rate, rate * self.burst_seconds, now)
 
     # --------------------------- convenience props ------------------------- #
+    @property
+    def shared_key(self) -> str:
+        """Key identifying this limit's window in a shared backend."""
+        return "|".join(self.model_names)
+
+    def _window_usage(self) -> WindowUsage:
+        """
+        Return requests and tokens counted in the window (pending + completed).
+
+        With a shared backend this is the snapshot taken by the last
+        :meth:`_refresh_shared`, so it is safe to call under ``_lock``.
+        """
+        if self.backend is not None:
+            return self._shared_usage
+        return WindowUsage(
+            len(self._pending_requests) + self._completed_request_count,
+            self._pending_input_tokens + self._completed_input_tokens,
+            self._pending_output_tokens + self._completed_output_tokens,
+        )
+
+    def _refresh_shared(self) -> None:
+        """
+        Read the shared window's totals and next expiry from the backend.
+
+        Must not be called under ``_lock``: the read may wait on other
+        processes' writes.  Async paths run it in a worker thread.
+        """
+        usage = self.backend.usage(
+            self.shared_key, window_seconds=self.window_seconds, pending_timeout_seconds=self.pending_timeout_seconds
+        )
+        expiry = self.backend.seconds_until_expiry(
+            self.shared_key, window_seconds=self.window_seconds, pending_timeout_seconds=self.pending_timeout_seconds
+        )
+        with self._lock:
+            self._shared_usage = usage
+            self._shared_expiry = None if expiry is None else time.monotonic() + expiry
+
+    async def _refresh_shared_async(self) -> None:
+        """Run :meth:`_refresh_shared` in a worker thread, off the event loop."""
+        await anyio.to_thread.run_sync(self._refresh_shared)
+
+    async def window_usage(self) -> WindowUsage:
+        """Return the requests and tokens counted in the window, expiring aged-out requests first."""
+        if self.backend is not None:
+            await self._refresh_shared_async()
+        with self._lock:
+            self._cleanup_old_requests()
+            return self._window_usage()
+
+    def _current_usage(self) -> WindowUsage:
+        """Return the window usage, reading a shared backend afresh first."""
+        if self.backend is not None:
+            self._refresh_shared()
+        return self._window_usage()
+
     @property
     def current_requests_in_window(self) -> int:
         """Return number of requests currently counted in the window."""
-        return len(self._pending_requests) + len(self._completed_requests)
+        return self._current_usage().requests
 
     @property
     def remaining_requests_per_minute(self) -> float | int:
@@ -245,12 +847,8 @@ class ModelRateLimit(BaseModel):
         but the combined sum represents a potentially slightly stale snapshot.
         Call _cleanup_old_requests within a lock context before accessing if needed.
         """
-        return (
-            self._pending_input_tokens
-            + self._pending_output_tokens
-            + self._completed_input_tokens
-            + self._completed_output_tokens
-        )
+        usage = self._current_usage()
+        return usage.input_tokens + usage.output_tokens
 
     @property
     def remaining_total_tokens_per_minute(self) -> float | int:
@@ -260,7 +858,7 @@ class ModelRateLimit(BaseModel):
     @property
     def current_input_tokens_in_window(self) -> int:
         """Return input tokens counted in the current window."""
-        return self._pending_input_tokens + self._completed_input_tokens
+        return self._current_usage().input_tokens
 
     @property
     def remaining_input_tokens_per_minute(self) -> float | int:
@@ -270,7 +868,7 @@ class ModelRateLimit(BaseModel):
     @property
     def current_output_tokens_in_window(self) -> int:
         """Return output tokens counted in the current window."""
-        return self._pending_output_tokens + self._completed_output_tokens
+        return self._current_usage().output_tokens
 
     @property
     def remaining_output_tokens_per_minute(self) -> float | int:
@@ -281,50 +879,113 @@ class ModelRateLimit(BaseModel):
     def print_current_status(self) -> None:
         """Print the current rate-limit utilisation."""
         print(f"Current window: {self.window_seconds}s")
+        if self.algorithm != "sliding_log":
+            print(f"Algorithm: {self.algorithm} (burst {self.burst_seconds}s)")
         if self.rpm:
-            print(f"Requests: {self.current_requests_in_window} / {self.rpm}")
+            print(f"Requests: {self.current_requests_in_window} / {self.rpm}{self._configured_note('rpm')}")
         if self.tpm:
-            print(f"Tokens: {self.current_total_tokens_in_window} / {self.tpm}")
+            print(f"Tokens: {self.current_total_tokens_in_window} / {self.tpm}{self._configured_note('tpm')}")
         if self.itpm:
-            print(f"Input tokens: {self.current_input_tokens_in_window} / {self.itpm}")
+            print(f"Input tokens: {self.current_input_tokens_in_window} / {self.itpm}{self._configured_note('itpm')}")
         if self.otpm:
-            print(f"Output tokens: {self.current_output_tokens_in_window} / {self.otpm}")
+            print(f"Output tokens: {self.current_output_tokens_in_window} / {self.otpm}{self._configured_note('otpm')}")
+        if self.max_concurrency:
+            print(f"In flight: {len(self._pending_requests)} / {self.max_concurrency} concurrent")
+        if (paused := self._paused_until - time.monotonic()) > 0:
+            print(f"Paused for {paused:.1f}s by provider back-off")
+        if self.has_daily_quota:
+            usage = self._today()
+            if self.rpd:
+                print(f"Requests today: {usage.requests} / {self.rpd}")
+            if self.tpd:
+                print(f"Tokens today: {usage.tokens} / {self.tpd}")
+            if self.daily_cost_usd:
+                print(f"Spend today: ${usage.cost_usd:.2f} / ${self.daily_cost_usd:.2f}")
+
+    def _configured_note(self, name: str) -> str:
+        configured = self._configured_limits.get(name, 0)
+        return "" if configured == getattr(self, name) else f" (configured {configured})"
 
     # ---------------------------- housekeeping ----------------------------- #
     def _cleanup_old_requests(self) -> None:
         """Remove completed/pending requests that aged out of the sliding window."""
-        cutoff_time = time.monotonic() - self.window_seconds
-
-        while self._completed_requests and self._completed_requests[0].request_completion_timestamp < cutoff_time:
-            expired = self._completed_requests.popleft()
-            self._completed_input_tokens -= expired.input_tokens
-            self._completed_output_tokens -= expired.output_tokens
+        if self._bucket_window is not None:
+            requests, input_tokens, output_tokens = self._bucket_window.expire(time.monotonic())
+            self._completed_request_count -= requests
+            self._completed_input_tokens -= input_tokens
+            self._completed_output_tokens -= output_tokens
             self._completed_input_tokens = max(0, self._completed_input_tokens)
             self._completed_output_tokens = max(0, self._completed_output_tokens)
-
-        # Prune stalled pending requests
+        else:
+            cutoff_time = time.monotonic() - self.window_seconds
+            while self._completed_requests and self._completed_requests[0].request_completion_timestamp < cutoff_time:
+                expired = self._completed_requests.popleft()
+                self._completed_request_count -= 1
+                self._completed_input_tokens -= expired.input_tokens
+                self._completed_output_tokens -= expired.output_tokens
+                self._completed_input_tokens = max(0, self._completed_input_tokens)
+                self._completed_output_tokens = max(0, self._completed_output_tokens)
+                self._release_request(expired)
+
+        # Prune stalled pending requests - only the expired prefix is visited
         cutoff_time = time.monotonic() - self.pending_timeout_seconds
-        for request_id, req in list(self._pending_requests.items()):
-            if req.lock_acquisition_timestamp < cutoff_time:
-                logger.warning(
-                    "Pending request %s timed out after %ss. Removing from tracking.",
-                    request_id,
-                    self.pending_timeout_seconds,
-                )
-                self._pending_input_tokens -= req.input_tokens
-                self._pending_output_tokens -= req.output_tokens
-                self._pending_input_tokens = max(0, self._pending_input_tokens)
-                self._pending_output_tokens = max(0, self._pending_output_tokens)
-                del self._pending_requests[request_id]
+        while (req := self._oldest_pending()) is not None and req.lock_acquisition_timestamp < cutoff_time:
+            logger.warning(
+                "Pending request %s timed out after %ss. Removing from tracking.",
+                req.id,
+                self.pending_timeout_seconds,
+            )
+            self._pending_by_age.popleft()
+            self._pending_input_tokens -= req.input_tokens
+            self._pending_output_tokens -= req.output_tokens
+            self._pending_input_tokens = max(0, self._pending_input_tokens)
+            self._pending_output_tokens = max(0, self._pending_output_tokens)
+            del self._pending_requests[req.id]
+            self._release_request(req)
+
+    def _oldest_pending(self) -> Request | None:
+        """Return the oldest still-pending request, discarding stale index entries."""
+        by_age = self._pending_by_age
+        pending = self._pending_requests
+        while by_age:
+            if (req := pending.get(by_age[0])) is not None:
+                return req
+            by_age.popleft()
+        return None
+
+    def _new_request(
+        self, req_id: int, acquired_at: float | None, completed_at: float | None, in_tok: int, out_tok: int
+    ) -> Request:
+        """Return a :class:`Request`, reusing a released record when one is available."""
+        if not self._request_pool:
+            return Request(req_id, acquired_at, completed_at, in_tok, out_tok)
+        req = self._request_pool.pop()
+        req.id = req_id
+        req.lock_acquisition_timestamp = acquired_at
+        req.request_completion_timestamp = completed_at
+        req.input_tokens = in_tok
+        req.output_tokens = out_tok
+        return req
+
+    def _release_request(self, req: Request) -> None:
+        """Return a record nothing refers to any more to the pool."""
+        if len(self._request_pool) < REQUEST_POOL_SIZE:
+            self._request_pool.append(req)
 
     # ------------------------ capacity / eligibility ----------------------- #
     def _can_make_request(self, desired_input_tokens: int, desired_output_tokens: int) -> bool:
         """Check if making a new request would violate any rate limits."""
         self._cleanup_old_requests()
-        return self.has_capacity(desired_input_tokens, desired_output_tokens)
+        return self._has_capacity(desired_input_tokens, desired_output_tokens)
 
     def has_capacity(self, desired_input_tokens: int, desired_output_tokens: int) -> bool:
         """Return True if the request would not exceed any limits."""
+        if self.backend is not None:
+            self._refresh_shared()
+        return self._has_capacity(desired_input_tokens, desired_output_tokens)
+
+    def _has_capacity(self, desired_input_tokens: int, desired_output_tokens: int) -> bool:
+        """:meth:`has_capacity` against the last shared-window snapshot - never reads the backend."""
         logger.debug(
             f"Checking if can make request for {self.model_names} with estimated tokens: {desired_input_tokens}, {desired_output_tokens}"
         )
@@ -332,41 +993,58 @@ class ModelRateLimit(BaseModel):
         if desired_input_tokens < 0 or desired_output_tokens < 0:
             raise ValueError("negative token counts are not allowed")
 
-        if self.rpm and self.current_requests_in_window + 1 > self.rpm:
-            logger.debug(f"Request count {self.current_requests_in_window} + 1 > rpm {self.rpm}, returning False")
+        desired_input_tokens, desired_output_tokens = self._charge(desired_input_tokens, desired_output_tokens)
+        self._check_fulfillable(desired_input_tokens, desired_output_tokens)
+
+        if self.has_daily_quota:
+            self._check_daily_quota(desired_input_tokens, desired_output_tokens)
+
+        if self._paused_until > time.monotonic():
+            logger.debug(f"Admissions for {self.model_names} paused by provider back-off, returning False")
             return False
 
-        if self.itpm:
-            if desired_input_tokens > self.itpm:
-                msg = f"Estimated input tokens ({desired_input_tokens}) exceed the input tokens per minute limit ({self.itpm}). Request can never be fulfilled."
-                raise ValueError(msg)
+        if self._at_max_concurrency():
+            return False
 
-            if self.current_input_tokens_in_window + desired_input_tokens > self.itpm:
-                logger.debug(
-                    f"Current input tokens {self.current_input_tokens_in_window} + estimated input tokens {desired_input_tokens} > itpm {self.itpm}, returning False"
-                )
-                return False
+        if self._buckets is not None:
+            return self._bucket_wait_time(desired_input_tokens, desired_output_tokens) == 0
 
-        if self.otpm:
-            if desired_output_tokens > self.otpm:
-                msg = f"Estimated output tokens ({desired_output_tokens}) exceed the output tokens per minute limit ({self.otpm}). Request can never be fulfilled."
-                raise ValueError(msg)
+        return self._fits_window(self._window_usage(), desired_input_tokens, desired_output_tokens)
 
-            if self.current_output_tokens_in_window + desired_output_tokens > self.otpm:
-                logger.debug(
-                    f"Current output tokens {self.current_output_tokens_in_window} + estimated output tokens {desired_output_tokens} > otpm {self.otpm}, returning False"
-                )
-                return False
+    def _charge(self, input_tokens: int, output_tokens: int) -> tuple[int, int]:
+        """Return the tokens an estimate is charged at admission, after over-commit."""
+        if self.overcommit == 1:
+            return input_tokens, output_tokens
+        return math.ceil(input_tokens / self.overcommit), math.ceil(output_tokens / self.overcommit)
 
-        if self.tpm:
-            total_tokens = self.current_input_tokens_in_window + self.current_output_tokens_in_window
-            estimated_total_tokens = desired_input_tokens + desired_output_tokens
+    def _at_max_concurrency(self) -> bool:
+        """Return True if ``max_concurrency`` reservations are already in flight."""
+        if self.max_concurrency and len(self._pending_requests) >= self.max_concurrency:
+            logger.debug(f"{len(self._pending_requests)} requests in flight >= max_concurrency {self.max_concurrency}")
+            return True
+        return False
 
-            if estimated_total_tokens > self.tpm:
-                msg = f"Estimated total tokens ({estimated_total_tokens}) exceed the total tokens per minute limit ({self.tpm}). Request can never be fulfilled."
-                raise ValueError(msg)
+    def _fits_window(self, usage: WindowUsage, desired_input_tokens: int, desired_output_tokens: int) -> bool:
+        """Return True if the request fits on top of the window *usage*."""
+        if self.rpm and usage.requests + 1 > self.rpm:
+            logger.debug(f"Request count {usage.requests} + 1 > rpm {self.rpm}, returning False")
+            return False
+
+        if self.itpm and usage.input_tokens + desired_input_tokens > self.itpm:
+            logger.debug(
+                f"Current input tokens {usage.input_tokens} + estimated input tokens {desired_input_tokens} > itpm {self.itpm}, returning False"
+            )
+            return False
 
-            if total_tokens + estimated_total_tokens > self.tpm:
+        if self.otpm and usage.output_tokens + desired_output_tokens > self.otpm:
+            logger.debug(
+                f"Current output tokens {usage.output_tokens} + estimated output tokens {desired_output_tokens} > otpm {self.otpm}, returning False"
+            )
+            return False
+
+        if self.tpm:
+            total_tokens = usage.input_tokens + usage.output_tokens
+            if total_tokens + desired_input_tokens + desired_output_tokens > self.tpm:
                 logger.debug(
                     f"Total tokens {total_tokens} + estimated input tokens {desired_input_tokens} + estimated output tokens {desired_output_tokens} > tpm {self.tpm}, returning False"
                 )
@@ -374,157 +1052,1259 @@ class ModelRateLimit(BaseModel):
 
         return True
 
+    def _check_fulfillable(self, desired_input_tokens: int, desired_output_tokens: int) -> None:
+        """Raise ``ValueError`` for requests larger than a whole window's limit."""
+        if self.itpm and desired_input_tokens > self.itpm:
+            msg = f"Estimated input tokens ({desired_input_tokens}) exceed the input tokens per minute limit ({self.itpm}). Request can never be fulfilled."
+            raise ValueError(msg)
+
+        if self.otpm and desired_output_tokens > self.otpm:
+            msg = f"Estimated output tokens ({desired_output_tokens}) exceed the output tokens per minute limit ({self.otpm}). Request can never be fulfilled."
+            raise ValueError(msg)
+
+        estimated_total_tokens = desired_input_tokens + desired_output_tokens
+        if self.tpm and estimated_total_tokens > self.tpm:
+            msg = f"Estimated total tokens ({estimated_total_tokens}) exceed the total tokens per minute limit ({self.tpm}). Request can never be fulfilled."
+            raise ValueError(msg)
+
+    # ---------------------------- daily quotas ----------------------------- #
+    @property
+    def has_daily_quota(self) -> bool:
+        """True if any of rpd, tpd or daily_cost_usd is set."""
+        return bool(self.rpd or self.tpd or self.daily_cost_usd)
+
+    def _today(self) -> DailyUsage:
+        """Return today's usage, loading it from the store when the day changes."""
+        if time.time() >= self._day_ends_at:
+            now = datetime.now(ZoneInfo(self.quota_timezone))
+            midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), now.tzinfo)
+            self._day = now.date().isoformat()
+            self._day_ends_at = midnight.timestamp()
+            self._daily_usage = self._quota_store().usage(self.shared_key, self._day)
+        return self._daily_usage
+
+    def _quota_store(self) -> DailyQuotaStore:
+        return self.daily_quota_store or DailyQuotaStore.default()
+
+    def _check_daily_quota(self, desired_input_tokens: int, desired_output_tokens: int) -> None:
+        """Raise :class:`DailyQuotaExceededError` if the request would exceed a daily quota."""
+        usage = self._today()
+        # Reservations still in flight count against today as well
+        if self.rpd and usage.requests + len(self._pending_requests) + 1 > self.rpd:
+            msg = f"Daily request quota ({self.rpd}) for {self.model_names} is used up until {self._day} ends."
+            raise DailyQuotaExceededError(msg)
+        pending_tokens = self._pending_input_tokens + self._pending_output_tokens
+        if self.tpd and usage.tokens + pending_tokens + desired_input_tokens + desired_output_tokens > self.tpd:
+            msg = f"Daily token quota ({self.tpd}) for {self.model_names} is used up until {self._day} ends."
+            raise DailyQuotaExceededError(msg)
+        if self.daily_cost_usd and usage.cost_usd >= self.daily_cost_usd:
+            msg = f"Daily spend cap (${self.daily_cost_usd}) for {self.model_names} is used up until {self._day} ends."
+            raise DailyQuotaExceededError(msg)
+
+    def _record_daily_usage(self, tokens: int, cost_usd: float) -> None:
+        self._today()
+        self._daily_usage = self._quota_store().add(self.shared_key, self._day, 1, tokens, cost_usd)
+
+    # ------------------------- refilling buckets --------------------------- #
+    @staticmethod
+    def _bucket_costs(requests: int, input_tokens: int, output_tokens: int) -> dict[str, int]:
+        return {
+            "requests": requests,
+            "input": input_tokens,
+            "output": output_tokens,
+            "total": input_tokens + output_tokens,
+        }
+
+    def _bucket_wait_time(self, input_tokens: int, output_tokens: int) -> float:
+        """Seconds until every refilling bucket can admit the request."""
+        now = time.monotonic()
+        costs = self._bucket_costs(1, input_tokens, output_tokens)
+        return max((bucket.wait_time(costs[name], now) for name, bucket in self._buckets.items()), default=0.0)
+
+    def _bucket_adjust(self, requests: int, input_tokens: int, output_tokens: int) -> None:
+        """Consume (positive) or refund (negative) amounts across the refilling buckets."""
+        if self._buckets is None:
+            return
+        now = time.monotonic()
+        costs = self._bucket_costs(requests, input_tokens, output_tokens)
+        for name, bucket in self._buckets.items():
+            if costs[name] > 0:
+                bucket.consume(costs[name], now)
+            elif costs[name] < 0:
+                bucket.refund(-costs[name], now)
+
+    # --------------------------- adaptive limits --------------------------- #
+    @property
+    def configured_limits(self) -> dict[str, int]:
+        """The rpm/tpm/itpm/otpm this limit was created with, before adaptation."""
+        return dict(self._configured_limits)
+
+    def _set_limit(self, name: str, value: int) -> None:
+        """Set the effective limit *name* and retune its refilling bucket."""
+        setattr(self, name, value)
+        bucket_name = {"rpm": "requests", "itpm": "input", "otpm": "output", "tpm": "total"}[name]
+        if self._buckets is not None and bucket_name in self._buckets:
+            rate = value / self.window_seconds
+            self._buckets[bucket_name].set_rate(rate, rate * self.burst_seconds, time.monotonic())
+
+    def _pause_internal(self, seconds: float) -> None:
+        """Stop admitting requests for *seconds* (never shortens an existing pause)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _limit_floor(self, name: str) -> int:
+        return max(1, int(self._configured_limits[name] * self.adaptive_min_factor))
+
+    def _update_from_headers_internal(self, headers: RateLimitHeaders) -> None:
+        """Apply reported limits and back-off - caller must hold a lock."""
+        if not self.adaptive:
+            return
+        for kind, name in LIMIT_FIELDS.items():
+            configured = self._configured_limits[name]
+            reported = headers.limits.get(kind)
+            if not configured or not reported:
+                continue
+            target = reported * self.window_seconds / 60
+            target = int(min(configured * self.adaptive_max_factor, max(self._limit_floor(name), target)))
+            ceiling = self._limit_ceilings[name]
+            if abs(target - ceiling) <= ceiling * self.adaptive_hysteresis:
+                continue
+            self._limit_ceilings[name] = target
+            current = getattr(self, name)
+            # While backed off after a rate-limit error, only ever lower the limit
+            new = target if current >= ceiling else min(current, target)
+            logger.info("Adjusting %s for %s from %s to %s", name, self.model_names, current, new)
+            self._set_limit(name, new)
+
+        if headers.retry_after_seconds is not None:
+            self._pause_internal(headers.retry_after_seconds)
+        for kind, remaining in headers.remaining.items():
+            if remaining <= 0 and (reset := headers.reset_seconds.get(kind)) is not None:
+                self._pause_internal(reset)
+
+    def _record_rate_limit_error_internal(self, headers: RateLimitHeaders) -> None:
+        """Multiplicatively cut every configured limit - caller must hold a lock."""
+        if not self.adaptive:
+            return
+        self._update_from_headers_internal(headers)
+        now = time.monotonic()
+        if now - self._last_cut_at < self.aimd_cooldown_seconds:
+            return
+        self._last_cut_at = now
+        for name, configured in self._configured_limits.items():
+            if configured:
+                current = getattr(self, name)
+                self._set_limit(name, max(self._limit_floor(name), int(current * self.aimd_decrease_factor)))
+                logger.info(
+                    "Rate limited: cutting %s for %s from %s to %s",
+                    name,
+                    self.model_names,
+                    current,
+                    getattr(self, name),
+                )
+        self._backed_off = True
+        self._aimd_successes = 0
+
+    def _record_success(self) -> None:
+        """Additively grow backed-off limits after every run of successes - caller must hold a lock."""
+        if not self._backed_off:
+            return
+        self._aimd_successes += 1
+        if self._aimd_successes < self.aimd_probe_successes:
+            return
+        self._aimd_successes = 0
+        backed_off = False
+        for name, ceiling in self._limit_ceilings.items():
+            current = getattr(self, name)
+            if ceiling and current < ceiling:
+                step = max(1, int(ceiling * self.aimd_increase_fraction))
+                self._set_limit(name, min(ceiling, current + step))
+                backed_off |= current + step < ceiling
+        self._backed_off = backed_off
+
+    async def record_rate_limit_error(self, headers: Mapping[str, object] | RateLimitHeaders | None = None) -> None:
+        """
+        Back off after the provider rejected a request with a rate-limit error.
+
+        Every configured limit is multiplied by ``aimd_decrease_factor``, at most
+        once per ``aimd_cooldown_seconds`` since in-flight requests tend to fail
+        together, then grows back by ``aimd_increase_fraction`` of its ceiling
+        after every ``aimd_probe_successes`` successful requests.
+        """
+        if not isinstance(headers, RateLimitHeaders):
+            headers = parse_rate_limit_headers(headers)
+        with self._lock:
+            self._record_rate_limit_error_internal(headers)
+
+    def record_rate_limit_error_sync(self, headers: Mapping[str, object] | RateLimitHeaders | None = None) -> None:
+        """Sync version of :meth:`record_rate_limit_error`."""
+        if not isinstance(headers, RateLimitHeaders):
+            headers = parse_rate_limit_headers(headers)
+        with self._lock:
+            self._record_rate_limit_error_internal(headers)
+
+    async def update_from_headers(self, headers: Mapping[str, object] | RateLimitHeaders | None) -> None:
+        """
+        Adapt the effective limits to provider rate-limit *headers* (raw or parsed).
+
+        Limits move towards the reported ones, clamped to ``adaptive_min_factor``
+        .. ``adaptive_max_factor`` times the configured value and ignoring changes
+        below ``adaptive_hysteresis``.  ``retry-after``, or a remaining count of
+        zero, pauses admissions until the provider's reset time.
+        """
+        if not isinstance(headers, RateLimitHeaders):
+            headers = parse_rate_limit_headers(headers)
+        if not headers:
+            return
+        with self._lock:
+            self._update_from_headers_internal(headers)
+            self._notify_waiters()
+
+    def update_from_headers_sync(self, headers: Mapping[str, object] | RateLimitHeaders | None) -> None:
+        """Sync version of :meth:`update_from_headers`."""
+        if not isinstance(headers, RateLimitHeaders):
+            headers = parse_rate_limit_headers(headers)
+        if not headers:
+            return
+        with self._lock:
+            self._update_from_headers_internal(headers)
+            self._notify_waiters()
+
     # ---------------------------- wait helpers ---------------------------- #
-    def await_capacity_sync(self, input_tokens: int, output_tokens: int) -> None:
-        """Block until capacity is available for the desired tokens."""
-        while True:
-            with self._thread_lock:
-                self._cleanup_old_requests()
-                if self.has_capacity(input_tokens, output_tokens):
-                    return
-            time.sleep(0.05)
+    def _seconds_until_capacity_frees(self, input_tokens: int = 0, output_tokens: int = 0) -> float:
+        """
+        Return how long a waiter should park before re-checking capacity.
+
+        This is the time until the oldest completed request leaves the window
+        or the oldest pending request times out - or, for the refilling
+        algorithms, until the buckets hold enough for the request - capped at
+        ``MAX_WAIT_SECONDS``.  Releases via :meth:`record_actual_usage` or
+        cancellation notify waiters directly so they never have to wait for
+        this deadline.
+        """
+        if (paused := self._paused_until - time.monotonic()) > 0:
+            return min(MAX_WAIT_SECONDS, paused)
+        if self._buckets is not None:
+            return min(MAX_WAIT_SECONDS, self._bucket_wait_time(*self._charge(input_tokens, output_tokens)))
+        if self.backend is not None:
+            # Releases by other processes cannot notify us, so poll the shared window
+            if self._shared_expiry is None:
+                return self.backend.poll_interval
+            return min(self.backend.poll_interval, max(0.0, self._shared_expiry - time.monotonic()))
+
+        now = time.monotonic()
+        wake_at = now + MAX_WAIT_SECONDS
+        if self._bucket_window is not None:
+            if (expiry := self._bucket_window.next_expiry()) is not None:
+                wake_at = min(wake_at, expiry)
+        elif self._completed_requests:
+            wake_at = min(wake_at, self._completed_requests[0].request_completion_timestamp + self.window_seconds)
+        if (oldest := self._oldest_pending()) is not None:
+            wake_at = min(wake_at, oldest.lock_acquisition_timestamp + self.pending_timeout_seconds)
+        return max(0.0, wake_at - now)
+
+    @staticmethod
+    def _queue_head(waiters: list[Waiter]) -> Waiter | None:
+        """Return the first live waiter, discarding cancelled ones."""
+        while waiters and waiters[0].cancelled:
+            heapq.heappop(waiters)
+        return waiters[0] if waiters else None
+
+    def _notify_waiters(self) -> None:
+        """Wake the head waiter, sync or async - caller must hold ``_lock``."""
+        if head := self._queue_head(self._waiters):
+            head.wake()
+
+    def _clamp_to_deadline(self, timeout: float | None, deadline: float | None) -> float | None:
+        """Shorten a park *timeout* to end at *deadline*, raising once it has passed."""
+        if deadline is None:
+            return timeout
+        if (remaining := deadline - time.monotonic()) <= 0:
+            msg = f"No capacity for {self.model_names} before the deadline."
+            raise RateLimitTimeoutError(msg)
+        return remaining if timeout is None else min(timeout, remaining)
+
+    async def _wait_in_turn(
+        self,
+        attempt: Callable[[], T | None],
+        in_tok: int,
+        out_tok: int,
+        priority: int,
+        deadline: float | None = None,
+    ) -> T:
+        """
+        Queue behind earlier and higher-priority waiters, then run *attempt*.
+
+        Only the head of the queue calls *attempt*, so a large request that
+        does not fit yet holds its place while capacity drains instead of
+        being overtaken by smaller ones.  The head parks until a release
+        notifies it or the window frees capacity; everyone else parks until
+        the waiter in front of them leaves the queue and hands over.  Raises
+        :class:`RateLimitTimeoutError` if *deadline* (a ``time.monotonic()``
+        value) passes first; the waiter then leaves the queue as if cancelled.
+        """
+        waiter: Waiter | None = None
+        try:
+            while True:
+                if self.backend is not None:
+                    await self._refresh_shared_async()
+                with self._lock:
+                    if waiter is None and self._queue_head(self._waiters) is None:
+                        result = attempt()
+                        if result is not None:
+                            return result
+                    if waiter is None:
+                        waiter = _async_waiter(priority, next(self._waiter_seq))
+                        heapq.heappush(self._waiters, waiter)
+                    if self._queue_head(self._waiters) is waiter:
+                        result = attempt()
+                        if result is not None:
+                            heapq.heappop(self._waiters)
+                            waiter = None
+                            self._notify_waiters()
+                            return result
+                        timeout = self._seconds_until_capacity_frees(in_tok, out_tok)
+                    else:
+                        timeout = math.inf if waiter.call_soon is not None else MAX_WAIT_SECONDS
+                    timeout = self._clamp_to_deadline(timeout, deadline)
+                    event = waiter.event = anyio.Event()
+                with anyio.move_on_after(timeout):
+                    await event.wait()
+        finally:
+            if waiter is not None:
+                with self._lock:
+                    waiter.cancelled = True
+                    self._notify_waiters()
+
+    def _wait_in_turn_sync(
+        self,
+        attempt: Callable[[], T | None],
+        in_tok: int,
+        out_tok: int,
+        priority: int,
+        deadline: float | None = None,
+    ) -> T:
+        """Sync version of :meth:`_wait_in_turn`."""
+        waiter: Waiter | None = None
+        try:
+            while True:
+                if self.backend is not None:
+                    self._refresh_shared()
+                with self._lock:
+                    if waiter is None and self._queue_head(self._waiters) is None:
+                        result = attempt()
+                        if result is not None:
+                            return result
+                    if waiter is None:
+                        waiter = Waiter(priority, next(self._waiter_seq), event=threading.Event())
+                        heapq.heappush(self._waiters, waiter)
+                    if self._queue_head(self._waiters) is waiter:
+                        result = attempt()
+                        if result is not None:
+                            heapq.heappop(self._waiters)
+                            waiter = None
+                            self._notify_waiters()
+                            return result
+                        timeout = self._seconds_until_capacity_frees(in_tok, out_tok)
+                    else:
+                        timeout = None
+                    timeout = self._clamp_to_deadline(timeout, deadline)
+                    event = waiter.event
+                    event.clear()
+                event.wait(timeout)
+        finally:
+            if waiter is not None:
+                with self._lock:
+                    waiter.cancelled = True
+                    self._notify_waiters()
+
+    def await_capacity_sync(
+        self,
+        input_tokens: int,
+        output_tokens: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,
+        deadline: float | None = None,
+    ) -> None:
+        """
+        Block until capacity is available for the desired tokens.
 
-    async def await_capacity(self, input_tokens: int, output_tokens: int) -> None:
+        Raises :class:`RateLimitTimeoutError` after *timeout* seconds or once
+        *deadline* (a ``time.monotonic()`` value) passes, whichever is first.
+        """
+        self._wait_in_turn_sync(
+            lambda: self._can_make_request(input_tokens, output_tokens) or None,
+            input_tokens,
+            output_tokens,
+            priority,
+            _deadline(timeout, deadline),
+        )
+
+    async def await_capacity(
+        self,
+        input_tokens: int,
+        output_tokens: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,  # noqa: ASYNC109 - mirrors the sync API
+        deadline: float | None = None,
+    ) -> None:
         """Async version of :meth:`await_capacity_sync`."""
-        while True:
-            async with self._lock:
-                self._cleanup_old_requests()
-                if self.has_capacity(input_tokens, output_tokens):
-                    return
-            await anyio.sleep(0.05)
+        await self._wait_in_turn(
+            lambda: self._can_make_request(input_tokens, output_tokens) or None,
+            input_tokens,
+            output_tokens,
+            priority,
+            _deadline(timeout, deadline),
+        )
+
+    def _window_releases(self, now: float) -> Iterator[tuple[float, int, int, int]]:
+        """
+        Yield ``(at, requests, input, output)`` as window usage is released, in time order.
+
+        Pending reservations are assumed to complete now, so they leave the
+        window ``window_seconds`` from *now*.
+        """
+        if self._bucket_window is not None:
+            completed = self._bucket_window.slots()
+        else:
+            completed = (
+                (req.request_completion_timestamp + self.window_seconds, 1, req.input_tokens, req.output_tokens)
+                for req in self._completed_requests
+            )
+        pending = [
+            (
+                now + self.window_seconds,
+                len(self._pending_requests),
+                self._pending_input_tokens,
+                self._pending_output_tokens,
+            )
+        ]
+        return heapq.merge(completed, pending)
+
+    @property
+    def concurrency_saturated(self) -> bool:
+        """True while ``max_concurrency`` reservations are in flight, so admission waits for one to finish."""
+        with self._lock:
+            return self._at_max_concurrency()
+
+    def estimate_wait(self, input_tokens: int, output_tokens: int) -> float:
+        """
+        Estimate how many seconds until a request of this size could be admitted.
+
+        Computed from the window contents, assuming in-flight reservations
+        complete now with their estimated usage and nothing else is admitted
+        in between, so callers can route elsewhere instead of blocking.
+        Returns ``0.0`` if the request fits now and ``math.inf`` if it can
+        never fit or a daily quota is used up.  With a shared backend only the
+        next expiry of the shared window is known, so the estimate is a lower
+        bound.  It is also a lower bound while ``max_concurrency`` reservations
+        are in flight: a slot frees whenever one of them is recorded, which
+        cannot be predicted, so only the window and any back-off pause are
+        counted.  Check :attr:`concurrency_saturated` for that case.
+        """
+        if self.backend is not None:
+            self._refresh_shared()
+        with self._lock:
+            try:
+                if self._can_make_request(input_tokens, output_tokens):
+                    return 0.0
+            except (ValueError, DailyQuotaExceededError):
+                return math.inf
+            now = time.monotonic()
+            paused = max(0.0, self._paused_until - now)
+            charge = self._charge(input_tokens, output_tokens)
+            if self._buckets is not None:
+                return max(paused, self._bucket_wait_time(*charge))
+            if self.backend is not None:
+                return max(paused, 0.0 if self._shared_expiry is None else self._shared_expiry - now)
+
+            usage = self._window_usage()
+            if self._fits_window(usage, *charge):
+                return paused
+            for at, requests, released_input, released_output in self._window_releases(now):
+                usage = WindowUsage(
+                    usage.requests - requests,
+                    usage.input_tokens - released_input,
+                    usage.output_tokens - released_output,
+                )
+                if self._fits_window(usage, *charge):
+                    return max(paused, at - now)
+            return math.inf
 
     # ---------------------------- acquire logic ---------------------------- #
     # Internal helper (no locking)
-    def _try_acquire(self, in_tok: int, out_tok: int) -> str | None:
+    def _try_acquire(self, in_tok: int, out_tok: int) -> int | None:
         """Attempt to reserve capacity—caller must already hold *some* lock."""
+        if self.backend is not None:
+            return self._try_acquire_shared(in_tok, out_tok)
         if not self._can_make_request(in_tok, out_tok):
             return None
 
-        now = time.monotonic()
-        req_id = str(uuid.uuid4())
-        req = Request(
-            id=req_id,
-            lock_acquisition_timestamp=now,
-            request_completion_timestamp=None,
-            input_tokens=in_tok,
-            output_tokens=out_tok,
+        req_id = next(_request_ids)
+        req = self._track_pending(req_id, in_tok, out_tok)
+        self._bucket_adjust(1, req.input_tokens, req.output_tokens)
+        return req_id
+
+    def _try_acquire_shared(self, in_tok: int, out_tok: int) -> int | None:
+        """Reserve against the shared backend, tracking the reservation locally as well."""
+        if in_tok < 0 or out_tok < 0:
+            raise ValueError("negative token counts are not allowed")
+        self._check_fulfillable(in_tok, out_tok)
+        self._cleanup_old_requests()
+        if self._at_max_concurrency():
+            return None
+
+        req_id = next(_request_ids)
+        reserved = self.backend.try_reserve(
+            self.shared_key,
+            _shared_request_id(req_id),
+            in_tok,
+            out_tok,
+            self._fits_window,
+            window_seconds=self.window_seconds,
+            pending_timeout_seconds=self.pending_timeout_seconds,
         )
-        self._pending_requests[req_id] = req
+        if not reserved:
+            return None
+        self._track_pending(req_id, in_tok, out_tok)
+        return req_id
+
+    def _track_pending(self, req_id: int, in_tok: int, out_tok: int) -> Request:
+        """Add a reservation, charged after over-commit, to the local pending bookkeeping."""
+        in_tok, out_tok = self._charge(in_tok, out_tok)
+        req = self._pending_requests[req_id] = self._new_request(req_id, time.monotonic(), None, in_tok, out_tok)
+        self._pending_by_age.append(req_id)
         self._pending_input_tokens += in_tok
         self._pending_output_tokens += out_tok
-        return req_id
+        return req
 
     # ---------- async variants ---------- #
-    async def acquire(self, in_tok: int, out_tok: int) -> str | None:
-        """Attempt to acquire capacity asynchronously."""
-        async with self._lock:
+    async def acquire(self, in_tok: int, out_tok: int) -> int | None:
+        """Attempt to acquire capacity without waiting or jumping the waiter queue."""
+        with self._lock:
+            if self._queue_head(self._waiters) is not None:
+                return None
             return self._try_acquire(in_tok, out_tok)
 
-    async def acquire_blocking(self, in_tok: int, out_tok: int) -> str:
-        """Keep trying :meth:`acquire` until successful."""
-        while True:
-            req_id = await self.acquire(in_tok, out_tok)
-            if req_id:
-                return req_id
-            await anyio.sleep(0.1)
-
-    async def reserve_capacity(self, est_in: int, est_out: int) -> RateLimitContext:
-        """Acquire capacity and return a context manager."""
-        req_id = await self.acquire_blocking(est_in, est_out)
+    async def acquire_blocking(
+        self,
+        in_tok: int,
+        out_tok: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,  # noqa: ASYNC109 - mirrors the sync API
+        deadline: float | None = None,
+    ) -> int:
+        """Wait in the queue until capacity can be reserved, or raise :class:`RateLimitTimeoutError`."""
+        return await self._wait_in_turn(
+            lambda: self._try_acquire(in_tok, out_tok), in_tok, out_tok, priority, _deadline(timeout, deadline)
+        )
+
+    @property
+    def is_unlimited(self) -> bool:
+        """
+        True if there is nothing to enforce right now.
+
+        Reservations on an unlimited limit skip locking and bookkeeping
+        entirely, so its window usage is not tracked.
+        """
+        return not (
+            self.rpm
+            or self.tpm
+            or self.itpm
+            or self.otpm
+            or self.max_concurrency
+            or self.rpd
+            or self.tpd
+            or self.daily_cost_usd
+            or self.backend is not None
+            or self._paused_until > time.monotonic()
+        )
+
+    async def reserve_capacity(
+        self,
+        est_in: int,
+        est_out: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,  # noqa: ASYNC109 - mirrors the sync API
+        deadline: float | None = None,
+    ) -> RateLimitContext:
+        """
+        Acquire capacity and return a context manager.
+
+        Raises :class:`RateLimitTimeoutError` after *timeout* seconds or once
+        *deadline* (a ``time.monotonic()`` value) passes, whichever is first.
+        """
+        if self.is_unlimited and est_in >= 0 and est_out >= 0:
+            return _UNLIMITED_CONTEXT
+        req_id = await self.acquire_blocking(est_in, est_out, priority, timeout=timeout, deadline=deadline)
         return RateLimitContext(self, req_id)
 
     # ---------- sync variants ----------- #
-    def acquire_sync(self, in_tok: int, out_tok: int) -> str | None:
-        """Attempt to acquire capacity synchronously."""
-        with self._thread_lock:
+    def acquire_sync(self, in_tok: int, out_tok: int) -> int | None:
+        """Attempt to acquire capacity synchronously without jumping the waiter queue."""
+        with self._lock:
+            if self._queue_head(self._waiters) is not None:
+                return None
             return self._try_acquire(in_tok, out_tok)
 
-    def acquire_blocking_sync(self, in_tok: int, out_tok: int) -> str:
-        """Blocking version of :meth:`acquire_sync`."""
-        while True:
-            req_id = self.acquire_sync(in_tok, out_tok)
-            if req_id:
-                return req_id
-            time.sleep(0.1)
-
-    def reserve_capacity_sync(self, est_in: int, est_out: int) -> RateLimitContext:
-        """Blocking wrapper returning a :class:`RateLimitContext`."""
-        req_id = self.acquire_blocking_sync(est_in, est_out)
+    def acquire_blocking_sync(
+        self,
+        in_tok: int,
+        out_tok: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,
+        deadline: float | None = None,
+    ) -> int:
+        """Blocking version of :meth:`acquire_blocking`."""
+        return self._wait_in_turn_sync(
+            lambda: self._try_acquire(in_tok, out_tok), in_tok, out_tok, priority, _deadline(timeout, deadline)
+        )
+
+    def reserve_capacity_sync(
+        self,
+        est_in: int,
+        est_out: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,
+        deadline: float | None = None,
+    ) -> RateLimitContext:
+        """Blocking wrapper returning a :class:`RateLimitContext`; see :meth:`reserve_capacity`."""
+        if self.is_unlimited and est_in >= 0 and est_out >= 0:
+            return _UNLIMITED_CONTEXT
+        req_id = self.acquire_blocking_sync(est_in, est_out, priority, timeout=timeout, deadline=deadline)
         return RateLimitContext(self, req_id)
 
+    # ---------- bulk variants ----------- #
+    def _try_acquire_many(self, estimates: list[tuple[int, int]]) -> list[int] | None:
+        """
+        Reserve the longest prefix of *estimates* that fits - caller must hold a lock.
+
+        Expired requests are swept once, so each additional reservation
+        costs O(1).  An estimate that can never
+        be admitted ends the batch; its error is raised once it comes first.
+        """
+        request_ids: list[int] = []
+        if self.backend is None:
+            self._cleanup_old_requests()
+        for in_tok, out_tok in estimates:
+            try:
+                if self.backend is not None:
+                    req_id = self._try_acquire_shared(in_tok, out_tok)
+                elif self._has_capacity(in_tok, out_tok):
+                    req_id = next(_request_ids)
+                    req = self._track_pending(req_id, in_tok, out_tok)
+                    self._bucket_adjust(1, req.input_tokens, req.output_tokens)
+                else:
+                    req_id = None
+            except (ValueError, DailyQuotaExceededError):
+                if not request_ids:
+                    raise
+                break
+            if req_id is None:
+                break
+            request_ids.append(req_id)
+        return request_ids or None
+
+    async def reserve_many(
+        self,
+        estimates: Iterable[tuple[int, int]],
+        max_n: int | None = None,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,  # noqa: ASYNC109 - mirrors the sync API
+        deadline: float | None = None,
+    ) -> RateLimitBatch:
+        """
+        Reserve capacity for up to *max_n* ``(input_tokens, output_tokens)`` estimates at once.
+
+        Waits in turn until the first estimate fits, then grants it and every
+        following estimate that fits right now, in order, within one critical
+        section.  The returned batch may therefore hold fewer reservations than
+        requested.  *timeout* and *deadline* bound the wait as in
+        :meth:`reserve_capacity`.
+        """
+        estimates = _batch_estimates(estimates, max_n)
+        if not estimates:
+            return RateLimitBatch(self, [])
+        in_tok, out_tok = estimates[0]
+        request_ids = await self._wait_in_turn(
+            lambda: self._try_acquire_many(estimates), in_tok, out_tok, priority, _deadline(timeout, deadline)
+        )
+        return RateLimitBatch(self, request_ids)
+
+    def reserve_many_sync(
+        self,
+        estimates: Iterable[tuple[int, int]],
+        max_n: int | None = None,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,
+        deadline: float | None = None,
+    ) -> RateLimitBatch:
+        """Sync version of :meth:`reserve_many`."""
+        estimates = _batch_estimates(estimates, max_n)
+        if not estimates:
+            return RateLimitBatch(self, [])
+        in_tok, out_tok = estimates[0]
+        request_ids = self._wait_in_turn_sync(
+            lambda: self._try_acquire_many(estimates), in_tok, out_tok, priority, _deadline(timeout, deadline)
+        )
+        return RateLimitBatch(self, request_ids)
+
     # ----------------------- record / cancel helpers ----------------------- #
-    # Internal implementation shared by sync & async
-    def _record_actual_usage_internal(self, request_id: str, in_tok: int, out_tok: int, cached_hit: bool) -> None:
-        """Update token counts once the request finishes."""
-        if request_id in self._pending_requests:
-            req = self._pending_requests.pop(request_id)
+    def _untrack_pending(self, request_id: int) -> Request | None:
+        """Remove a request from the local pending bookkeeping, returning it if present."""
+        req = self._pending_requests.pop(request_id, None)
+        if req is not None:
             self._pending_input_tokens -= req.input_tokens
             self._pending_output_tokens -= req.output_tokens
             self._pending_input_tokens = max(0, self._pending_input_tokens)
             self._pending_output_tokens = max(0, self._pending_output_tokens)
+        return req
+
+    # Internal implementation shared by sync & async
+    def _record_actual_usage_internal(
+        self, request_id: int, in_tok: int, out_tok: int, cached_hit: bool, cost_usd: float = 0.0
+    ) -> Callable[[], None] | None:
+        """
+        Update token counts once the request finishes.
+
+        With a shared backend, returns the backend write for the caller to run
+        after releasing ``_lock``.
+        """
+        if not cached_hit:
+            self._record_success()
+            if self.has_daily_quota:
+                self._record_daily_usage(in_tok + out_tok, cost_usd)
+        if self.backend is not None:
+            if (req := self._untrack_pending(request_id)) is not None:
+                self._release_request(req)
+            return functools.partial(
+                self.backend.record, self.shared_key, _shared_request_id(request_id), in_tok, out_tok, cached_hit
+            )
+
+        if (req := self._untrack_pending(request_id)) is not None:
+            if cached_hit:
+                self._bucket_adjust(-1, -req.input_tokens, -req.output_tokens)
+                self._release_request(req)
+            else:
+                # The window logs the actual usage below, so any overshoot of the
+                # over-commit charge holds capacity until it expires; refilling
+                # buckets carry it as a negative level instead
+                self._bucket_adjust(0, in_tok - req.input_tokens, out_tok - req.output_tokens)
         else:
             logger.warning("Request ID %s not in pending when recording usage.", request_id)
-            req = Request(
-                id=request_id,
-                lock_acquisition_timestamp=None,
-                request_completion_timestamp=time.monotonic(),
-                input_tokens=in_tok,
-                output_tokens=out_tok,
-            )
+            req = self._new_request(request_id, None, time.monotonic(), in_tok, out_tok)
+            if not cached_hit:
+                self._bucket_adjust(0, in_tok, out_tok)
 
         if not cached_hit:
             req.input_tokens = in_tok
             req.output_tokens = out_tok
             req.request_completion_timestamp = time.monotonic()
 
-            self._completed_requests.append(req)
+            if self._bucket_window is not None:
+                # Expire first so the slot being written cannot alias a stale one
+                self._cleanup_old_requests()
+                self._bucket_window.add(req.request_completion_timestamp, in_tok, out_tok)
+                self._release_request(req)
+            else:
+                self._completed_requests.append(req)
+            self._completed_request_count += 1
             self._completed_input_tokens += in_tok
             self._completed_output_tokens += out_tok
 
         self._cleanup_old_requests()
+        return None
+
+    # ------------------------ shared backend writes ------------------------ #
+    async def _write_shared(self, writes: list[Callable[[], None]]) -> None:
+        """Run backend writes in a worker thread, outside ``_lock``, then wake the head waiter."""
+        if writes:
+
+            def run() -> None:
+                for write in writes:
+                    write()
+
+            await anyio.to_thread.run_sync(run)
+            with self._lock:
+                self._notify_waiters()
+
+    def _write_shared_sync(self, writes: list[Callable[[], None]]) -> None:
+        """Sync version of :meth:`_write_shared`."""
+        if writes:
+            for write in writes:
+                write()
+            with self._lock:
+                self._notify_waiters()
 
     # ---------- async record ---------- #
     async def record_actual_usage(
-        self, request_id: str, input_tokens: int, output_tokens: int, cached_hit: bool = False
+        self, request_id: int, input_tokens: int, output_tokens: int, cached_hit: bool = False, cost_usd: float = 0.0
     ) -> None:
         """Record actual usage asynchronously."""
-        async with self._lock:
-            self._record_actual_usage_internal(request_id, input_tokens, output_tokens, cached_hit)
+        with self._lock:
+            write = self._record_actual_usage_internal(request_id, input_tokens, output_tokens, cached_hit, cost_usd)
+            if write is None:
+                self._notify_waiters()
+        await self._write_shared([write] if write else [])
 
     # ---------- sync record ----------- #
     def record_actual_usage_sync(
-        self, request_id: str, input_tokens: int, output_tokens: int, cached_hit: bool = False
+        self, request_id: int, input_tokens: int, output_tokens: int, cached_hit: bool = False, cost_usd: float = 0.0
     ) -> None:
         """Record actual usage synchronously."""
-        with self._thread_lock:
-            self._record_actual_usage_internal(request_id, input_tokens, output_tokens, cached_hit)
+        with self._lock:
+            write = self._record_actual_usage_internal(request_id, input_tokens, output_tokens, cached_hit, cost_usd)
+            if write is None:
+                self._notify_waiters()
+        self._write_shared_sync([write] if write else [])
 
     # ------------------------ cancel helpers (shared) ---------------------- #
-    def _cancel_pending_internal(self, request_id: str) -> None:
-        """Remove a pending request without recording usage."""
-        if request_id in self._pending_requests:
-            req = self._pending_requests.pop(request_id)
-            self._pending_input_tokens -= req.input_tokens
-            self._pending_output_tokens -= req.output_tokens
-            self._pending_input_tokens = max(0, self._pending_input_tokens)
-            self._pending_output_tokens = max(0, self._pending_output_tokens)
+    def _cancel_pending_internal(self, request_id: int) -> Callable[[], None] | None:
+        """
+        Remove a pending request without recording usage.
+
+        With a shared backend, returns the backend write for the caller to run
+        after releasing ``_lock``.
+        """
+        if (req := self._untrack_pending(request_id)) is not None:
+            self._bucket_adjust(-1, -req.input_tokens, -req.output_tokens)
+            self._release_request(req)
             logger.info("Cancelled pending request %s.", request_id)
+            if self.backend is not None:
+                return functools.partial(self.backend.cancel, self.shared_key, _shared_request_id(request_id))
+        return None
 
-    async def _cancel_pending(self, request_id: str) -> None:
+    async def _cancel_pending(self, request_id: int) -> None:
         """Async wrapper around :meth:`_cancel_pending_internal`."""
+        await self._cancel_many([request_id])
 
-        if request_id in self._pending_requests:
-            async with self._lock:
-                self._cancel_pending_internal(request_id)
-
-    def _cancel_pending_sync(self, request_id: str) -> None:
+    def _cancel_pending_sync(self, request_id: int) -> None:
         """Sync wrapper around :meth:`_cancel_pending_internal`."""
-        with self._thread_lock:
-            self._cancel_pending_internal(request_id)
+        self._cancel_many_sync([request_id])
+
+    async def _cancel_many(self, request_ids: list[int]) -> None:
+        """Cancel several pending requests under one lock acquisition."""
+        if not any(request_id in self._pending_requests for request_id in request_ids):
+            return
+        with self._lock:
+            writes = [write for request_id in request_ids if (write := self._cancel_pending_internal(request_id))]
+            if not writes:
+                self._notify_waiters()
+        await self._write_shared(writes)
+
+    def _cancel_many_sync(self, request_ids: list[int]) -> None:
+        """Sync version of :meth:`_cancel_many`."""
+        if request_ids:
+            with self._lock:
+                writes = [write for request_id in request_ids if (write := self._cancel_pending_internal(request_id))]
+                if not writes:
+                    self._notify_waiters()
+            self._write_shared_sync(writes)
+
+
+class _Refused(NamedTuple):
+    """Index of the :class:`RateLimitChain` level that refused a reservation."""
+
+    level: int
+
+
+class RateLimitChain:
+    """
+    Reserve across an ordered chain of :class:`ModelRateLimit` levels at once.
+
+    Offers the same reservation API as a single ``ModelRateLimit``.  A
+    reservation succeeds on every level or on none: each attempt takes the
+    locks of all levels (in global creation order, so overlapping chains
+    cannot deadlock), reserves level by level and rolls back if any level is
+    full or has a queue.  It then waits in the queue of the level that
+    refused before trying again, so nothing is held while waiting.
+    """
+
+    def __init__(self, limits: list[ModelRateLimit]):
+        """Chain *limits*, innermost (model) level first."""
+        self.limits = limits
+        self._lock_order = sorted(limits, key=lambda limit: limit._order)
+        # chain request id -> per-level request ids, oldest first in _reservations_by_age
+        self._reservations: dict[int, list[int]] = {}
+        self._reservations_by_age: deque[int] = deque()
+        # Shared-backend cancels of rolled-back levels, run once every lock is released
+        self._rollback_writes: list[tuple[ModelRateLimit, Callable[[], None]]] = []
+
+    @property
+    def model_names(self) -> list[str]:
+        """Model names of the innermost level."""
+        return self.limits[0].model_names
+
+    # ------------------------------ acquire -------------------------------- #
+    def _try_acquire_locked(self, in_tok: int, out_tok: int, turn: int | None = None) -> int | _Refused:
+        """
+        Reserve on every level or none - caller must hold every level's lock.
+
+        Returns the chain request id, or which level refused.  *turn* is the
+        level whose queue the caller has just left as its head; that level's
+        queue is not deferred to again, or two chains could keep handing the
+        head to each other without either ever reserving.
+        """
+        acquired: list[int] = []
+        try:
+            for index, limit in enumerate(self.limits):
+                queued = index != turn and limit._queue_head(limit._waiters) is not None
+                request_id = None if queued else limit._try_acquire(in_tok, out_tok)
+                if request_id is None:
+                    self._roll_back(acquired)
+                    return _Refused(index)
+                acquired.append(request_id)
+        except BaseException:
+            self._roll_back(acquired)
+            raise
+        self._purge_expired()
+        self._reservations[acquired[0]] = acquired
+        self._reservations_by_age.append(acquired[0])
+        return acquired[0]
+
+    def _purge_expired(self) -> None:
+        """
+        Forget the oldest reservations that every level has timed out - caller must hold every lock.
+
+        Recorded and cancelled ids are popped from ``_reservations`` directly
+        and skipped here, so only the expired prefix is visited.
+        """
+        by_age = self._reservations_by_age
+        while by_age:
+            level_ids = self._reservations.get(by_age[0])
+            if level_ids is not None and any(
+                level_id in limit._pending_requests for limit, level_id in zip(self.limits, level_ids, strict=False)
+            ):
+                return
+            self._reservations.pop(by_age.popleft(), None)
+
+    def _roll_back(self, acquired: list[int]) -> None:
+        """Cancel *acquired* level reservations, deferring backend writes to :meth:`_attempt`."""
+        for limit, request_id in zip(self.limits, acquired, strict=False):
+            if (write := limit._cancel_pending_internal(request_id)) is not None:
+                self._rollback_writes.append((limit, write))
+
+    def _try_acquire_many_locked(
+        self, estimates: list[tuple[int, int]], turn: int | None = None
+    ) -> list[int] | _Refused:
+        """Reserve the longest prefix of *estimates* that fits every level - caller must hold every lock."""
+        request_ids: list[int] = []
+        for in_tok, out_tok in estimates:
+            try:
+                result = self._try_acquire_locked(in_tok, out_tok, turn)
+            except (ValueError, DailyQuotaExceededError):
+                if not request_ids:
+                    raise
+                break
+            if isinstance(result, _Refused):
+                return request_ids or result
+            request_ids.append(result)
+        return request_ids
+
+    @contextlib.contextmanager
+    def _locked(self, writes: list[tuple[ModelRateLimit, Callable[[], None]]]) -> Iterator[None]:
+        """Hold every level's lock, handing the rollback writes left inside over to *writes*."""
+        with ExitStack() as stack:
+            for limit in self._lock_order:
+                stack.enter_context(limit._lock)
+            try:
+                yield
+            finally:
+                writes.extend(self._rollback_writes)
+                self._rollback_writes.clear()
+
+    def _attempt(self, attempt: Callable[[], T]) -> T:
+        """Run *attempt* holding every level's lock, then any rollback writes without them."""
+        writes: list[tuple[ModelRateLimit, Callable[[], None]]] = []
+        try:
+            with self._locked(writes):
+                return attempt()
+        finally:
+            for limit, write in writes:
+                limit._write_shared_sync([write])
+
+    async def _attempt_async(self, attempt: Callable[[], T]) -> T:
+        """Async version of :meth:`_attempt`; rollback writes run in a worker thread."""
+        writes: list[tuple[ModelRateLimit, Callable[[], None]]] = []
+        try:
+            with self._locked(writes):
+                return attempt()
+        finally:
+            for limit, write in writes:
+                await limit._write_shared([write])
+
+    async def acquire(self, in_tok: int, out_tok: int) -> int | None:
+        """Reserve on every level if all have room right now, without jumping any queue."""
+        result = await self._attempt_async(functools.partial(self._try_acquire_locked, in_tok, out_tok))
+        return None if isinstance(result, _Refused) else result
+
+    def acquire_sync(self, in_tok: int, out_tok: int) -> int | None:
+        """Sync version of :meth:`acquire`."""
+        result = self._attempt(functools.partial(self._try_acquire_locked, in_tok, out_tok))
+        return None if isinstance(result, _Refused) else result
+
+    async def acquire_blocking(
+        self,
+        in_tok: int,
+        out_tok: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,  # noqa: ASYNC109 - mirrors the sync API
+        deadline: float | None = None,
+    ) -> int:
+        """Wait until every level can admit the request, then reserve them all."""
+        deadline = _deadline(timeout, deadline)
+        attempt = functools.partial(self._try_acquire_locked, in_tok, out_tok)
+        turn = None
+        while isinstance(result := await self._attempt_async(functools.partial(attempt, turn=turn)), _Refused):
+            await self.limits[result.level].await_capacity(in_tok, out_tok, priority, deadline=deadline)
+            turn = result.level
+        return result
+
+    def acquire_blocking_sync(
+        self,
+        in_tok: int,
+        out_tok: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,
+        deadline: float | None = None,
+    ) -> int:
+        """Sync version of :meth:`acquire_blocking`."""
+        deadline = _deadline(timeout, deadline)
+        attempt = functools.partial(self._try_acquire_locked, in_tok, out_tok)
+        turn = None
+        while isinstance(result := self._attempt(functools.partial(attempt, turn=turn)), _Refused):
+            self.limits[result.level].await_capacity_sync(in_tok, out_tok, priority, deadline=deadline)
+            turn = result.level
+        return result
+
+    async def reserve_many(
+        self,
+        estimates: Iterable[tuple[int, int]],
+        max_n: int | None = None,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,  # noqa: ASYNC109 - mirrors the sync API
+        deadline: float | None = None,
+    ) -> RateLimitBatch:
+        """Bulk version of :meth:`reserve_capacity`; see :meth:`ModelRateLimit.reserve_many`."""
+        deadline = _deadline(timeout, deadline)
+        estimates = _batch_estimates(estimates, max_n)
+        if not estimates:
+            return RateLimitBatch(self, [])
+        attempt = functools.partial(self._try_acquire_many_locked, estimates)
+        turn = None
+        while isinstance(result := await self._attempt_async(functools.partial(attempt, turn=turn)), _Refused):
+            await self.limits[result.level].await_capacity(*estimates[0], priority, deadline=deadline)
+            turn = result.level
+        return RateLimitBatch(self, result)
+
+    def reserve_many_sync(
+        self,
+        estimates: Iterable[tuple[int, int]],
+        max_n: int | None = None,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,
+        deadline: float | None = None,
+    ) -> RateLimitBatch:
+        """Sync version of :meth:`reserve_many`."""
+        deadline = _deadline(timeout, deadline)
+        estimates = _batch_estimates(estimates, max_n)
+        if not estimates:
+            return RateLimitBatch(self, [])
+        attempt = functools.partial(self._try_acquire_many_locked, estimates)
+        turn = None
+        while isinstance(result := self._attempt(functools.partial(attempt, turn=turn)), _Refused):
+            self.limits[result.level].await_capacity_sync(*estimates[0], priority, deadline=deadline)
+            turn = result.level
+        return RateLimitBatch(self, result)
+
+    async def reserve_capacity(
+        self,
+        est_in: int,
+        est_out: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,  # noqa: ASYNC109 - mirrors the sync API
+        deadline: float | None = None,
+    ) -> RateLimitContext:
+        """Acquire capacity on every level and return a context manager."""
+        req_id = await self.acquire_blocking(est_in, est_out, priority, timeout=timeout, deadline=deadline)
+        return RateLimitContext(self, req_id)  # type: ignore[arg-type]
+
+    def reserve_capacity_sync(
+        self,
+        est_in: int,
+        est_out: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,
+        deadline: float | None = None,
+    ) -> RateLimitContext:
+        """Sync version of :meth:`reserve_capacity`."""
+        req_id = self.acquire_blocking_sync(est_in, est_out, priority, timeout=timeout, deadline=deadline)
+        return RateLimitContext(self, req_id)  # type: ignore[arg-type]
+
+    def has_capacity(self, desired_input_tokens: int, desired_output_tokens: int) -> bool:
+        """Return True if every level could admit the request."""
+        return all(limit.has_capacity(desired_input_tokens, desired_output_tokens) for limit in self.limits)
+
+    def estimate_wait(self, input_tokens: int, output_tokens: int) -> float:
+        """Estimate the wait until every level could admit the request; see :meth:`ModelRateLimit.estimate_wait`."""
+        return max(limit.estimate_wait(input_tokens, output_tokens) for limit in self.limits)
+
+    @property
+    def concurrency_saturated(self) -> bool:
+        """True while any level has ``max_concurrency`` reservations in flight."""
+        return any(limit.concurrency_saturated for limit in self.limits)
+
+    async def await_capacity(
+        self,
+        input_tokens: int,
+        output_tokens: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,  # noqa: ASYNC109 - mirrors the sync API
+        deadline: float | None = None,
+    ) -> None:
+        """Wait until every level has room at the same time."""
+        deadline = _deadline(timeout, deadline)
+        while True:
+            for limit in self.limits:
+                if limit.backend is not None:
+                    await limit._refresh_shared_async()
+            if all(limit._has_capacity(input_tokens, output_tokens) for limit in self.limits):
+                return
+            for limit in self.limits:
+                await limit.await_capacity(input_tokens, output_tokens, priority, deadline=deadline)
+
+    def await_capacity_sync(
+        self,
+        input_tokens: int,
+        output_tokens: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,
+        deadline: float | None = None,
+    ) -> None:
+        """Sync version of :meth:`await_capacity`."""
+        deadline = _deadline(timeout, deadline)
+        while not self.has_capacity(input_tokens, output_tokens):
+            for limit in self.limits:
+                limit.await_capacity_sync(input_tokens, output_tokens, priority, deadline=deadline)
+
+    # -------------------------- record / cancel ---------------------------- #
+    def _pop_levels(self, request_id: int, *, recording: bool) -> list[tuple[ModelRateLimit, int]]:
+        """
+        Forget *request_id* and return its per-level ids.
+
+        Unknown ids are recorded on every level under the same id, as a single
+        limit would, and are ignored when cancelling.
+        """
+        level_ids = self._reservations.pop(request_id, None)
+        if level_ids is None:
+            level_ids = [request_id] * len(self.limits) if recording else []
+        return list(zip(self.limits, level_ids, strict=False))
+
+    async def record_actual_usage(
+        self, request_id: int, input_tokens: int, output_tokens: int, cached_hit: bool = False, cost_usd: float = 0.0
+    ) -> None:
+        """Record actual usage on every level."""
+        for limit, level_id in self._pop_levels(request_id, recording=True):
+            await limit.record_actual_usage(
+                level_id, input_tokens, output_tokens, cached_hit=cached_hit, cost_usd=cost_usd
+            )
+
+    def record_actual_usage_sync(
+        self, request_id: int, input_tokens: int, output_tokens: int, cached_hit: bool = False, cost_usd: float = 0.0
+    ) -> None:
+        """Sync version of :meth:`record_actual_usage`."""
+        for limit, level_id in self._pop_levels(request_id, recording=True):
+            limit.record_actual_usage_sync(
+                level_id, input_tokens, output_tokens, cached_hit=cached_hit, cost_usd=cost_usd
+            )
+
+    async def _cancel_pending(self, request_id: int) -> None:
+        """Cancel the reservation on every level."""
+        for limit, level_id in self._pop_levels(request_id, recording=False):
+            await limit._cancel_pending(level_id)
+
+    def _cancel_pending_sync(self, request_id: int) -> None:
+        """Sync version of :meth:`_cancel_pending`."""
+        for limit, level_id in self._pop_levels(request_id, recording=False):
+            limit._cancel_pending_sync(level_id)
+
+    async def _cancel_many(self, request_ids: list[int]) -> None:
+        """Cancel several reservations on every level."""
+        for request_id in request_ids:
+            await self._cancel_pending(request_id)
+
+    def _cancel_many_sync(self, request_ids: list[int]) -> None:
+        """Sync version of :meth:`_cancel_many`."""
+        for request_id in request_ids:
+            self._cancel_pending_sync(request_id)
+
+
+_ROUTE_GROUP = "_bulkllm_route_{}"
+_ROUTE_GROUP_INDEX = len(_ROUTE_GROUP.format(""))
+# Numbered (``\1``) and named (``(?P=name)``) backreferences and conditionals
+# (``(?(1)...)``) all refer to groups, which the combined alternation renumbers or rebinds
+_GROUP_REFERENCE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+
+
+def _combine_patterns(patterns: list[Pattern]) -> Pattern | None:
+    """
+    Join *patterns* into one alternation whose ``lastgroup`` names the first one that matches.
+
+    Each alternative is followed by an empty marker group, and alternatives
+    are tried left to right, so ``combined.match(name).lastgroup`` identifies
+    the same pattern a sequential ``pattern.match`` loop would pick.  Returns
+    ``None`` when the patterns cannot be combined safely (group references,
+    inline global flags, clashing group names).
+    """
+    if not patterns or any(_GROUP_REFERENCE.search(p.pattern) for p in patterns):
+        return None
+    try:
+        return re.compile(
+            "|".join(f"(?:{p.pattern})(?P<{_ROUTE_GROUP.format(i)}>)" for i, p in enumerate(patterns)),
+            patterns[0].flags,
+        )
+    except re.error:
+        return None
 
 
 class RateLimiter:
-    """Manages rate limits for all models, routing to the appropriate ModelRateLimit."""
+    """
+    Manages rate limits for all models, routing to the appropriate ModelRateLimit.
+
+    Limits with a ``level`` of ``"provider"``, ``"key"`` or ``"org"`` apply on
+    top of the model's own limit for every model they match, and reservations
+    for such a model go through a :class:`RateLimitChain`:
+
+        RateLimiter([
+            ModelRateLimit(model_names=["anthropic/claude-3-5-haiku-20241022"], itpm=400_000),
+            ModelRateLimit(model_names=["anthropic/.*"], is_regex=True, level="provider", rpm=4_000),
+            ModelRateLimit(model_names=[".*"], is_regex=True, level="org", rpm=10_000),
+        ])
+
+    ``reserve_many`` grants as many of a batch of estimates as fit right now
+    in one critical section.  Reservations wait until granted unless given
+    ``timeout=`` or ``deadline=``, after which they raise
+    :class:`RateLimitTimeoutError`; :meth:`estimate_wait` lets a caller route
+    elsewhere instead of waiting.
+    """
+
+    # Bound on the per-name routing memos
+    route_cache_size = 4096
 
     def __init__(self, rate_limits: list[ModelRateLimit] | None = None):
         """Initialise lookup tables and load default rate limits."""
@@ -532,6 +2312,16 @@ class RateLimiter:
 
         # Store regex patterns for model matching
         self.regex_patterns: list[tuple[Pattern, ModelRateLimit]] = []
+        # All regex patterns as one alternation, rebuilt lazily after add_rate_limit
+        self._combined_pattern: Pattern | None = None
+        self._combined_stale = False
+
+        # Provider/key/org limits that apply on top of the model's own limit
+        self.parent_limits: list[ModelRateLimit] = []
+
+        # Memoised routing results, including names that fall through to the default
+        self._routes: OrderedDict[str, ModelRateLimit] = OrderedDict()
+        self._chains: OrderedDict[str, ModelRateLimit | RateLimitChain] = OrderedDict()
 
         # Default rate limits
         self.default_rate_limit = ModelRateLimit(model_names=["default"], rpm=0, tpm=0, itpm=0, otpm=0)
@@ -550,48 +2340,207 @@ class RateLimiter:
         if not rate_limit or not rate_limit.model_names:
             return
 
+        self._routes.clear()
+        self._chains.clear()
+        if rate_limit.level != "model":
+            self.parent_limits.append(rate_limit)
+            self.parent_limits.sort(key=lambda limit: LIMIT_LEVELS.index(limit.level))
+            return
+
         # Handle regex patterns
         if rate_limit.is_regex:
             for pattern_str in rate_limit.model_names:
                 pattern = re.compile(pattern_str)
                 self.regex_patterns.append((pattern, rate_limit))
+            self._combined_stale = True
         else:
             for model_name in rate_limit.model_names:
                 self.model_limit_lookup[model_name] = rate_limit
 
+    def _remember(self, memo: OrderedDict[str, T], model_name: str, value: T) -> T:
+        """Store *value* in *memo*, evicting the oldest entry once it is full."""
+        if len(memo) >= self.route_cache_size:
+            memo.popitem(last=False)
+        memo[model_name] = value
+        return value
+
+    def _match_regex(self, model_name: str) -> ModelRateLimit:
+        """Return the limit of the first regex pattern matching *model_name*, or the default."""
+        if self._combined_stale:
+            self._combined_pattern = _combine_patterns([pattern for pattern, _ in self.regex_patterns])
+            self._combined_stale = False
+        if self._combined_pattern is not None:
+            if (match := self._combined_pattern.match(model_name)) is None:
+                return self.default_rate_limit
+            return self.regex_patterns[int(match.lastgroup[_ROUTE_GROUP_INDEX:])][1]
+
+        for pattern, model_limit in self.regex_patterns:
+            if pattern.match(model_name):
+                return model_limit
+
+        return self.default_rate_limit
+
     def get_rate_limit_for_model(self, model_name: str) -> ModelRateLimit:
         """Get the ModelRateLimit instance for a model."""
         model_limit = self.model_limit_lookup.get(model_name)
         if model_limit:
             return model_limit
 
-        for pattern, model_limit in self.regex_patterns:
-            if pattern.match(model_name):
-                return model_limit
+        if (model_limit := self._routes.get(model_name)) is not None:
+            return model_limit
+        return self._remember(self._routes, model_name, self._match_regex(model_name))
 
-        return self.default_rate_limit
+    @staticmethod
+    def _matches(rate_limit: ModelRateLimit, model_name: str) -> bool:
+        if rate_limit.is_regex:
+            return any(re.match(pattern, model_name) for pattern in rate_limit.model_names)
+        return model_name in rate_limit.model_names
+
+    def get_rate_limits_for_model(self, model_name: str) -> list[ModelRateLimit]:
+        """Return every limit that applies to *model_name*, from the model level outwards."""
+        return [
+            self.get_rate_limit_for_model(model_name),
+            *(limit for limit in self.parent_limits if self._matches(limit, model_name)),
+        ]
+
+    def get_limiter_for_model(self, model_name: str) -> ModelRateLimit | RateLimitChain:
+        """Return the model's own limit, or a :class:`RateLimitChain` if outer levels apply."""
+        if (limiter := self._chains.get(model_name)) is None:
+            limits = self.get_rate_limits_for_model(model_name)
+            limiter = limits[0] if len(limits) == 1 else RateLimitChain(limits)
+            self._remember(self._chains, model_name, limiter)
+        return limiter
+
+    async def reserve_capacity(
+        self,
+        model_name: str,
+        input_tokens: int,
+        output_tokens: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,  # noqa: ASYNC109 - mirrors the sync API
+        deadline: float | None = None,
+    ) -> RateLimitContext:
+        """
+        Reserve capacity for a request and return its :class:`RateLimitContext`.
 
-    async def reserve_capacity(self, model_name: str, input_tokens: int, output_tokens: int) -> RateLimitContext:
-        """Reserve capacity for a request. Returns RateLimitContext if successful, None otherwise."""
-        rate_limit = self.get_rate_limit_for_model(model_name)
-        return await rate_limit.reserve_capacity(input_tokens, output_tokens)
+        Waiters for the same model are served in order of *priority* (lower first),
+        FIFO within a priority.  Raises :class:`RateLimitTimeoutError` after
+        *timeout* seconds or once *deadline* (a ``time.monotonic()`` value)
+        passes; :meth:`estimate_wait` tells up front whether that is likely.
+        """
+        rate_limit = self.get_limiter_for_model(model_name)
+        return await rate_limit.reserve_capacity(
+            input_tokens, output_tokens, priority, timeout=timeout, deadline=deadline
+        )
 
-    def reserve_capacity_sync(self, model_name: str, input_tokens: int, output_tokens: int) -> RateLimitContext:
+    def reserve_capacity_sync(
+        self,
+        model_name: str,
+        input_tokens: int,
+        output_tokens: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,
+        deadline: float | None = None,
+    ) -> RateLimitContext:
         """Blocking wrapper around :pymeth:`ModelRateLimit.reserve_capacity`."""
+        rate_limit = self.get_limiter_for_model(model_name)
+        return rate_limit.reserve_capacity_sync(
+            input_tokens, output_tokens, priority, timeout=timeout, deadline=deadline
+        )
+
+    async def update_from_headers(self, model_name: str, headers: Mapping[str, object] | None) -> None:
+        """Adapt *model_name*'s limit to provider rate-limit *headers*; the shared default limit is left alone."""
+        rate_limit = self.get_rate_limit_for_model(model_name)
+        if rate_limit is not self.default_rate_limit:
+            await rate_limit.update_from_headers(headers)
+
+    def update_from_headers_sync(self, model_name: str, headers: Mapping[str, object] | None) -> None:
+        """Sync version of :meth:`update_from_headers`."""
+        rate_limit = self.get_rate_limit_for_model(model_name)
+        if rate_limit is not self.default_rate_limit:
+            rate_limit.update_from_headers_sync(headers)
+
+    async def record_rate_limit_error(self, model_name: str, headers: Mapping[str, object] | None = None) -> None:
+        """Back off *model_name*'s limit after a rate-limit error; the shared default limit is left alone."""
+        rate_limit = self.get_rate_limit_for_model(model_name)
+        if rate_limit is not self.default_rate_limit:
+            await rate_limit.record_rate_limit_error(headers)
+
+    def record_rate_limit_error_sync(self, model_name: str, headers: Mapping[str, object] | None = None) -> None:
+        """Sync version of :meth:`record_rate_limit_error`."""
         rate_limit = self.get_rate_limit_for_model(model_name)
-        return rate_limit.reserve_capacity_sync(input_tokens, output_tokens)
+        if rate_limit is not self.default_rate_limit:
+            rate_limit.record_rate_limit_error_sync(headers)
+
+    async def reserve_many(
+        self,
+        model_name: str,
+        estimates: Iterable[tuple[int, int]],
+        max_n: int | None = None,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,  # noqa: ASYNC109 - mirrors the sync API
+        deadline: float | None = None,
+    ) -> RateLimitBatch:
+        """Reserve capacity for many requests to *model_name* at once; see :meth:`ModelRateLimit.reserve_many`."""
+        return await self.get_limiter_for_model(model_name).reserve_many(
+            estimates, max_n, priority, timeout=timeout, deadline=deadline
+        )
+
+    def reserve_many_sync(
+        self,
+        model_name: str,
+        estimates: Iterable[tuple[int, int]],
+        max_n: int | None = None,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,
+        deadline: float | None = None,
+    ) -> RateLimitBatch:
+        """Sync version of :meth:`reserve_many`."""
+        return self.get_limiter_for_model(model_name).reserve_many_sync(
+            estimates, max_n, priority, timeout=timeout, deadline=deadline
+        )
 
     def has_capacity(self, model_name: str, desired_input_tokens: int, desired_output_tokens: int) -> bool:
         """Check capacity for a particular model."""
-        rate_limit = self.get_rate_limit_for_model(model_name)
+        rate_limit = self.get_limiter_for_model(model_name)
         return rate_limit.has_capacity(desired_input_tokens, desired_output_tokens)
 
-    def await_capacity_sync(self, model_name: str, input_tokens: int, output_tokens: int) -> None:
-        """Block until the specified model has room for a new request."""
-        rate_limit = self.get_rate_limit_for_model(model_name)
-        rate_limit.await_capacity_sync(input_tokens, output_tokens)
+    def estimate_wait(self, model_name: str, input_tokens: int, output_tokens: int) -> float:
+        """Estimate the seconds until *model_name* could admit a request; see :meth:`ModelRateLimit.estimate_wait`."""
+        return self.get_limiter_for_model(model_name).estimate_wait(input_tokens, output_tokens)
 
-    async def await_capacity(self, model_name: str, input_tokens: int, output_tokens: int) -> None:
+    def concurrency_saturated(self, model_name: str) -> bool:
+        """Return True while *model_name* waits on in-flight requests; see :attr:`ModelRateLimit.concurrency_saturated`."""
+        return self.get_limiter_for_model(model_name).concurrency_saturated
+
+    def await_capacity_sync(
+        self,
+        model_name: str,
+        input_tokens: int,
+        output_tokens: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,
+        deadline: float | None = None,
+    ) -> None:
+        """Block until the specified model has room for a new request, or raise :class:`RateLimitTimeoutError`."""
+        rate_limit = self.get_limiter_for_model(model_name)
+        rate_limit.await_capacity_sync(input_tokens, output_tokens, priority, timeout=timeout, deadline=deadline)
+
+    async def await_capacity(
+        self,
+        model_name: str,
+        input_tokens: int,
+        output_tokens: int,
+        priority: int = 0,
+        *,
+        timeout: float | None = None,  # noqa: ASYNC109 - mirrors the sync API
+        deadline: float | None = None,
+    ) -> None:
         """Async version of :meth:`await_capacity_sync`."""
-        rate_limit = self.get_rate_limit_for_model(model_name)
-        await rate_limit.await_capacity(input_tokens, output_tokens)
+        rate_limit = self.get_limiter_for_model(model_name)
+        await rate_limit.await_capacity(input_tokens, output_tokens, priority, timeout=timeout, deadline=deadline)
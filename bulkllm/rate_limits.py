@@ -271,6 +271,15 @@ DEFAULT_RATE_LIMITS: RateLimitConfig = [
         itpm=2_000_000,
         otpm=400_000,
     ),
+    # OpenRouter free variants: 20 rpm and 50 requests/day (1000/day once the
+    # account has bought at least $10 of credits - raise rpd to match)
+    ModelRateLimit(
+        model_names=["^openrouter/.*:free$"],
+        rpm=20,
+        rpd=50,
+        is_regex=True,
+        pending_timeout_seconds=180,
+    ),
     # OpenRouter Models - use regex to match all models
     ModelRateLimit(
         model_names=["^openrouter/.*$"],
@@ -0,0 +1,622 @@
+"""
+Response cache backends for LiteLLM: sharded SQLite on disk, an LRU in memory.
+
+litellm's ``type="disk"`` cache keeps every response in one ``diskcache``
+database, so concurrent readers and writers queue on a single file and every
+payload is stored uncompressed.  :class:`ShardedSQLiteCache` spreads entries
+over ``shards`` SQLite files picked by cache-key prefix, each in WAL mode so
+readers never block on writers, and stores payloads zlib-compressed.
+
+Entries may carry a TTL and are dropped when read after it expires.  With
+``max_bytes`` set, each shard keeps its share of the budget by evicting the
+least recently read entries.  The async methods run the blocking SQLite calls
+in anyio's worker threads, so event loops keep serving other requests while a
+lookup is on disk.
+
+Install it as the backend of a ``litellm.Cache``::
+
+    litellm.cache = litellm.Cache(type="local")
+    litellm.cache.cache = ShardedSQLiteCache(path)
+
+Repeated lookups within a process (self-consistency samples, retries,
+reruns) would still read and decompress the same entry each time.
+:class:`TieredCache` puts a bounded in-memory LRU in front of any backend and
+writes through to it, so those lookups never leave the process.
+:func:`bulkllm.llm.initialize_litellm` installs
+``TieredCache(ShardedSQLiteCache(CACHE_PATH / "responses"))``.
+
+Both classes keep hit, miss and latency counters (``stats()``); the tiered
+cache also counts each lookup once on the active
+:class:`~bulkllm.usage_tracker.UsageTracker`, with the tier that answered it,
+reported by ``UsageTracker.cache_snapshot()``.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import functools
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import anyio.to_thread
+from litellm.caching.base_cache import BaseCache
+
+from bulkllm.usage_tracker import track_cache_lookup
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+DEFAULT_MAX_BYTES = 4 * 2**30
+DEFAULT_MEMORY_ENTRIES = 10_000
+DEFAULT_MEMORY_BYTES = 256 * 2**20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    compressed INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);
+INSERT OR IGNORE INTO totals (id, bytes) VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    UPDATE totals SET bytes = bytes + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    UPDATE totals SET bytes = bytes - OLD.size;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN
+    UPDATE totals SET bytes = bytes - OLD.size + NEW.size;
+END;
+"""
+
+_UPSERT = """
+INSERT INTO entries (key, value, compressed, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET
+    value = excluded.value,
+    compressed = excluded.compressed,
+    size = excluded.size,
+    expires_at = excluded.expires_at,
+    accessed_at = excluded.accessed_at
+"""
+
+
+@dataclass
+class CacheStats:
+    """Lookup and write counters for one cache, with cumulative latency."""
+
+    hits: int = 0
+    misses: int = 0
+    sets: int = 0
+    expirations: int = 0
+    evictions: int = 0
+    fallback_hits: int = 0
+    get_seconds: float = 0.0
+    set_seconds: float = 0.0
+
+    @property
+    def hit_ratio(self) -> float:
+        """Fraction of lookups answered from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def mean_get_ms(self) -> float:
+        """Mean lookup latency in milliseconds."""
+        lookups = self.hits + self.misses
+        return self.get_seconds * 1000 / lookups if lookups else 0.0
+
+    @property
+    def mean_set_ms(self) -> float:
+        """Mean write latency in milliseconds."""
+        return self.set_seconds * 1000 / self.sets if self.sets else 0.0
+
+    def snapshot(self) -> dict[str, float]:
+        """Return the counters and derived ratios as a plain dict."""
+        return {
+            **asdict(self),
+            "hit_ratio": self.hit_ratio,
+            "mean_get_ms": self.mean_get_ms,
+            "mean_set_ms": self.mean_set_ms,
+        }
+
+
+class _ShardPool:
+    """Connections to one shard file, shared by all threads and capped at *size* open at once."""
+
+    def __init__(self, path: Path, size: int, busy_timeout: float):
+        if size < 1:
+            msg = f"connections_per_shard must be positive, got {size}"
+            raise ValueError(msg)
+        self.path = path
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self.opened = 0
+        self._idle: list[sqlite3.Connection] = []
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow an idle connection, opening one if under the cap and waiting otherwise."""
+        with self._cond:
+            if self._pid != os.getpid():
+                # Connections inherited over a fork must not be used by the child
+                self._idle, self.opened, self._pid = [], 0, os.getpid()
+            while not self._idle and self.opened >= self.size:
+                self._cond.wait()
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self.opened += 1
+        if conn is None:
+            try:
+                conn = self._open()
+            except BaseException:
+                with self._cond:
+                    self.opened -= 1
+                    self._cond.notify()
+                raise
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def close(self) -> None:
+        """Close the idle connections."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self.opened -= len(idle)
+        for conn in idle:
+            conn.close()
+
+
+class ShardedSQLiteCache(BaseCache):
+    """LiteLLM cache backend storing compressed responses across SQLite-WAL shards."""
+
+    def __init__(
+        self,
+        path: str | Path,
+        *,
+        shards: int = 16,
+        max_bytes: int | None = DEFAULT_MAX_BYTES,
+        default_ttl: float | None = None,
+        compress_min_bytes: int = 256,
+        compression_level: int = 6,
+        touch_interval: float = 60.0,
+        busy_timeout: float = 30.0,
+        connections_per_shard: int = 4,
+        fallback: BaseCache | None = None,
+    ):
+        """
+        Create *shards* databases under the directory *path* if needed.
+
+        *max_bytes* bounds the stored (compressed) payload size across all
+        shards, ``None`` for no bound.  Reads refresh an entry's LRU position
+        at most once per *touch_interval* seconds so hot keys do not turn
+        every lookup into a write.  Threads share at most
+        *connections_per_shard* connections to each shard, opened on first
+        use, so the number of open files stays bounded however many worker
+        threads run lookups.  On a miss, *fallback* (such as the old disk
+        cache) is consulted and its entry copied into this cache.
+        """
+        if not 1 <= shards <= 256:
+            msg = f"shards must be between 1 and 256, got {shards}"
+            raise ValueError(msg)
+        super().__init__()
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl  # type: ignore[assignment]
+        self.compress_min_bytes = compress_min_bytes
+        self.compression_level = compression_level
+        self.touch_interval = touch_interval
+        self.busy_timeout = busy_timeout
+        self.fallback = fallback
+        self._pools = [
+            _ShardPool(self.path / f"responses-{i:03d}.sqlite", connections_per_shard, busy_timeout)
+            for i in range(shards)
+        ]
+        self._stats = CacheStats()
+        self._stats_lock = threading.Lock()
+        for pool in self._pools:
+            with pool.connection() as conn:
+                conn.executescript(_SCHEMA)
+
+    def _shard(self, key: str) -> _ShardPool:
+        """Return the pool for the shard holding *key*, chosen by its hex prefix."""
+        try:
+            prefix = int(key[:8], 16)
+        except ValueError:
+            prefix = zlib.crc32(key.encode())
+        return self._pools[prefix % len(self._pools)]
+
+    def close(self) -> None:
+        """Close the idle connections; shards reopen them on next use."""
+        for pool in self._pools:
+            pool.close()
+
+    def _count(self, **counts: int) -> None:
+        with self._stats_lock:
+            for name, count in counts.items():
+                setattr(self._stats, name, getattr(self._stats, name) + count)
+
+    def stats(self) -> CacheStats:
+        """Return a copy of the counters recorded by this process."""
+        with self._stats_lock:
+            return CacheStats(**asdict(self._stats))
+
+    def reset_stats(self) -> None:
+        """Zero the counters."""
+        with self._stats_lock:
+            self._stats = CacheStats()
+
+    def total_bytes(self) -> int:
+        """Return the stored payload size summed over every shard."""
+        total = 0
+        for pool in self._pools:
+            with pool.connection() as conn:
+                total += conn.execute("SELECT bytes FROM totals").fetchone()[0]
+        return total
+
+    def _encode(self, value: Any) -> tuple[bytes, bool]:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) < self.compress_min_bytes:
+            return data, False
+        compressor = zlib.compressobj(self.compression_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush(), True
+
+    @staticmethod
+    def _decode(data: bytes, compressed: int) -> Any:
+        return pickle.loads(zlib.decompress(data, -zlib.MAX_WBITS) if compressed else data)  # noqa: S301
+
+    def _expires_at(self, now: float, kwargs: dict[str, Any]) -> float | None:
+        ttl = kwargs.get("ttl", self.default_ttl)
+        return now + float(ttl) if ttl is not None else None
+
+    def _write(self, conn: sqlite3.Connection, key: str, value: Any, now: float, kwargs: dict[str, Any]) -> None:
+        data, compressed = self._encode(value)
+        conn.execute(_UPSERT, (key, data, compressed, len(data), self._expires_at(now, kwargs), now))
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """Drop expired entries, then least recently read ones, until the shard is below 90% of its budget."""
+        if self.max_bytes is None:
+            return
+        budget = self.max_bytes // len(self._pools)
+        if conn.execute("SELECT bytes FROM totals").fetchone()[0] <= budget:
+            return
+        expired = conn.execute("DELETE FROM entries WHERE expires_at < ?", (now,)).rowcount
+        excess = conn.execute("SELECT bytes FROM totals").fetchone()[0] - int(budget * 0.9)
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+        evicted = conn.executemany("DELETE FROM entries WHERE key = ?", victims).rowcount
+        self._count(expirations=expired, evictions=evicted)
+
+    def set_cache(self, key, value, **kwargs):
+        """Store *value* under *key*, expiring after ``kwargs["ttl"]`` seconds if given."""
+        start = time.perf_counter()
+        now = time.time()
+        with self._shard(key).connection() as conn:
+            self._write(conn, key, value, now, kwargs)
+            self._evict(conn, now)
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self._stats.sets += 1
+            self._stats.set_seconds += elapsed
+
+    def _lookup(self, conn: sqlite3.Connection, key: str) -> tuple[bool, Any]:
+        """Return ``(found, value)`` for *key*, dropping it if expired."""
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, compressed, expires_at, accessed_at FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return False, None
+        data, compressed, expires_at, accessed_at = row
+        if expires_at is not None and expires_at <= now:
+            conn.execute("DELETE FROM entries WHERE key = ? AND expires_at <= ?", (key, now))
+            self._count(expirations=1)
+            return False, None
+        if now - accessed_at >= self.touch_interval:
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return True, self._decode(data, compressed)
+
+    def get_cache(self, key, **kwargs):
+        """Return the value stored under *key*, or ``None``."""
+        start = time.perf_counter()
+        with self._shard(key).connection() as conn:
+            found, value = self._lookup(conn, key)
+        if not found and self.fallback is not None:
+            value = self.fallback.get_cache(key)
+            if value is not None:
+                found = True
+                self._count(fallback_hits=1)
+                self.set_cache(key, value)
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self._stats.get_seconds += elapsed
+            if found:
+                self._stats.hits += 1
+            else:
+                self._stats.misses += 1
+        return value
+
+    def batch_get_cache(self, keys: list, **kwargs):
+        """Return the values stored under *keys*, ``None`` where missing."""
+        return [self.get_cache(key, **kwargs) for key in keys]
+
+    def increment_cache(self, key, value: int, **kwargs) -> int:
+        """Add *value* to the number stored under *key* and return the result."""
+        now = time.time()
+        with self._shard(key).connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            found, current = self._lookup(conn, key)
+            total = (current if found else 0) + value
+            self._write(conn, key, total, now, kwargs)
+            conn.execute("COMMIT")
+        return total
+
+    def delete_cache(self, key):
+        """Remove *key* if present."""
+        with self._shard(key).connection() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def flush_cache(self):
+        """Remove every entry from every shard."""
+        for pool in self._pools:
+            with pool.connection() as conn:
+                conn.execute("DELETE FROM entries")
+
+    async def async_set_cache(self, key, value, **kwargs):
+        """Async :meth:`set_cache`, run in a worker thread."""
+        await anyio.to_thread.run_sync(functools.partial(self.set_cache, key, value, **kwargs))
+
+    async def async_set_cache_pipeline(self, cache_list, **kwargs):
+        """Store every ``(key, value)`` pair in *cache_list* from one worker thread."""
+
+        def set_all() -> None:
+            for key, value in cache_list:
+                self.set_cache(key, value, **kwargs)
+
+        await anyio.to_thread.run_sync(set_all)
+
+    async def async_get_cache(self, key, **kwargs):
+        """Async :meth:`get_cache`, run in a worker thread."""
+        return await anyio.to_thread.run_sync(functools.partial(self.get_cache, key, **kwargs))
+
+    async def async_batch_get_cache(self, keys: list, **kwargs):
+        """Async :meth:`batch_get_cache`, run in one worker thread."""
+        return await anyio.to_thread.run_sync(functools.partial(self.batch_get_cache, keys, **kwargs))
+
+    async def async_increment(self, key, value: int, **kwargs) -> int:
+        """Async :meth:`increment_cache`, run in a worker thread."""
+        return await anyio.to_thread.run_sync(functools.partial(self.increment_cache, key, value, **kwargs))
+
+    async def disconnect(self):
+        """Close the idle connections."""
+        self.close()
+
+
+def _approx_size(value: Any) -> int:
+    """Rough in-memory footprint of *value*: string lengths plus a fixed overhead per object."""
+    if isinstance(value, str | bytes | bytearray):
+        return 50 + len(value)
+    if isinstance(value, dict):
+        return 64 + sum(_approx_size(key) + _approx_size(item) for key, item in value.items())
+    if isinstance(value, list | tuple):
+        return 56 + sum(_approx_size(item) for item in value)
+    return 32
+
+
+class TieredCache(BaseCache):
+    """Bounded in-process LRU in front of another LiteLLM cache backend, written through to it."""
+
+    def __init__(
+        self,
+        backend: BaseCache,
+        *,
+        max_entries: int = DEFAULT_MEMORY_ENTRIES,
+        max_bytes: int = DEFAULT_MEMORY_BYTES,
+        ttl: float | None = None,
+    ):
+        """
+        Keep up to *max_entries* values, and about *max_bytes* of them, in memory.
+
+        Values are held as the objects the backend returned and handed out
+        without copying, so callers must not mutate them (litellm keeps the
+        response itself as a JSON string and parses it on every hit).  An
+        entry lives in memory for the ``ttl`` it was written with, capped by
+        *ttl*; entries loaded from *backend* are kept until evicted or for
+        *ttl* seconds.
+        """
+        super().__init__()
+        self.backend = backend
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[Any, int, float | None]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory": CacheStats(), "backend": CacheStats()}
+
+    def stats(self) -> dict[str, CacheStats]:
+        """Return a copy of the counters for the ``memory`` and ``backend`` tiers."""
+        with self._lock:
+            return {tier: CacheStats(**asdict(stats)) for tier, stats in self._stats.items()}
+
+    def reset_stats(self) -> None:
+        """Zero the counters."""
+        with self._lock:
+            self._stats = {"memory": CacheStats(), "backend": CacheStats()}
+
+    @property
+    def memory_bytes(self) -> int:
+        """Approximate size of the values held in memory."""
+        return self._bytes
+
+    def _remember(self, key: str, value: Any, ttl: float | None) -> None:
+        """Put *value* at the most recently used end, evicting from the other end to stay in bounds."""
+        size = _approx_size(value)
+        ttls = [t for t in (ttl, self.ttl) if t is not None]
+        expires_at = time.monotonic() + min(ttls) if ttls else None
+        with self._lock:
+            if (old := self._entries.pop(key, None)) is not None:
+                self._bytes -= old[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, expires_at)
+            self._bytes += size
+            stats = self._stats["memory"]
+            stats.sets += 1
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                stats.evictions += 1
+
+    def _forget(self, key: str) -> None:
+        with self._lock:
+            if (old := self._entries.pop(key, None)) is not None:
+                self._bytes -= old[1]
+
+    def _recall(self, key: str) -> tuple[bool, Any]:
+        """Return ``(found, value)`` from memory, marking *key* as most recently used."""
+        start = time.perf_counter()
+        with self._lock:
+            stats = self._stats["memory"]
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                del self._entries[key]
+                self._bytes -= entry[1]
+                stats.expirations += 1
+                entry = None
+            elif entry is not None:
+                self._entries.move_to_end(key)
+            if entry is not None:
+                stats.hits += 1
+            else:
+                stats.misses += 1
+            stats.get_seconds += time.perf_counter() - start
+        return (True, entry[0]) if entry is not None else (False, None)
+
+    def _count_backend(self, start: float, *, value: Any = None, write: bool = False) -> None:
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stats = self._stats["backend"]
+            if write:
+                stats.sets += 1
+                stats.set_seconds += elapsed
+                return
+            stats.get_seconds += elapsed
+            if value is not None:
+                stats.hits += 1
+            else:
+                stats.misses += 1
+        track_cache_lookup("backend" if value is not None else None)
+
+    def get_cache(self, key, **kwargs):
+        """Return *key* from memory, else from the backend (remembering it), else ``None``."""
+        found, value = self._recall(key)
+        if found:
+            track_cache_lookup("memory")
+            return value
+        start = time.perf_counter()
+        value = self.backend.get_cache(key, **kwargs)
+        self._count_backend(start, value=value)
+        if value is not None:
+            self._remember(key, value, None)
+        return value
+
+    async def async_get_cache(self, key, **kwargs):
+        """Async :meth:`get_cache`; memory hits return without leaving the event loop."""
+        found, value = self._recall(key)
+        if found:
+            track_cache_lookup("memory")
+            return value
+        start = time.perf_counter()
+        value = await self.backend.async_get_cache(key, **kwargs)
+        self._count_backend(start, value=value)
+        if value is not None:
+            self._remember(key, value, None)
+        return value
+
+    def batch_get_cache(self, keys: list, **kwargs):
+        """Return the values stored under *keys*, ``None`` where missing."""
+        return [self.get_cache(key, **kwargs) for key in keys]
+
+    async def async_batch_get_cache(self, keys: list, **kwargs):
+        """Async :meth:`batch_get_cache`."""
+        return [await self.async_get_cache(key, **kwargs) for key in keys]
+
+    def set_cache(self, key, value, **kwargs):
+        """Write *value* to the backend, then to memory."""
+        start = time.perf_counter()
+        self.backend.set_cache(key, value, **kwargs)
+        self._count_backend(start, write=True)
+        self._remember(key, value, kwargs.get("ttl"))
+
+    async def async_set_cache(self, key, value, **kwargs):
+        """Async :meth:`set_cache`."""
+        start = time.perf_counter()
+        await self.backend.async_set_cache(key, value, **kwargs)
+        self._count_backend(start, write=True)
+        self._remember(key, value, kwargs.get("ttl"))
+
+    async def async_set_cache_pipeline(self, cache_list, **kwargs):
+        """Write every ``(key, value)`` pair in *cache_list* to the backend, then to memory."""
+        start = time.perf_counter()
+        await self.backend.async_set_cache_pipeline(cache_list, **kwargs)
+        self._count_backend(start, write=True)
+        for key, value in cache_list:
+            self._remember(key, value, kwargs.get("ttl"))
+
+    def increment_cache(self, key, value: int, **kwargs) -> int:
+        """Increment *key* in the backend and remember the result."""
+        total = self.backend.increment_cache(key, value, **kwargs)
+        self._remember(key, total, kwargs.get("ttl"))
+        return total
+
+    async def async_increment(self, key, value: int, **kwargs) -> int:
+        """Async :meth:`increment_cache`."""
+        total = await self.backend.async_increment(key, value, **kwargs)
+        self._remember(key, total, kwargs.get("ttl"))
+        return total
+
+    def delete_cache(self, key):
+        """Remove *key* from both tiers."""
+        self._forget(key)
+        self.backend.delete_cache(key)
+
+    def flush_cache(self):
+        """Empty both tiers."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        self.backend.flush_cache()
+
+    async def disconnect(self):
+        """Disconnect the backend."""
+        await self.backend.disconnect()
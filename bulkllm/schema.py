@@ -78,18 +78,23 @@ class LLMConfig(CiBaseModel):
 
         return self
 
-    def completion_kwargs(self) -> dict[str, Any]:
+    def completion_kwargs(self, *, stream: bool = False) -> dict[str, Any]:
         """
         Return the base keyword-arguments for a litellm completion call that
         depend *solely* on this config.  The caller is still responsible for
         adding a ``messages`` list and final token-window parameters.
+
+        With *stream*, the kwargs request a streamed response whose final
+        chunk carries usage, as :func:`bulkllm.llm.astream` expects.
         """
         completion_kwargs: dict[str, Any] = {
             "model": self.litellm_model_name,
             "temperature": self.temperature,
-            "stream": False,
+            "stream": stream,
             "timeout": self.timeout,
         }
+        if stream:
+            completion_kwargs["stream_options"] = {"include_usage": True}
 
         if self.reasoning_effort:
             if self.litellm_model_name.startswith("openrouter/"):
@@ -136,3 +141,12 @@ class LLMConfig(CiBaseModel):
             completion_kwargs["user"] = completion_kwargs.get("user", "") + str(completion_kwargs["reasoning"])
 
         return completion_kwargs
+
+    def bulkllm_kwargs(self, *, stream: bool = False) -> dict[str, Any]:
+        """
+        Return :meth:`completion_kwargs` plus the options of :mod:`bulkllm.llm`'s wrappers.
+
+        Adds ``estimate_key`` (this config's slug) so output lengths are
+        learned per config.  Not for calling litellm directly.
+        """
+        return {**self.completion_kwargs(stream=stream), "estimate_key": self.slug}
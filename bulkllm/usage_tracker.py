@@ -11,6 +11,8 @@ Public API
 * ``UsageTracker`` - async (and sync) context manager accumulating
   per-model aggregates.  A module-level ``GLOBAL_TRACKER`` is always
   active.
+* ``track_cache_lookup(...)`` - count a response-cache lookup and the tier
+  that answered it; ``UsageTracker.cache_snapshot()`` reports the hit ratio.
 
 The module intentionally omits any thread-safety primitives, export, or
 reporting utilities.
@@ -61,6 +63,9 @@ class UsageRecord(BaseModel):
 
     # ---- timing & cost ----
     time_ms: float | None = None
+    # Streaming only: delay until the first content chunk, and the mean gap between content chunks after it
+    time_to_first_token_ms: float | None = None
+    inter_token_latency_ms: float | None = None
     cost_usd: float | None = None
 
     # ---- metadata ----
@@ -83,8 +88,8 @@ class UsageRecord(BaseModel):
                 continue
             if isinstance(v, int | float) and v == 0:
                 continue
-            # Round time_ms to 3 decimal places
-            if k == "time_ms" and v is not None:
+            # Round latencies (time_ms etc.) to 3 decimal places
+            if k.endswith("_ms"):
                 filtered[k] = round(v, 3)
             else:
                 filtered[k] = v
@@ -178,8 +183,8 @@ class UsageAggregate(BaseModel):
                 self.invalid_count.add(1)
 
             for field_name, value in r.__dict__.items():
-                # round the time_ms
-                if field_name == "time_ms" and field_name not in self.stats:
+                # round the latencies (time_ms etc.)
+                if field_name.endswith("_ms") and field_name not in self.stats:
                     self.stats[field_name] = UsageStat(round_to=1)
                 if isinstance(value, int | float | bool) and field_name != "model":
                     self.stats[field_name].add(value)
@@ -208,12 +213,14 @@ class UsageAggregate(BaseModel):
 class UsageTracker:
     """Async-safe accumulator shared via a contextvar stack."""
 
-    __slots__ = ("_aggregates", "_token", "name")
+    __slots__ = ("_aggregates", "_cache_lookups", "_token", "name")
 
     def __init__(self, name: str | None = None) -> None:
         """Initialise an empty tracker with an optional name."""
         self.name = name or "Unnamed"
         self._aggregates: dict[str, UsageAggregate] = {}
+        # tier that answered -> lookups; ``None`` counts misses
+        self._cache_lookups: dict[str | None, int] = {}
         self._token: contextvars.Token | None = None
 
     # ------------------------------------------------------------- context mgr
@@ -251,11 +258,27 @@ class UsageTracker:
         agg = self._aggregates.setdefault(record.model, UsageAggregate(model=record.model))
         agg.add(record)
 
+    def _add_cache_lookup(self, tier: str | None) -> None:
+        """Internal helper to count a cache lookup answered by *tier* (``None`` for a miss)."""
+        self._cache_lookups[tier] = self._cache_lookups.get(tier, 0) + 1
+
     # ------------------------------------------------------------- public API
     def snapshot(self) -> dict[str, Any]:
         """Deep-copy view for diagnostics."""
         return {m: agg.snapshot() for m, agg in self._aggregates.items()}
 
+    def cache_snapshot(self) -> dict[str, Any]:
+        """Response-cache hits, misses and hit ratio, overall and for each tier that answered."""
+        hits = sum(count for tier, count in self._cache_lookups.items() if tier is not None)
+        misses = self._cache_lookups.get(None, 0)
+        lookups = hits + misses
+        tiers = {
+            tier: {"hits": count, "hit_ratio": count / lookups}
+            for tier, count in self._cache_lookups.items()
+            if tier is not None
+        }
+        return {"hits": hits, "misses": misses, "hit_ratio": hits / lookups if lookups else 0.0, "tiers": tiers}
+
     def aggregate_stats(self) -> dict[str, UsageAggregate]:
         """Return access to the internal aggregates mapping."""
         return self._aggregates
@@ -266,8 +289,11 @@ class UsageTracker:
 # ---------------------------------------------------------------------------
 
 GLOBAL_TRACKER = UsageTracker("global")
-_usage_stack_var: contextvars.ContextVar[tuple[UsageTracker, ...]] = contextvars.ContextVar("_usage_stack_var")
-_usage_stack_var.set((GLOBAL_TRACKER,))
+# A default rather than a module-level set(), so threads started without a
+# copied context (e.g. executor workers) still record to GLOBAL_TRACKER.
+_usage_stack_var: contextvars.ContextVar[tuple[UsageTracker, ...]] = contextvars.ContextVar(
+    "_usage_stack_var", default=(GLOBAL_TRACKER,)
+)
 
 
 # ---------------------------------------------------------------------------
@@ -454,3 +480,9 @@ def track_usage(
     # ------------------------------------------------------------------ push to all active trackers
     for tracker in _usage_stack_var.get():
         tracker._add_record(_rec)
+
+
+def track_cache_lookup(tier: str | None) -> None:
+    """Count one response-cache lookup, answered by *tier* or missed (``None``), on every active tracker."""
+    for tracker in _usage_stack_var.get():
+        tracker._add_cache_lookup(tier)
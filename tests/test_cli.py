@@ -655,3 +655,21 @@ def test_list_configs_estimated_cost(monkeypatch):
     assert "est_cost" in lines[0]
     row = [c.strip() for c in lines[2].split("|")]
     assert row[-1] == "0.00020"
+
+
+def test_limiter_server_command(monkeypatch):
+    import bulkllm.cli as cli_mod
+
+    calls = []
+
+    async def fake_serve(**kwargs):
+        calls.append(kwargs)
+
+    monkeypatch.setattr(cli_mod, "serve", fake_serve)
+
+    runner = CliRunner()
+    result = runner.invoke(app, ["limiter-server", "--port", "9000"])
+
+    assert result.exit_code == 0
+    assert "127.0.0.1:9000" in result.output
+    assert calls == [{"host": "127.0.0.1", "port": 9000, "path": None}]
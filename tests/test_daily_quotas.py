@@ -0,0 +1,117 @@
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from bulkllm.daily_quotas import DailyQuotaStore, DailyUsage
+from bulkllm.rate_limiter import DailyQuotaExceededError, ModelRateLimit, RateLimiter
+
+
+@pytest.fixture
+def store(tmp_path) -> DailyQuotaStore:
+    return DailyQuotaStore(tmp_path / "quotas.sqlite")
+
+
+def test_store_accumulates_per_day(store: DailyQuotaStore) -> None:
+    assert store.usage("m", "2025-01-01") == DailyUsage()
+    store.add("m", "2025-01-01", 1, 10, 0.5)
+    assert store.add("m", "2025-01-01", 1, 5, 0.25) == DailyUsage(2, 15, 0.75)
+    assert store.usage("m", "2025-01-02") == DailyUsage()
+    assert store.usage("other", "2025-01-01") == DailyUsage()
+
+
+def test_increments_are_buffered_until_flushed(store: DailyQuotaStore, tmp_path) -> None:
+    assert store._connection().execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    store.add("m", "2025-01-01", 1, 10, 0.5)
+    store.add("m", "2025-01-01", 1, 5, 0.25)
+    other_process = DailyQuotaStore(tmp_path / "quotas.sqlite")
+    assert other_process.usage("m", "2025-01-01") == DailyUsage()
+    assert store._read("m", "2025-01-01") == DailyUsage()
+
+    # Both increments are written in one flush, which also reads back the other process's usage
+    other_process.add("m", "2025-01-01", 3, 0, 0.0)
+    other_process.flush()
+    store.flush()
+    assert store._read("m", "2025-01-01") == DailyUsage(5, 15, 0.75)
+    assert store.usage("m", "2025-01-01") == DailyUsage(5, 15, 0.75)
+    store.flush()
+    assert store._read("m", "2025-01-01") == DailyUsage(5, 15, 0.75)
+
+
+def test_background_thread_flushes_periodically(tmp_path) -> None:
+    store = DailyQuotaStore(tmp_path / "quotas.sqlite", flush_interval=0.01)
+    store.add("m", "2025-01-01", 2, 0, 0.0)
+    deadline = time.monotonic() + 2
+    while store._read("m", "2025-01-01") != DailyUsage(2, 0, 0.0) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert store._read("m", "2025-01-01") == DailyUsage(2, 0, 0.0)
+    store.add("m", "2025-01-01", 1, 0, 0.0)
+    store.close()
+    assert store._read("m", "2025-01-01") == DailyUsage(3, 0, 0.0)
+
+
+def test_rpd_enforced_and_survives_restart(store: DailyQuotaStore) -> None:
+    limit = ModelRateLimit(model_names=["m"], rpd=2, daily_quota_store=store)
+    with limit.reserve_capacity_sync(1, 1) as ctx:
+        ctx.record_usage_sync(1, 1)
+    # A request still in flight counts towards the quota too
+    pending = limit.acquire_sync(1, 1)
+    with pytest.raises(DailyQuotaExceededError, match="Daily request quota"):
+        limit.has_capacity(1, 1)
+    limit.record_actual_usage_sync(pending, 1, 1)
+
+    restarted = ModelRateLimit(model_names=["m"], rpd=2, daily_quota_store=store)
+    with pytest.raises(DailyQuotaExceededError, match="Daily request quota"):
+        restarted.reserve_capacity_sync(1, 1)
+
+
+def test_cached_hits_do_not_count(store: DailyQuotaStore) -> None:
+    limit = ModelRateLimit(model_names=["m"], rpd=1, daily_quota_store=store)
+    for _ in range(3):
+        with limit.reserve_capacity_sync(1, 1) as ctx:
+            ctx.record_usage_sync(1, 1, cached_hit=True)
+    assert limit.has_capacity(1, 1)
+
+
+def test_tpd_and_daily_cost(store: DailyQuotaStore) -> None:
+    limit = ModelRateLimit(model_names=["m"], tpd=100, daily_cost_usd=1.0, daily_quota_store=store)
+    with limit.reserve_capacity_sync(30, 30) as ctx:
+        ctx.record_usage_sync(30, 30, cost_usd=0.4)
+    assert limit.has_capacity(20, 20)
+    with pytest.raises(DailyQuotaExceededError, match="Daily token quota"):
+        limit.has_capacity(20, 21)
+
+    with limit.reserve_capacity_sync(1, 1) as ctx:
+        ctx.record_usage_sync(1, 1, cost_usd=0.6)
+    with pytest.raises(DailyQuotaExceededError, match="Daily spend cap"):
+        limit.has_capacity(1, 1)
+
+
+def test_day_follows_quota_timezone(store: DailyQuotaStore) -> None:
+    limit = ModelRateLimit(model_names=["m"], rpd=5, quota_timezone="America/Los_Angeles", daily_quota_store=store)
+    limit.has_capacity(1, 1)
+    assert limit._day == datetime.now(ZoneInfo("America/Los_Angeles")).date().isoformat()
+    assert 0 < limit._day_ends_at - time.time() <= 25 * 3600
+
+    # Usage recorded under another day does not count today
+    store.add(limit.shared_key, "2000-01-01", 100, 0, 0.0)
+    limit._day_ends_at = 0  # force a reload
+    assert limit.has_capacity(1, 1)
+
+
+@pytest.mark.asyncio
+async def test_chain_checks_daily_quota_on_outer_level(store: DailyQuotaStore) -> None:
+    org = ModelRateLimit(model_names=[".*"], is_regex=True, level="org", rpd=1, daily_quota_store=store)
+    model = ModelRateLimit(model_names=["m"], rpm=10)
+    limiter = RateLimiter([model, org])
+    async with await limiter.reserve_capacity("m", 1, 1) as ctx:
+        await ctx.record_usage(1, 1, cost_usd=0.01)
+    with pytest.raises(DailyQuotaExceededError, match="Daily request quota"):
+        await limiter.reserve_capacity("m", 1, 1)
+    assert not model._pending_requests
+
+
+def test_default_openrouter_free_limit() -> None:
+    limit = RateLimiter().get_rate_limit_for_model("openrouter/meta-llama/llama-3.3-70b-instruct:free")
+    assert (limit.rpm, limit.rpd) == (20, 50)
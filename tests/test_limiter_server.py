@@ -0,0 +1,192 @@
+import asyncio
+import contextlib
+
+import pytest
+
+from bulkllm import limiter_server
+from bulkllm.daily_quotas import DailyQuotaStore
+from bulkllm.limiter_server import LimiterClient, LimiterServer, LimiterServerError
+from bulkllm.rate_limiter import DailyQuotaExceededError, ModelRateLimit, RateLimiter
+
+
+@contextlib.asynccontextmanager
+async def _server(**limit_kwargs):
+    limit = ModelRateLimit(model_names=["m"], **limit_kwargs)
+    server = await LimiterServer(RateLimiter([limit])).start(host="127.0.0.1", port=0)
+    async with server:
+        yield limit, server.sockets[0].getsockname()[1]
+
+
+async def _settle(predicate) -> None:
+    """Wait for fire-and-forget messages to reach the server."""
+    async with asyncio.timeout(2):
+        while not predicate():  # noqa: ASYNC110 - polling state changed by the server
+            await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_reserve_and_record_round_trip():
+    async with _server(rpm=10) as (limit, port), LimiterClient(port=port, lease_size=1) as client:
+        async with await client.reserve_capacity("m", 10, 5) as ctx:
+            assert limit.current_requests_in_window == 1
+            await ctx.record_usage(7, 3)
+        await _settle(lambda: not limit._pending_requests)
+        assert limit.current_input_tokens_in_window == 7
+        assert limit.current_output_tokens_in_window == 3
+        assert await client.status("m") == {"requests": 1, "input_tokens": 7, "output_tokens": 3}
+
+
+@pytest.mark.asyncio
+async def test_limit_is_shared_between_clients():
+    async with (
+        _server(rpm=2) as (limit, port),
+        LimiterClient(port=port, lease_size=1) as a,
+        LimiterClient(port=port, lease_size=1) as b,
+    ):
+        await a.reserve_capacity("m", 1, 1)
+        await b.reserve_capacity("m", 1, 1)
+        with pytest.raises(TimeoutError):
+            async with asyncio.timeout(0.2):
+                await a.reserve_capacity("m", 1, 1)
+        assert limit.current_requests_in_window == 2
+
+
+@pytest.mark.asyncio
+async def test_leases_avoid_round_trips():
+    async with _server(rpm=100) as (limit, port), LimiterClient(port=port, lease_size=4) as client:
+        for _ in range(4):
+            async with await client.reserve_capacity("m", 10, 10) as ctx:
+                await ctx.record_usage(10, 10)
+        assert client.round_trips == 1
+        # A larger estimate than the leases cover needs a fresh reservation.
+        async with await client.reserve_capacity("m", 20, 10) as ctx:
+            await ctx.record_usage(20, 10)
+        assert client.round_trips == 2
+        await _settle(lambda: limit.current_requests_in_window == 5 + 3)
+
+
+@pytest.mark.asyncio
+async def test_close_and_disconnect_release_capacity():
+    async with _server(rpm=40) as (limit, port):
+        client = LimiterClient(port=port, lease_size=4)
+        await client.connect()
+        await client.reserve_capacity("m", 1, 1)
+        assert limit.current_requests_in_window == 4
+        # Closing releases the unused leases; the outstanding reservation is
+        # cancelled by the server when the connection drops.
+        await client.aclose()
+        await _settle(lambda: limit.current_requests_in_window == 0)
+
+
+@pytest.mark.asyncio
+async def test_leases_are_capped_at_a_fraction_of_the_tightest_limit():
+    async with _server(rpm=1000, tpm=1000) as (limit, port), LimiterClient(port=port, lease_size=50) as client:
+        # 10% of tpm is 100 tokens, enough for five more 20-token reservations
+        await client.reserve_capacity("m", 10, 10)
+        assert limit.current_requests_in_window == 6
+        # Leases also hold concurrency slots, so they are capped by max_concurrency too;
+        # the larger estimate skips the held leases and reserves afresh
+        limit.max_concurrency = 10
+        await client.reserve_capacity("m", 20, 20)
+        assert limit.current_requests_in_window == 6 + 1 + 1
+
+
+@pytest.mark.asyncio
+async def test_status_expires_requests_that_left_the_window():
+    async with _server(rpm=10) as (limit, port), LimiterClient(port=port, lease_size=1) as client:
+        async with await client.reserve_capacity("m", 10, 5) as ctx:
+            await ctx.record_usage(7, 3)
+        await _settle(lambda: limit._completed_requests)
+        limit._completed_requests[0].request_completion_timestamp -= limit.window_seconds + 1
+        assert await client.status("m") == {"requests": 0, "input_tokens": 0, "output_tokens": 0}
+
+
+@pytest.mark.asyncio
+async def test_sync_reservations_block_from_other_threads_only():
+    async with _server(rpm=10) as (limit, port), LimiterClient(port=port, lease_size=1) as client:
+
+        def reserve_and_record() -> None:
+            with client.reserve_capacity_sync("m", 10, 5) as ctx:
+                ctx.record_usage_sync(7, 3)
+
+        await asyncio.to_thread(reserve_and_record)
+        await _settle(lambda: limit.current_input_tokens_in_window == 7)
+        with pytest.raises(LimiterServerError, match="await reserve_capacity instead"):
+            client.reserve_capacity_sync("m", 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_server_expires_unclaimed_leases(monkeypatch):
+    monkeypatch.setattr(limiter_server, "LEASE_GRACE_SECONDS", 0.0)
+    async with _server(rpm=100) as (limit, port), LimiterClient(port=port, lease_size=4, lease_ttl=0.2) as client:
+        await client.reserve_capacity("m", 1, 1)
+        await client.reserve_capacity("m", 1, 1)
+        assert limit.current_requests_in_window == 4
+        # No further requests arrive, yet the two unclaimed leases are returned
+        await _settle(lambda: limit.current_requests_in_window == 2)
+        assert len(limit._pending_requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_contexts_can_be_finished_from_sync_threads():
+    async with _server(rpm=10) as (limit, port), LimiterClient(port=port, lease_size=1) as client:
+        recorded = await client.reserve_capacity("m", 10, 5)
+        cancelled = await client.reserve_capacity("m", 10, 5)
+
+        def finish() -> None:
+            recorded.record_usage_sync(7, 3)
+            with contextlib.suppress(ValueError), cancelled:
+                raise ValueError
+
+        await asyncio.to_thread(finish)
+        await _settle(lambda: not limit._pending_requests)
+        assert limit.current_input_tokens_in_window == 7
+        assert limit.current_requests_in_window == 1
+
+
+@pytest.mark.asyncio
+async def test_unknown_op_is_reported():
+    async with _server() as (_, port), LimiterClient(port=port) as client:
+        with pytest.raises(LimiterServerError, match="Unknown op"):
+            await client._call({"op": "bogus"})
+
+
+@pytest.mark.asyncio
+async def test_daily_quota_errors_reach_the_client(tmp_path):
+    store = DailyQuotaStore(tmp_path / "quotas.sqlite")
+    async with _server(rpm=100, rpd=2, daily_quota_store=store) as (limit, port):
+        async with LimiterClient(port=port, lease_size=4) as client:
+            # The extra leases stop at the quota instead of failing the reservation
+            await client.reserve_capacity("m", 1, 1)
+            assert limit.current_requests_in_window == 2
+        await _settle(lambda: limit.current_requests_in_window == 0)
+        limit._record_daily_usage(1, 0.0)
+        limit._record_daily_usage(1, 0.0)
+        async with LimiterClient(port=port, lease_size=1) as client:
+            with pytest.raises(DailyQuotaExceededError, match="Daily request quota"):
+                await client.reserve_capacity("m", 1, 1)
+            # The server is still serving the connection afterwards
+            assert (await client.status("m"))["requests"] == 0
+
+
+@pytest.mark.asyncio
+async def test_unexpected_errors_get_a_reply(monkeypatch):
+    async with _server() as (limit, port), LimiterClient(port=port) as client:
+
+        def broken():
+            raise RuntimeError("window broke")
+
+        monkeypatch.setattr(limit, "_window_usage", broken)
+        with pytest.raises(LimiterServerError, match="RuntimeError: window broke"):
+            await client.status("m")
+
+
+@pytest.mark.asyncio
+async def test_unix_socket(tmp_path):
+    path = str(tmp_path / "limiter.sock")
+    limit = ModelRateLimit(model_names=["m"], rpm=10)
+    server = await LimiterServer(RateLimiter([limit])).start(path=path)
+    async with server, LimiterClient(path=path) as client:
+        async with await client.reserve_capacity("m", 1, 1) as ctx:
+            await ctx.record_usage(1, 1)
+        assert (await client.status("m"))["requests"] >= 1
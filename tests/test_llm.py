@@ -1,8 +1,21 @@
+import functools
+import math
 import os
+import threading
 import time
 
+import anyio
+import httpx
+import litellm
 import pytest
 
+import bulkllm.llm as llm_mod
+from bulkllm.output_estimator import OutputTokenEstimator
+from bulkllm.rate_limiter import ModelRateLimit, RateLimiter
+from bulkllm.response_cache import ShardedSQLiteCache, TieredCache
+from bulkllm.schema import LLMConfig
+from bulkllm.usage_tracker import UsageTracker
+
 
 @pytest.mark.skipif(not os.getenv("OPENAI_API_KEY"), reason="requires OPENAI_API_KEY")
 def test_helloworld():
@@ -45,6 +58,447 @@ def test_created_field_cached_after_5_seconds():
     )
 
 
+def _fake_response(headers: dict[str, str]) -> litellm.ModelResponse:
+    response = litellm.ModelResponse(
+        model="openai/gpt-4o", usage={"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7}
+    )
+    response._hidden_params = {"response_cost": 0.0, "additional_headers": headers}
+    return response
+
+
+@pytest.fixture
+def llm_env(monkeypatch):
+    """Route ``bulkllm.llm`` through one ``openai/gpt-4o`` limit; returns setup(*, cache=True, **limit_kwargs)."""
+
+    def setup(*, cache: bool = True, **limit_kwargs) -> tuple[ModelRateLimit, list]:
+        limit = ModelRateLimit(model_names=["openai/gpt-4o"], **limit_kwargs)
+        monkeypatch.setattr(llm_mod, "rate_limiter", lambda: RateLimiter([limit]))
+        monkeypatch.setattr(llm_mod, "initialize_litellm", lambda: None)
+        monkeypatch.setattr(litellm, "cache", litellm.Cache(type="local") if cache else None)
+        tracked = []
+        monkeypatch.setattr(llm_mod, "track_usage", lambda model, record: tracked.append(record))
+        return limit, tracked
+
+    return setup
+
+
+@pytest.mark.asyncio
+async def test_acompletion_adapts_limits_from_response_headers(monkeypatch, llm_env):
+    limit, _ = llm_env(rpm=100, tpm=100_000)
+
+    async def fake_acompletion(*args, **kwargs):
+        return _fake_response({"x-ratelimit-limit-requests": "300", "llm_provider-retry-after": "0"})
+
+    monkeypatch.setattr(litellm, "acompletion", fake_acompletion)
+    await llm_mod._acompletion(model="openai/gpt-4o", messages=[{"role": "user", "content": "hi"}])
+    assert limit.rpm == 300
+    assert limit.tpm == 100_000
+
+
+def test_completion_adapts_limits_from_response_headers(monkeypatch, llm_env):
+    limit, _ = llm_env(rpm=100)
+
+    @functools.wraps(litellm.completion)  # keeps the signature used to bind arguments
+    def fake_completion(*args, **kwargs):
+        return _fake_response({"x-ratelimit-limit-requests": "50"})
+
+    monkeypatch.setattr(litellm, "completion", fake_completion)
+
+    llm_mod._completion(model="openai/gpt-4o", messages=[{"role": "user", "content": "hi"}])
+    assert limit.rpm == 50
+
+
+@pytest.mark.asyncio
+async def test_acompletion_rate_limit_error_backs_off(monkeypatch, llm_env):
+    limit, _ = llm_env(rpm=100)
+
+    async def fake_acompletion(*args, **kwargs):
+        raise litellm.exceptions.RateLimitError(
+            "slow down",
+            llm_provider="openai",
+            model="gpt-4o",
+            response=httpx.Response(429, headers={"retry-after": "30"}),
+        )
+
+    monkeypatch.setattr(litellm, "acompletion", fake_acompletion)
+    with pytest.raises(litellm.exceptions.RateLimitError):
+        await llm_mod._acompletion(model="openai/gpt-4o", messages=[{"role": "user", "content": "hi"}])
+    assert limit.rpm == 50
+    assert not limit.has_capacity(1, 1)  # every waiter honours the retry-after pause
+
+
+def test_completion_reserves_learned_output_tokens(monkeypatch, llm_env):
+    limit, _ = llm_env(cache=False, otpm=100_000)
+    estimator = OutputTokenEstimator(warmup=2, headroom=1.0)
+    monkeypatch.setattr(llm_mod, "output_estimator", lambda: estimator)
+    reserved = []
+
+    @functools.wraps(litellm.completion)  # keeps the signature used to bind arguments
+    def fake_completion(*args, **kwargs):
+        reserved.append(limit._pending_output_tokens)
+        return _fake_response({})
+
+    monkeypatch.setattr(litellm, "completion", fake_completion)
+    for _ in range(3):
+        llm_mod._completion(
+            model="openai/gpt-4o", messages=[{"role": "user", "content": "hi"}], max_tokens=8000, estimate_key="slug"
+        )
+    # Warm-up reserves max_tokens, then the observed 2-token completions
+    assert reserved == [8000, 8000, 2]
+    assert estimator.learned("slug") == estimator.learned("openai/gpt-4o") == 2
+
+
+def test_config_kwargs_learn_output_tokens_under_the_slug(monkeypatch, llm_env):
+    llm_env(cache=False)
+    estimator = OutputTokenEstimator(warmup=1, headroom=1.0)
+    monkeypatch.setattr(llm_mod, "output_estimator", lambda: estimator)
+    forwarded = []
+
+    @functools.wraps(litellm.completion)
+    def fake_completion(*args, **kwargs):
+        forwarded.append(kwargs)
+        return _fake_response({})
+
+    monkeypatch.setattr(litellm, "completion", fake_completion)
+    config = LLMConfig(
+        slug="gpt-4o-terse",
+        display_name="GPT-4o terse",
+        company_name="OpenAI",
+        litellm_model_name="openai/gpt-4o",
+        llm_family="gpt-4o",
+        temperature=0.0,
+        max_tokens=100,
+    )
+    llm_mod._completion(**config.bulkllm_kwargs(), messages=[{"role": "user", "content": "hi"}])
+
+    assert estimator.learned("gpt-4o-terse") == 2
+    assert "estimate_key" not in forwarded[0]
+
+
+@pytest.mark.asyncio
+async def test_cache_hits_skip_the_rate_limiter(monkeypatch, llm_env):
+    limit, tracked = llm_env(rpm=1)
+    calls = []
+
+    async def fake_acompletion(*args, **kwargs):
+        calls.append(kwargs)
+        return _fake_response({})
+
+    monkeypatch.setattr(litellm, "acompletion", fake_acompletion)
+    cached = {"model": "openai/gpt-4o", "messages": [{"role": "user", "content": "cached"}]}
+    litellm.cache.add_cache(_fake_response({}).model_dump(), **cached)
+    # The only request slot is taken, so anything entering the limiter would block
+    limit.reserve_capacity_sync(1, 1)
+
+    with anyio.fail_after(1):
+        for _ in range(3):
+            response = await llm_mod._acompletion(**cached)
+            assert response.is_cached_hit
+            assert response.usage.prompt_tokens == 5
+    sync_response = llm_mod._completion(**cached)
+    assert sync_response.is_cached_hit
+    assert calls == []
+    assert [record.is_cached_hit for record in tracked] == [True] * 4
+    assert limit.current_requests_in_window == 1
+
+    # Misses and explicit cache bypasses still go through the limiter
+    limit.rpm = 10
+    await llm_mod._acompletion(**cached, cache={"no-cache": True})
+    await llm_mod._acompletion(model="openai/gpt-4o", messages=[{"role": "user", "content": "new"}])
+    assert len(calls) == 2
+    assert limit.current_requests_in_window == 3
+
+
+def _count_cache_reads(monkeypatch):
+    backend = litellm.cache.cache
+    reads = []
+    get_cache, async_get_cache = backend.get_cache, backend.async_get_cache
+
+    async def counting_async_get_cache(key, **kwargs):
+        reads.append(key)
+        return await async_get_cache(key, **kwargs)
+
+    # The in-memory backend's async read calls its sync one, so only one of them is counted
+    monkeypatch.setattr(backend, "async_get_cache", counting_async_get_cache)
+    return reads, lambda: monkeypatch.setattr(
+        backend, "get_cache", lambda key, **kw: reads.append(key) or get_cache(key, **kw)
+    )
+
+
+@pytest.mark.asyncio
+async def test_checked_misses_read_the_cache_backend_once(monkeypatch, llm_env):
+    llm_env(rpm=100)
+    reads, _ = _count_cache_reads(monkeypatch)
+    request = {"model": "openai/gpt-4o", "messages": [{"role": "user", "content": "once"}], "mock_response": "hi"}
+
+    assert not (await llm_mod._acompletion(**request)).is_cached_hit
+    assert len(reads) == 1
+    # The response is still written back (by a background task), so the repeat is a single-read hit
+    with anyio.fail_after(2):
+        while not litellm.cache.cache.cache_dict:  # noqa: ASYNC110 - polling LiteLLM's background write
+            await anyio.sleep(0.01)
+    assert (await llm_mod._acompletion(**request)).is_cached_hit
+    assert len(reads) == 2
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_counts_each_lookup_once(llm_env, tmp_path):
+    llm_env(rpm=100)
+    tiered = litellm.cache.cache = TieredCache(ShardedSQLiteCache(tmp_path))
+    request = {"model": "openai/gpt-4o", "messages": [{"role": "user", "content": "count"}], "mock_response": "hi"}
+
+    with UsageTracker("run") as tracker:
+        assert not (await llm_mod._acompletion(**request)).is_cached_hit
+        with anyio.fail_after(2):
+            while not tiered.stats()["backend"].sets:  # noqa: ASYNC110 - polling LiteLLM's background write
+                await anyio.sleep(0.01)
+        assert (await llm_mod._acompletion(**request)).is_cached_hit
+
+    assert tracker.cache_snapshot() == {
+        "hits": 1,
+        "misses": 1,
+        "hit_ratio": 0.5,
+        "tiers": {"memory": {"hits": 1, "hit_ratio": 0.5}},
+    }
+    stats = tiered.stats()
+    assert (stats["memory"].hits, stats["memory"].misses) == (1, 1)
+    assert (stats["backend"].hits, stats["backend"].misses, stats["backend"].sets) == (0, 1, 1)
+
+
+def test_sync_checked_misses_read_the_cache_backend_once(monkeypatch, llm_env):
+    llm_env(rpm=100)
+    reads, count_sync_reads = _count_cache_reads(monkeypatch)
+    count_sync_reads()
+    request = {"model": "openai/gpt-4o", "messages": [{"role": "user", "content": "once"}], "mock_response": "hi"}
+
+    assert not llm_mod._completion(**request).is_cached_hit
+    assert len(reads) == 1
+    assert llm_mod._completion(**request).is_cached_hit
+    assert len(reads) == 2
+
+
+@pytest.mark.asyncio
+async def test_identical_concurrent_calls_share_one_request(monkeypatch, llm_env):
+    calls = []
+    release = anyio.Event()
+
+    async def fake_acompletion(*args, **kwargs):
+        calls.append(kwargs)
+        await release.wait()
+        return _fake_response({})
+
+    limit, tracked = llm_env(rpm=100)
+    monkeypatch.setattr(litellm, "acompletion", fake_acompletion)
+    request = {"model": "openai/gpt-4o", "messages": [{"role": "user", "content": "same"}]}
+    responses = []
+
+    async def call(**extra):
+        responses.append(await llm_mod._acompletion(**request, **extra))
+
+    async with anyio.create_task_group() as tg:
+        for _ in range(50):
+            tg.start_soon(call)
+        # An opted-out request and a sampled one (temperature > 0) make their own calls
+        tg.start_soon(functools.partial(call, coalesce=False))
+        tg.start_soon(functools.partial(call, temperature=0.7))
+        await anyio.sleep(0.05)
+        release.set()
+
+    assert len(calls) == 3
+    assert limit.current_requests_in_window == 3
+    assert sorted(record.is_cached_hit for record in tracked) == [False] * 3 + [True] * 49
+    # Followers get their own copies, marked as the cache hits they were tracked as
+    assert len({id(response) for response in responses}) == 52
+    assert sorted(response.is_cached_hit for response in responses) == [False] * 3 + [True] * 49
+    assert all(response.usage.prompt_tokens == 5 for response in responses)
+    assert not llm_mod._in_flight
+
+
+@pytest.mark.asyncio
+async def test_followers_receive_the_leaders_exception(monkeypatch, llm_env):
+    release = anyio.Event()
+
+    async def fake_acompletion(*args, **kwargs):
+        await release.wait()
+        raise litellm.exceptions.BadRequestError("bad prompt", model="openai/gpt-4o", llm_provider="openai")
+
+    _, tracked = llm_env(rpm=100)
+    monkeypatch.setattr(litellm, "acompletion", fake_acompletion)
+    errors = []
+
+    async def call():
+        try:
+            await llm_mod._acompletion(model="openai/gpt-4o", messages=[{"role": "user", "content": "x"}])
+        except litellm.exceptions.BadRequestError as e:
+            errors.append(e)
+
+    async with anyio.create_task_group() as tg:
+        for _ in range(5):
+            tg.start_soon(call)
+        await anyio.sleep(0.05)
+        release.set()
+
+    assert len(errors) == 5
+    assert len({id(error) for error in errors}) == 1
+    assert tracked == []
+    assert not llm_mod._in_flight
+
+
+@pytest.mark.asyncio
+async def test_a_follower_takes_over_when_the_leader_is_cancelled(monkeypatch, llm_env):
+    calls = []
+
+    async def fake_acompletion(*args, **kwargs):
+        calls.append(kwargs)
+        await anyio.sleep(0.01 if len(calls) > 1 else math.inf)
+        return _fake_response({})
+
+    _, tracked = llm_env(rpm=100)
+    monkeypatch.setattr(litellm, "acompletion", fake_acompletion)
+    request = {"model": "openai/gpt-4o", "messages": [{"role": "user", "content": "x"}]}
+    responses = []
+
+    async def follower():
+        responses.append(await llm_mod._acompletion(**request))
+
+    async with anyio.create_task_group() as tg, anyio.create_task_group() as leader_group:
+        leader_group.start_soon(functools.partial(llm_mod._acompletion, **request))
+        await anyio.sleep(0.01)
+        tg.start_soon(follower)
+        tg.start_soon(follower)
+        await anyio.sleep(0.01)
+        leader_group.cancel_scope.cancel()
+
+    assert len(calls) == 2
+    assert len(responses) == 2
+    assert sorted(record.is_cached_hit for record in tracked) == [False, True]
+
+
+def test_identical_calls_from_threads_share_one_request(monkeypatch, llm_env):
+    calls = []
+    followers = threading.Semaphore(0)
+
+    class CountingFuture(llm_mod.concurrent.futures.Future):
+        def result(self, timeout=None):
+            followers.release()
+            return super().result(timeout)
+
+    def fake_completion(*args, **kwargs):
+        calls.append(kwargs)
+        for _ in range(7):
+            followers.acquire(timeout=5)
+        return _fake_response({})
+
+    limit, tracked = llm_env(rpm=100)
+    monkeypatch.setattr(litellm, "completion", fake_completion)
+    monkeypatch.setattr(llm_mod.concurrent.futures, "Future", CountingFuture)
+    request = {"model": "openai/gpt-4o", "messages": [{"role": "user", "content": "threads"}]}
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(llm_mod._completion(**request))) for _ in range(8)]
+    # The leader answers once the seven followers are waiting on its future
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert len(calls) == 1
+    assert limit.current_requests_in_window == 1
+    assert sorted(record.is_cached_hit for record in tracked) == [False] + [True] * 7
+    # Each follower gets its own copy of the leader's response
+    assert len({id(response) for response in responses}) == 8
+    assert sorted(response.is_cached_hit for response in responses) == [False] + [True] * 7
+    assert not llm_mod._in_flight_sync
+
+
+# Stream tests run uncached, one reservation at a time
+_STREAM_LIMIT = {"cache": False, "rpm": 10, "max_concurrency": 1}
+_STREAM_REQUEST = {
+    "model": "openai/gpt-4o",
+    "messages": [{"role": "user", "content": "hi"}],
+    "mock_response": "hello there world",
+}
+
+
+@pytest.mark.asyncio
+async def test_stream_holds_reservation_and_records_terminal_usage(llm_env):
+    limit, tracked = llm_env(**_STREAM_LIMIT)
+
+    stream = await llm_mod.astream(**_STREAM_REQUEST)
+    text = []
+    async for chunk in stream:
+        # The reservation is held, so the concurrency cap of 1 is taken
+        assert limit._at_max_concurrency()
+        if chunk.choices and chunk.choices[0].delta.content:
+            text.append(chunk.choices[0].delta.content)
+
+    assert "".join(text) == "hello there world"
+    assert not limit._pending_requests
+    assert limit._completed_request_count == 1
+    (record,) = tracked
+    assert record is stream.usage_record
+    assert (record.input_tokens_total, record.output_tokens_total) == (8, 3)
+    assert record.time_to_first_token_ms is not None
+    assert record.time_to_first_token_ms <= record.time_ms
+    assert stream.inter_token_ms.count == 5
+    assert record.inter_token_latency_ms == pytest.approx(stream.inter_token_ms.total / 5)
+
+
+@pytest.mark.asyncio
+async def test_stream_without_terminal_usage_records_an_estimate(llm_env):
+    limit, tracked = llm_env(**_STREAM_LIMIT)
+
+    async with await llm_mod.astream(**_STREAM_REQUEST, stream_options={"include_usage": False}) as stream:
+        async for _ in stream:
+            pass
+
+    expected_output = litellm.token_counter(model="openai/gpt-4o", text="hello there world")
+    assert stream.usage_record.output_tokens_total == expected_output
+    assert stream.usage_record.input_tokens_total > 0
+    assert limit.current_output_tokens_in_window == expected_output
+    assert len(tracked) == 1
+
+
+@pytest.mark.asyncio
+async def test_closing_a_stream_early_releases_the_reservation(monkeypatch, llm_env):
+    limit, tracked = llm_env(**_STREAM_LIMIT)
+
+    async with await llm_mod.astream(**_STREAM_REQUEST) as stream:
+        async for _ in stream:
+            break
+    assert not limit._pending_requests
+    assert tracked[0].output_tokens_total > 0
+    assert [chunk async for chunk in stream] == []
+
+    # A stream that fails to open gives its reservation back
+    async def failing_acompletion(*args, **kwargs):
+        raise litellm.exceptions.BadRequestError("bad", model="openai/gpt-4o", llm_provider="openai")
+
+    monkeypatch.setattr(litellm, "acompletion", failing_acompletion)
+    with pytest.raises(litellm.exceptions.BadRequestError, match="bad"):
+        await llm_mod.astream(**_STREAM_REQUEST)
+    assert not limit._pending_requests
+    assert limit._completed_request_count == 1
+
+
+@pytest.mark.asyncio
+async def test_a_cancelled_close_still_releases_the_reservation(monkeypatch, llm_env):
+    limit, tracked = llm_env(**_STREAM_LIMIT)
+    stream = await llm_mod.astream(**_STREAM_REQUEST)
+    await stream.__anext__()
+
+    async def hanging_aclose():
+        await anyio.sleep(math.inf)
+
+    monkeypatch.setattr(stream._stream, "aclose", hanging_aclose, raising=False)
+    with anyio.move_on_after(0.01) as scope:
+        await stream.aclose()
+
+    assert scope.cancelled_caught
+    assert not limit._pending_requests
+    assert len(tracked) == 1
+    assert [chunk async for chunk in stream] == []
+
+
 if __name__ == "__main__":
     import pytest
 
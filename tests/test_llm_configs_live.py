@@ -38,7 +38,7 @@ def _normalize_content(content) -> str:
 @pytest.mark.skipif(os.getenv("GITHUB_ACTIONS") == "true", reason="Live ping test runs only outside GitHub Actions")
 @pytest.mark.parametrize("llm_config", model_resolver(["all"]), ids=lambda cfg: cfg.slug)
 def test_llm_config_ping(llm_config):
-    kwargs = llm_config.completion_kwargs()
+    kwargs = llm_config.bulkllm_kwargs()
     PROMPT = "Reply with the single lowercase word 'pong'. Do not add any other text. PING"
 
     messages = []
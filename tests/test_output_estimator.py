@@ -0,0 +1,59 @@
+import pytest
+
+from bulkllm.output_estimator import OutputTokenEstimator
+from bulkllm.usage_tracker import UsageRecord
+
+
+def test_warmup_falls_back_to_max_tokens() -> None:
+    est = OutputTokenEstimator(warmup=3)
+    assert est.estimate(8000, "m") == 8000
+    assert est.estimate(None, "m") == 1
+    est.observe(300, "m")
+    est.observe(300, "m")
+    assert est.estimate(8000, "m") == 8000
+    est.observe(300, "m")
+    assert est.estimate(8000, "m") == 330  # 300 with 10% headroom
+
+
+def test_quantile_headroom_and_cap() -> None:
+    est = OutputTokenEstimator(quantile=0.9, warmup=10, headroom=1.0)
+    for tokens in range(1, 11):
+        est.observe(tokens * 100, "m")
+    assert est.estimate(8000, "m") == 900
+    assert est.estimate(500, "m") == 500  # never more than the request allows
+    assert est.estimate(None, "m") == 900
+
+
+def test_window_slides() -> None:
+    est = OutputTokenEstimator(quantile=1.0, window=4, warmup=4, headroom=1.0)
+    for tokens in (5000, 10, 10, 10, 10):
+        est.observe(tokens, "m")
+    assert est.estimate(8000, "m") == 10
+
+
+def test_keys_fall_back_in_order() -> None:
+    est = OutputTokenEstimator(warmup=2, headroom=1.0)
+    est.observe(100, "slug", "model")
+    est.observe(100, "slug", "model")
+    est.observe(700, "model")
+    est.observe(700, "model")
+    assert est.estimate(8000, "slug", "model") == 100
+    assert est.estimate(8000, "other-slug", "model") == 700
+    assert est.estimate(8000, None, "model") == 700
+    est.reset()
+    assert est.estimate(8000, "slug", "model") == 8000
+
+
+def test_observe_record_skips_cache_hits() -> None:
+    est = OutputTokenEstimator(warmup=1, headroom=1.0)
+    est.observe_record(UsageRecord(model="m", output_tokens_total=50, is_cached_hit=True), "m")
+    assert est.learned("m") is None
+    est.observe_record(UsageRecord(model="m", output_text_tokens=70, output_tokens_total=70, tokens_total=70), "m")
+    assert est.learned("m") == 70
+
+
+def test_invalid_configuration() -> None:
+    with pytest.raises(ValueError, match="quantile"):
+        OutputTokenEstimator(quantile=0)
+    with pytest.raises(ValueError, match="warmup"):
+        OutputTokenEstimator(window=5, warmup=10)
@@ -0,0 +1,62 @@
+import pytest
+
+from bulkllm.rate_limit_headers import parse_duration, parse_rate_limit_headers
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        ("2", 2.0),
+        ("0.5", 0.5),
+        ("6m0s", 360.0),
+        ("20ms", 0.02),
+        ("1h2m3.5s", 3723.5),
+        ("2024-01-01T00:01:00Z", 60.0),
+        ("Mon, 01 Jan 2024 00:00:30 GMT", 30.0),
+        ("soon", None),
+    ],
+)
+def test_parse_duration(value, expected):
+    now = 1704067200.0  # 2024-01-01T00:00:00Z
+    assert parse_duration(value, now=now) == expected
+
+
+def test_parse_openai_headers():
+    headers = parse_rate_limit_headers(
+        {
+            "x-ratelimit-limit-requests": "500",
+            "x-ratelimit-remaining-requests": "499",
+            "x-ratelimit-reset-requests": "120ms",
+            "x-ratelimit-limit-tokens": "30000",
+            "x-ratelimit-remaining-tokens": "0",
+            "x-ratelimit-reset-tokens": "6s",
+            "content-type": "application/json",
+        }
+    )
+    assert headers.limits == {"requests": 500, "tokens": 30000}
+    assert headers.remaining == {"requests": 499, "tokens": 0}
+    assert headers.reset_seconds == {"requests": 0.12, "tokens": 6.0}
+    assert headers.retry_after_seconds is None
+
+
+def test_parse_prefixed_anthropic_headers():
+    headers = parse_rate_limit_headers(
+        {
+            "llm_provider-anthropic-ratelimit-input-tokens-limit": "400000",
+            "llm_provider-anthropic-ratelimit-output-tokens-limit": "80000",
+            "llm_provider-anthropic-ratelimit-requests-remaining": "3",
+            "llm_provider-anthropic-ratelimit-requests-reset": "2024-01-01T00:00:10Z",
+            "llm_provider-retry-after": "7",
+        },
+        now=1704067200.0,
+    )
+    assert headers.limits == {"input_tokens": 400000, "output_tokens": 80000}
+    assert headers.remaining == {"requests": 3}
+    assert headers.reset_seconds == {"requests": 10.0}
+    assert headers.retry_after_seconds == 7.0
+
+
+def test_parse_ignores_malformed_values():
+    headers = parse_rate_limit_headers({"x-ratelimit-limit-requests": "lots", "retry-after": "later"})
+    assert not headers
+    assert not parse_rate_limit_headers(None)
@@ -1,10 +1,15 @@
 import contextlib
+import math
+import random
+import threading
 import time
+from collections import deque
 
 import anyio
 import pytest
 
-from bulkllm.rate_limiter import ModelRateLimit, RateLimiter
+from bulkllm.rate_limit_backends import SQLiteRateLimitBackend
+from bulkllm.rate_limiter import ModelRateLimit, RateLimiter, RateLimitTimeoutError
 
 
 def test_has_capacity_exceeds_itpm():
@@ -52,6 +57,53 @@ def test_get_rate_limit_for_model_with_regex():
     assert rl.get_rate_limit_for_model("other") is rl.default_rate_limit
 
 
+def test_regex_routing_picks_first_match_and_memo_is_invalidated() -> None:
+    rl = RateLimiter([])
+    free = ModelRateLimit(model_names=["^or/.*:free$"], rpm=5, is_regex=True)
+    grouped = ModelRateLimit(model_names=[r"^or/(a|b)/.*$", r"^x(?P<n>\d)$"], rpm=6, is_regex=True)
+    rl.add_rate_limit(free)
+    rl.add_rate_limit(grouped)
+    assert rl.get_rate_limit_for_model("or/a/m:free") is free
+    assert rl.get_rate_limit_for_model("or/b/m") is grouped
+    assert rl.get_rate_limit_for_model("x1") is grouped
+    assert rl.get_rate_limit_for_model("or/c/m") is rl.default_rate_limit
+
+    # Negative results are memoised but forgotten once a new limit can match
+    catch_all = ModelRateLimit(model_names=["^or/"], rpm=7, is_regex=True)
+    rl.add_rate_limit(catch_all)
+    assert rl.get_rate_limit_for_model("or/c/m") is catch_all
+    assert rl.get_rate_limit_for_model("or/a/m:free") is free
+
+
+def test_regex_routing_falls_back_for_backreferences() -> None:
+    rl = RateLimiter([])
+    twice = ModelRateLimit(model_names=[r"^(\w+)-\1$"], rpm=5, is_regex=True)
+    rl.add_rate_limit(twice)
+    assert rl.get_rate_limit_for_model("ab-ab") is twice
+    assert rl.get_rate_limit_for_model("ab-cd") is rl.default_rate_limit
+
+
+@pytest.mark.parametrize("pattern", [r"^(?P<n>\w+)-(?P=n)$", r"^(\w+)?-(?(1)\w+|x)$"])
+def test_regex_routing_never_combines_group_references(pattern: str) -> None:
+    rl = RateLimiter([])
+    other = ModelRateLimit(model_names=["^zz$"], rpm=1, is_regex=True)
+    refs = ModelRateLimit(model_names=[pattern], rpm=5, is_regex=True)
+    rl.add_rate_limit(other)
+    rl.add_rate_limit(refs)
+    assert rl._combined_pattern is None
+    assert rl.get_rate_limit_for_model("ab-ab") is refs
+    assert rl.get_rate_limit_for_model("-x") is (refs if "(?(" in pattern else rl.default_rate_limit)
+
+
+def test_routing_memo_is_bounded(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(RateLimiter, "route_cache_size", 8)
+    rl = RateLimiter([ModelRateLimit(model_names=[".*"], is_regex=True, level="org", rpm=100)])
+    for i in range(20):
+        rl.get_limiter_for_model(f"m{i}")
+    assert len(rl._routes) == 8
+    assert len(rl._chains) == 8
+
+
 @pytest.mark.asyncio
 async def test_async_context_concurrent_usage():
     """Two workers should be able to hold separate contexts concurrently."""
@@ -120,3 +172,833 @@ async def test_await_capacity_blocks_until_release() -> None:
         release.set()
 
     assert timings["elapsed"] >= 0.3
+
+
+@pytest.mark.asyncio
+async def test_acquire_blocking_wakes_on_record_usage() -> None:
+    """Waiters should be woken by a release rather than polling."""
+    limit = ModelRateLimit(model_names=["m"], rpm=10, itpm=10)
+    holder = await limit.reserve_capacity(10, 0)
+    acquired = anyio.Event()
+
+    async def waiter() -> None:
+        ctx = await limit.reserve_capacity(5, 0)
+        acquired.set()
+        await ctx.record_usage(5, 0)
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(waiter)
+        await anyio.sleep(0.05)
+        assert not acquired.is_set()
+        await holder.record_usage(2, 0)
+        with anyio.fail_after(0.5):
+            await acquired.wait()
+
+
+@pytest.mark.asyncio
+async def test_acquire_blocking_wakes_on_window_expiry() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=1, window_seconds=1)
+    with limit.reserve_capacity_sync(1, 1) as ctx:
+        ctx.record_usage_sync(1, 1)
+
+    start = time.monotonic()
+    with anyio.fail_after(3):
+        ctx = await limit.reserve_capacity(1, 1)
+    await ctx.record_usage(1, 1)
+    assert time.monotonic() - start >= 0.9
+
+
+def test_acquire_blocking_sync_wakes_on_cancel() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=1)
+    holder = limit.reserve_capacity_sync(1, 1)
+    timings: dict[str, float] = {}
+
+    def waiter() -> None:
+        start = time.monotonic()
+        with limit.reserve_capacity_sync(1, 1) as ctx:
+            ctx.record_usage_sync(1, 1)
+        timings["elapsed"] = time.monotonic() - start
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.2)
+    with contextlib.suppress(ValueError):
+        holder.__exit__(ValueError, ValueError("abort"), None)
+    thread.join(timeout=2)
+    assert not thread.is_alive()
+    assert 0.2 <= timings["elapsed"] < 1.0
+
+
+@pytest.mark.asyncio
+async def test_large_request_not_overtaken_by_small_ones() -> None:
+    """A queued large request keeps its place while capacity drains."""
+    limit = ModelRateLimit(model_names=["m"], itpm=10)
+    holders = [await limit.reserve_capacity(3, 0) for _ in range(3)]
+    order: list[str] = []
+
+    async def request(name: str, tokens: int) -> None:
+        ctx = await limit.reserve_capacity(tokens, 0)
+        order.append(name)
+        await ctx.record_usage(0, 0, cached_hit=True)
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(request, "big", 9)
+        await anyio.sleep(0.01)
+        tg.start_soon(request, "small", 1)
+        await anyio.sleep(0.01)
+        # One token is free, but "small" must not overtake "big".
+        assert order == []
+        for ctx in holders:
+            await ctx.record_usage(0, 0, cached_hit=True)
+
+    assert order == ["big", "small"]
+
+
+@pytest.mark.asyncio
+async def test_priority_ordering_via_rate_limiter() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=1, window_seconds=60)
+    rl = RateLimiter([limit])
+    holder = await rl.reserve_capacity("m", 1, 1)
+    order: list[str] = []
+
+    async def request(name: str, priority: int) -> None:
+        ctx = await rl.reserve_capacity("m", 1, 1, priority=priority)
+        order.append(name)
+        await ctx.record_usage(0, 0, cached_hit=True)
+
+    async with anyio.create_task_group() as tg:
+        for name, priority in [("low", 5), ("high-1", 0), ("high-2", 0)]:
+            tg.start_soon(request, name, priority)
+            await anyio.sleep(0.01)
+        await holder.record_usage(0, 0, cached_hit=True)
+
+    assert order == ["high-1", "high-2", "low"]
+
+
+def test_sync_waiters_served_fifo() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=1)
+    holder = limit.reserve_capacity_sync(1, 1)
+    order: list[int] = []
+
+    def request(i: int) -> None:
+        ctx = limit.reserve_capacity_sync(1, 1)
+        order.append(i)
+        ctx.record_usage_sync(0, 0, cached_hit=True)
+
+    threads = []
+    for i in range(5):
+        thread = threading.Thread(target=request, args=(i,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.02)
+    holder.record_usage_sync(0, 0, cached_hit=True)
+    for thread in threads:
+        thread.join(timeout=2)
+    assert order == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_head_waiter_hands_over() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=1)
+    holder = await limit.reserve_capacity(1, 1)
+    acquired = anyio.Event()
+
+    async def follower() -> None:
+        ctx = await limit.reserve_capacity(1, 1)
+        acquired.set()
+        await ctx.record_usage(0, 0, cached_hit=True)
+
+    async with anyio.create_task_group() as tg:
+        with anyio.move_on_after(0.05):
+            tg.start_soon(follower)
+            await limit.reserve_capacity(1, 1)  # head waiter, gives up
+        assert len(limit._waiters) >= 1
+        await holder.record_usage(0, 0, cached_hit=True)
+        with anyio.fail_after(1):
+            await acquired.wait()
+
+
+def test_bucketed_window_expires_conservatively(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = {"t": 10.5}
+    monkeypatch.setattr(time, "monotonic", lambda: now["t"])
+    limit = ModelRateLimit(model_names=["m"], rpm=1, itpm=100, window_seconds=2, window_mode="bucketed")
+
+    with limit.reserve_capacity_sync(10, 0) as ctx:
+        ctx.record_usage_sync(7, 3)
+    assert limit.current_requests_in_window == 1
+    assert limit.current_input_tokens_in_window == 7
+    assert limit.current_output_tokens_in_window == 3
+    assert not limit._completed_requests
+
+    # The exact window would have released it at 12.5; buckets hold it until
+    # the whole slot is older than the window.
+    now["t"] = 12.6
+    assert not limit._can_make_request(1, 0)
+    assert limit._seconds_until_capacity_frees() == pytest.approx(0.4)
+
+    now["t"] = 13.0
+    assert limit._can_make_request(1, 0)
+    assert limit.current_requests_in_window == 0
+    assert limit.current_total_tokens_in_window == 0
+
+
+def test_bucketed_window_memory_is_constant(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = {"t": 0.0}
+    monkeypatch.setattr(time, "monotonic", lambda: now["t"])
+    limit = ModelRateLimit(model_names=["m"], rpm=50_000, window_mode="bucketed")
+    ring_size = limit._bucket_window.size
+
+    for i in range(5_000):
+        now["t"] = i * 0.05
+        with limit.reserve_capacity_sync(1, 1) as ctx:
+            ctx.record_usage_sync(1, 1)
+
+    assert limit._bucket_window.size == ring_size == 61
+    assert not limit._completed_requests
+    # Only completions from the last 60-61 seconds are still counted
+    assert 60 * 20 <= limit.current_requests_in_window <= 61 * 20
+    assert limit.current_input_tokens_in_window == limit.current_requests_in_window
+
+    # A long idle gap clears every slot
+    now["t"] += 1_000
+    limit._cleanup_old_requests()
+    assert limit.current_requests_in_window == 0
+    assert limit._bucket_window.next_expiry() is None
+
+
+@pytest.mark.parametrize("algorithm", ["token_bucket", "gcra"])
+def test_refilling_algorithms_pace_requests(algorithm: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    now = {"t": 100.0}
+    monkeypatch.setattr(time, "monotonic", lambda: now["t"])
+    # 600 rpm refills 10 requests per second; a half-second burst allows 5.
+    limit = ModelRateLimit(model_names=["m"], rpm=600, algorithm=algorithm, burst_seconds=0.5)
+
+    for _ in range(5):
+        assert limit.acquire_sync(1, 1) is not None
+    assert limit.acquire_sync(1, 1) is None
+    assert limit._seconds_until_capacity_frees(1, 1) == pytest.approx(0.1)
+
+    now["t"] += 0.1
+    assert limit.acquire_sync(1, 1) is not None
+    assert limit.acquire_sync(1, 1) is None
+
+
+@pytest.mark.parametrize("algorithm", ["token_bucket", "gcra"])
+def test_refilling_algorithms_reconcile_usage(algorithm: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    now = {"t": 100.0}
+    monkeypatch.setattr(time, "monotonic", lambda: now["t"])
+    # 6000 tpm refills 100 tokens per second with a 100 token burst.
+    limit = ModelRateLimit(model_names=["m"], tpm=6000, algorithm=algorithm)
+
+    first = limit.acquire_sync(50, 50)
+    assert not limit.has_capacity(10, 0)
+
+    # Using less than reserved refunds the difference...
+    limit.record_actual_usage_sync(first, 10, 10)
+    assert limit.has_capacity(80, 0)
+    assert not limit.has_capacity(81, 0)
+
+    # ...cancelling refunds the whole reservation...
+    second = limit.acquire_sync(40, 0)
+    limit._cancel_pending_sync(second)
+    assert limit.has_capacity(80, 0)
+
+    # ...and using more than reserved puts the bucket into debt.
+    third = limit.acquire_sync(80, 0)
+    limit.record_actual_usage_sync(third, 200, 0)
+    assert limit._bucket_wait_time(1, 0) == pytest.approx(1.21)
+
+
+@pytest.mark.parametrize("algorithm", ["token_bucket", "gcra"])
+def test_refilling_algorithms_admit_oversize_when_full(algorithm: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    now = {"t": 100.0}
+    monkeypatch.setattr(time, "monotonic", lambda: now["t"])
+    limit = ModelRateLimit(model_names=["m"], itpm=600, algorithm=algorithm)
+
+    assert limit.acquire_sync(500, 0) is not None
+    assert limit._bucket_wait_time(500, 0) == pytest.approx(50)
+    with pytest.raises(ValueError, match="input tokens per minute limit"):
+        limit.has_capacity(601, 0)
+
+
+def test_headers_adjust_limits_with_clamping_and_hysteresis() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=100, tpm=10_000, adaptive_max_factor=2.0)
+
+    limit.update_from_headers_sync({"x-ratelimit-limit-requests": "150", "x-ratelimit-limit-tokens": "1000000"})
+    assert limit.rpm == 150
+    assert limit.tpm == 20_000  # clamped to twice the configured limit
+    assert limit.configured_limits == {"rpm": 100, "tpm": 10_000, "itpm": 0, "otpm": 0}
+
+    # Small moves inside the hysteresis band are ignored
+    limit.update_from_headers_sync({"x-ratelimit-limit-requests": "140"})
+    assert limit.rpm == 150
+    limit.update_from_headers_sync({"x-ratelimit-limit-requests": "1"})
+    assert limit.rpm == 10  # clamped to adaptive_min_factor
+
+    # Limits that were not configured stay unlimited
+    limit.update_from_headers_sync({"anthropic-ratelimit-input-tokens-limit": "5000"})
+    assert limit.itpm == 0
+
+
+def test_headers_ignored_when_not_adaptive() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=100, adaptive=False)
+    limit.update_from_headers_sync({"x-ratelimit-limit-requests": "500", "retry-after": "30"})
+    assert limit.rpm == 100
+    assert limit.has_capacity(1, 1)
+
+
+def test_retry_after_and_exhausted_remaining_pause_admissions(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = {"t": 100.0}
+    monkeypatch.setattr(time, "monotonic", lambda: now["t"])
+    limit = ModelRateLimit(model_names=["m"], rpm=100)
+
+    limit.update_from_headers_sync({"retry-after": "2"})
+    assert limit.acquire_sync(1, 1) is None
+    assert limit._seconds_until_capacity_frees() == pytest.approx(1.0)  # capped at MAX_WAIT_SECONDS
+    now["t"] += 2
+    assert limit.acquire_sync(1, 1) is not None
+
+    limit.update_from_headers_sync({"x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "500ms"})
+    assert not limit.has_capacity(1, 1)
+    assert limit._seconds_until_capacity_frees() == pytest.approx(0.5)
+    now["t"] += 0.5
+    assert limit.has_capacity(1, 1)
+
+
+@pytest.mark.asyncio
+async def test_raised_limit_wakes_waiters() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=1)
+    limiter = RateLimiter([limit])
+    await limit.acquire(1, 1)
+
+    with anyio.fail_after(0.5):
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(limit.acquire_blocking, 1, 1)
+            await anyio.sleep(0.01)
+            await limiter.update_from_headers("m", {"x-ratelimit-limit-requests": "2"})
+    assert limit.current_requests_in_window == 2
+
+
+@pytest.mark.parametrize("algorithm", ["token_bucket", "gcra"])
+def test_adapted_limit_retunes_refilling_buckets(algorithm: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    now = {"t": 100.0}
+    monkeypatch.setattr(time, "monotonic", lambda: now["t"])
+    limit = ModelRateLimit(model_names=["m"], rpm=600, algorithm=algorithm)
+
+    limit.update_from_headers_sync({"x-ratelimit-limit-requests": "60"})
+    assert limit.acquire_sync(1, 1) is not None
+    assert limit.acquire_sync(1, 1) is None
+    assert limit._bucket_wait_time(1, 1) == pytest.approx(1.0)
+
+
+def test_default_limit_ignores_headers() -> None:
+    limiter = RateLimiter([])
+    limiter.update_from_headers_sync("unknown", {"retry-after": "30"})
+    assert limiter.has_capacity("unknown", 1, 1)
+
+
+def test_rate_limit_error_cuts_limits_and_successes_probe_back(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = {"t": 100.0}
+    monkeypatch.setattr(time, "monotonic", lambda: now["t"])
+    limit = ModelRateLimit(model_names=["m"], rpm=100, tpm=10_000, aimd_probe_successes=2, aimd_increase_fraction=0.1)
+
+    limit.record_rate_limit_error_sync()
+    assert (limit.rpm, limit.tpm) == (50, 5_000)
+    # Errors from the same burst of in-flight requests only cut once
+    limit.record_rate_limit_error_sync()
+    assert limit.rpm == 50
+    now["t"] += limit.aimd_cooldown_seconds
+    limit.record_rate_limit_error_sync()
+    assert limit.rpm == 25
+
+    # Each run of successes adds 10% of the ceiling back, up to the ceiling
+    for expected in (35, 45, 55, 65, 75, 85, 95, 100, 100):
+        for _ in range(2):
+            limit.record_actual_usage_sync(limit.acquire_sync(1, 1), 1, 1)
+        assert limit.rpm == expected
+    assert limit.tpm == 10_000
+
+    # Cached hits are not evidence of spare capacity
+    now["t"] += limit.aimd_cooldown_seconds
+    limit.record_rate_limit_error_sync()
+    for _ in range(4):
+        limit.record_actual_usage_sync(limit.acquire_sync(1, 1), 0, 0, cached_hit=True)
+    assert limit.rpm == 50
+
+
+def test_rate_limit_error_respects_floor_and_reported_ceiling() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=100, aimd_cooldown_seconds=0, aimd_probe_successes=1)
+    for _ in range(10):
+        limit.record_rate_limit_error_sync()
+    assert limit.rpm == 10  # adaptive_min_factor of the configured limit
+
+    # A reported limit while backed off lowers the ceiling without raising the limit
+    limit.update_from_headers_sync({"x-ratelimit-limit-requests": "20"})
+    assert limit.rpm == 10
+    for _ in range(15):
+        limit.record_actual_usage_sync(limit.acquire_sync(1, 1), 1, 1)
+    assert limit.rpm == 20
+
+
+def test_rate_limit_error_retry_after_pauses_every_waiter() -> None:
+    limiter = RateLimiter([ModelRateLimit(model_names=["m"], rpm=100)])
+    limiter.record_rate_limit_error_sync("m", {"retry-after": "0.2"})
+
+    start = time.monotonic()
+    limiter.reserve_capacity_sync("m", 1, 1)
+    assert time.monotonic() - start >= 0.19
+
+
+def test_rate_limit_error_ignored_when_not_adaptive() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=100, adaptive=False)
+    limit.record_rate_limit_error_sync({"retry-after": "30"})
+    assert limit.rpm == 100
+    assert limit.has_capacity(1, 1)
+
+
+def _hierarchy() -> tuple[RateLimiter, ModelRateLimit, ModelRateLimit, ModelRateLimit]:
+    a = ModelRateLimit(model_names=["p/a"], rpm=10)
+    b = ModelRateLimit(model_names=["p/b"], rpm=10)
+    provider = ModelRateLimit(model_names=["p/.*"], is_regex=True, level="provider", rpm=2)
+    org = ModelRateLimit(model_names=[".*"], is_regex=True, level="org", rpm=100)
+    return RateLimiter([org, a, provider, b]), a, b, provider
+
+
+def test_hierarchy_levels_resolved_in_order() -> None:
+    limiter, a, _, provider = _hierarchy()
+    org = limiter.parent_limits[-1]
+    assert limiter.get_rate_limits_for_model("p/a") == [a, provider, org]
+    assert limiter.get_rate_limits_for_model("q/x") == [limiter.default_rate_limit, org]
+    assert limiter.get_limiter_for_model("p/a") is limiter.get_limiter_for_model("p/a")
+
+
+def test_hierarchy_reservation_is_all_or_nothing() -> None:
+    limiter, a, b, provider = _hierarchy()
+    with limiter.reserve_capacity_sync("p/a", 1, 1) as ctx:
+        ctx.record_usage_sync(1, 1)
+    chain = limiter.get_limiter_for_model("p/b")
+    assert chain.acquire_sync(1, 1) is not None
+    # The provider level is now full, so the model level must not keep a reservation
+    assert limiter.get_limiter_for_model("p/a").acquire_sync(1, 1) is None
+    assert a.current_requests_in_window == 1
+    assert b.current_requests_in_window == 1
+    assert provider.current_requests_in_window == 2
+    assert limiter.parent_limits[-1].current_requests_in_window == 2
+
+
+def test_hierarchy_record_and_cancel_apply_to_every_level() -> None:
+    limiter, a, _, provider = _hierarchy()
+    org = limiter.parent_limits[-1]
+    with limiter.reserve_capacity_sync("p/a", 10, 10) as ctx:
+        ctx.record_usage_sync(3, 4)
+    for limit in (a, provider, org):
+        assert limit.current_input_tokens_in_window == 3
+        assert limit.current_output_tokens_in_window == 4
+        assert not limit._pending_requests
+
+    with contextlib.suppress(RuntimeError), limiter.reserve_capacity_sync("p/a", 1, 1):
+        raise RuntimeError
+    for limit in (a, provider, org):
+        assert limit.current_requests_in_window == 1
+        assert not limit._pending_requests
+
+
+@pytest.mark.asyncio
+async def test_hierarchy_waits_for_outer_level() -> None:
+    limiter, _, b, provider = _hierarchy()
+    first = await limiter.reserve_capacity("p/a", 1, 1)
+    await limiter.reserve_capacity("p/a", 1, 1)
+
+    order = []
+
+    async def waiter() -> None:
+        async with await limiter.reserve_capacity("p/b", 1, 1) as ctx:
+            order.append("b")
+            await ctx.record_usage(1, 1)
+
+    with anyio.fail_after(2):
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(waiter)
+            await anyio.sleep(0.05)
+            assert order == []
+            assert b.current_requests_in_window == 0
+            await first._limiter._cancel_pending(first.request_id)
+    assert order == ["b"]
+    assert provider.current_requests_in_window == 2
+
+
+def test_overlapping_chains_do_not_deadlock() -> None:
+    # Chains for different models share the provider and org levels; threads
+    # hammering both must all finish.
+    limiter, *_ = _hierarchy()
+    for limit in (*limiter.parent_limits, *limiter.model_limit_lookup.values()):
+        limit.rpm = 0  # unlimited so only lock ordering is exercised
+    errors: list[BaseException] = []
+
+    def worker(model: str) -> None:
+        try:
+            for _ in range(200):
+                with limiter.reserve_capacity_sync(model, 1, 1) as ctx:
+                    ctx.record_usage_sync(1, 1)
+        except BaseException as e:  # noqa: BLE001 - surfaced below
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(m,)) for m in ("p/a", "p/b") * 4]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+    assert not any(t.is_alive() for t in threads)
+    assert not errors
+    assert limiter.parent_limits[-1].current_requests_in_window == 1600
+
+
+def test_reserve_many_grants_what_fits_and_cancels_leftovers() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=5, tpm=100)
+    with limit.reserve_many_sync([(10, 10)] * 4 + [(80, 0)] + [(1, 1)] * 3) as batch:
+        # The fifth estimate does not fit, so granting stops before it
+        assert len(batch) == 4
+        assert limit.current_requests_in_window == 4
+        batch.record_usage_sync(0, 5, 5)
+        batch[1].record_usage_sync(1, 1)
+    assert limit.current_requests_in_window == 2
+    assert limit.current_input_tokens_in_window == 6
+    assert not limit._pending_requests
+
+
+def test_reserve_many_respects_max_n() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=100)
+    batch = limit.reserve_many_sync(iter([(1, 1)] * 10), max_n=3)
+    assert len(batch) == 3
+    assert len(set(batch.request_ids)) == 3
+    assert len(limit.reserve_many_sync([(1, 1)], max_n=0)) == 0
+    batch.release_sync()
+    assert limit.current_requests_in_window == 0
+
+
+@pytest.mark.asyncio
+async def test_reserve_many_waits_for_first_estimate() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=2)
+    first = await limit.reserve_capacity(1, 1)
+    await limit.reserve_capacity(1, 1)
+    granted: list[int] = []
+
+    async def waiter() -> None:
+        async with await limit.reserve_many([(1, 1)] * 3) as batch:
+            granted.append(len(batch))
+            for ctx in batch:
+                await ctx.record_usage(1, 1)
+
+    with anyio.fail_after(2):
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(waiter)
+            await anyio.sleep(0.05)
+            assert granted == []
+            await limit._cancel_pending(first.request_id)
+    assert granted == [1]
+    assert limit.current_requests_in_window == 2
+
+
+def test_reserve_many_through_hierarchy() -> None:
+    limiter, a, b, provider = _hierarchy()
+    with limiter.reserve_many_sync("p/a", [(1, 1)] * 5) as batch:
+        # The provider level admits only two
+        assert len(batch) == 2
+        batch.record_usage_sync(0, 1, 1)
+    assert a.current_requests_in_window == 1
+    assert provider.current_requests_in_window == 1
+    assert limiter.parent_limits[-1].current_requests_in_window == 1
+    assert not any(limit._pending_requests for limit in (a, b, provider))
+
+
+def test_chain_forgets_reservations_that_every_level_timed_out() -> None:
+    limiter, a, _, provider = _hierarchy()
+    chain = limiter.get_limiter_for_model("p/a")
+    stale = [chain.acquire_sync(1, 1), chain.acquire_sync(1, 1)]
+    chain.record_actual_usage_sync(stale[0], 1, 1)
+    for limit in chain.limits:
+        for req in limit._pending_requests.values():
+            req.lock_acquisition_timestamp -= limit.pending_timeout_seconds + 1
+    provider.rpm = 10
+
+    with chain.reserve_capacity_sync(1, 1) as ctx:
+        # The timed-out reservation is dropped along with the recorded one
+        assert list(chain._reservations) == [ctx.request_id]
+        assert list(chain._reservations_by_age) == [ctx.request_id]
+        ctx.record_usage_sync(1, 1)
+    assert not chain._reservations
+    assert a.current_requests_in_window == 2
+
+
+def test_reserve_many_times_out() -> None:
+    limiter, *_ = _hierarchy()
+    limiter.reserve_capacity_sync("p/a", 1, 1)
+    limiter.reserve_capacity_sync("p/a", 1, 1)
+    with pytest.raises(RateLimitTimeoutError, match="before the deadline"):
+        limiter.reserve_many_sync("p/b", [(1, 1)] * 2, timeout=0.05)
+    limit = ModelRateLimit(model_names=["m"], rpm=1)
+    limit.acquire_sync(1, 1)
+    with pytest.raises(RateLimitTimeoutError, match="before the deadline"):
+        limit.reserve_many_sync([(1, 1)], deadline=time.monotonic() + 0.05)
+    assert limit._queue_head(limit._waiters) is None
+
+
+@pytest.mark.asyncio
+async def test_reserve_many_times_out_async() -> None:
+    limiter, *_ = _hierarchy()
+    await limiter.reserve_capacity("p/a", 1, 1)
+    await limiter.reserve_capacity("p/a", 1, 1)
+    with anyio.fail_after(2), pytest.raises(RateLimitTimeoutError, match="before the deadline"):
+        await limiter.reserve_many("p/b", [(1, 1)] * 2, timeout=0.05)
+
+
+def test_reserve_many_stops_before_unfulfillable_estimate() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=10, itpm=100)
+    batch = limit.reserve_many_sync([(1, 1), (1000, 1), (1, 1)])
+    assert len(batch) == 1
+    batch.release_sync()
+    with pytest.raises(ValueError, match="can never be fulfilled"):
+        limit.reserve_many_sync([(1000, 1), (1, 1)])
+    assert not limit._pending_requests
+
+
+@pytest.mark.asyncio
+async def test_unlimited_limit_hands_out_shared_noop_context() -> None:
+    limit = ModelRateLimit(model_names=["m"])
+    assert limit.is_unlimited
+    ctx = limit.reserve_capacity_sync(10, 10)
+    assert ctx is await limit.reserve_capacity(10, 10)
+    with ctx:
+        pass  # leaving without recording is fine
+    async with ctx:
+        await ctx.record_usage(1, 1)
+    with pytest.raises(RuntimeError, match="boom"), ctx:
+        raise RuntimeError("boom")
+    assert not limit._pending_requests
+    assert limit.current_requests_in_window == 0
+    with pytest.raises(ValueError, match="negative"):
+        limit.reserve_capacity_sync(-1, 0)
+
+
+def test_limits_and_pauses_disable_fast_path() -> None:
+    assert not ModelRateLimit(model_names=["m"], tpd=10).is_unlimited
+    limit = ModelRateLimit(model_names=["m"], max_concurrency=1)
+    assert not limit.is_unlimited
+    paused = ModelRateLimit(model_names=["m"])
+    paused._pause_internal(60)
+    assert not paused.is_unlimited
+
+
+def test_max_concurrency_caps_outstanding_reservations() -> None:
+    limit = ModelRateLimit(model_names=["m"], max_concurrency=2)
+    first = limit.acquire_sync(1, 1)
+    assert limit.acquire_sync(1, 1) is not None
+    assert limit.acquire_sync(1, 1) is None
+    limit.record_actual_usage_sync(first, 1, 1)
+    # Completed requests no longer count, only outstanding ones
+    assert limit.acquire_sync(1, 1) is not None
+
+
+@pytest.mark.asyncio
+async def test_max_concurrency_shared_by_sync_and_async_callers(capsys: pytest.CaptureFixture[str]) -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=1000, max_concurrency=2)
+    sync_ctx = limit.reserve_capacity_sync(1, 1)
+    async_ctx = await limit.reserve_capacity(1, 1)
+    assert not limit.has_capacity(1, 1)
+    limit.print_current_status()
+    assert "In flight: 2 / 2 concurrent" in capsys.readouterr().out
+
+    acquired = anyio.Event()
+
+    async def waiter() -> None:
+        async with await limit.reserve_capacity(1, 1) as ctx:
+            acquired.set()
+            await ctx.record_usage(1, 1)
+
+    with anyio.fail_after(2):
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(waiter)
+            await anyio.sleep(0.05)
+            assert not acquired.is_set()
+            # A cancelled reservation frees its slot just like a recorded one
+            await async_ctx.__aexit__(RuntimeError, RuntimeError(), None)
+    assert acquired.is_set()
+    sync_ctx.record_usage_sync(1, 1)
+    assert len(limit._pending_requests) == 0
+
+
+def test_request_records_are_recycled_safely() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=10, pending_timeout_seconds=60)
+    first = limit.acquire_sync(1, 1)
+    record = limit._pending_requests[first]
+    limit._cancel_pending_sync(first)
+    second = limit.acquire_sync(2, 3)
+    assert second > first
+    # The cancelled request's record is reused, but its stale age entry is not
+    assert limit._pending_requests[second] is record
+    assert (record.id, record.input_tokens, record.output_tokens) == (second, 2, 3)
+    assert limit._oldest_pending() is record
+    assert list(limit._pending_by_age) == [second]
+
+
+def test_overcommit_admits_beyond_estimates_and_repays_debt(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = {"t": 100.0}
+    monkeypatch.setattr(time, "monotonic", lambda: now["t"])
+    assert len(ModelRateLimit(model_names=["m"], otpm=1000).reserve_many_sync([(0, 800)] * 3)) == 1
+    limit = ModelRateLimit(model_names=["m"], otpm=1000, itpm=1000, overcommit=2)
+    first, second = (limit.acquire_sync(50, 800) for _ in range(2))
+    assert limit.current_output_tokens_in_window == 800
+    assert not limit.has_capacity(0, 800)
+
+    # Using more than the 400 charged holds the overshoot in the window, counted once
+    limit.record_actual_usage_sync(first, 90, 800)
+    limit.record_actual_usage_sync(second, 10, 100)
+    assert limit.current_requests_in_window == 2
+    assert limit.current_input_tokens_in_window == 100
+    assert limit.current_output_tokens_in_window == 900
+    assert limit.current_total_tokens_in_window == 1000
+    now["t"] += 59.9
+    assert not limit.has_capacity(0, 800)
+    now["t"] += 0.11
+    assert limit.acquire_sync(0, 800) is not None
+    assert limit.current_output_tokens_in_window == 400
+
+
+def _simulate_otpm(overcommit: float, clock: dict[str, float], minutes: int = 10) -> list[int]:
+    """Output tokens completed per minute by a workload estimating 1000 but mostly using far less."""
+    rng = random.Random(0)
+    limit = ModelRateLimit(model_names=["m"], otpm=20_000, overcommit=overcommit)
+    in_flight: deque[tuple[float, int]] = deque()
+    used = [0] * minutes
+    for tick in range(minutes * 600):
+        clock["t"] = now = tick / 10
+        while in_flight and in_flight[0][0] <= now:
+            _, request_id = in_flight.popleft()
+            actual = 1000 if rng.random() < 0.1 else rng.randint(50, 200)
+            limit.record_actual_usage_sync(request_id, 0, actual)
+            used[tick // 600] += actual
+        while (request_id := limit.acquire_sync(0, 1000)) is not None:
+            in_flight.append((now + 20, request_id))
+    return used
+
+
+def test_overcommit_improves_utilisation_within_limit(monkeypatch: pytest.MonkeyPatch) -> None:
+    clock = {"t": 0.0}
+    monkeypatch.setattr(time, "monotonic", lambda: clock["t"])
+    conservative = _simulate_otpm(1.0, clock)
+    overcommitted = _simulate_otpm(4.0, clock)
+    print(f"tokens/minute: conservative {conservative}, overcommit=4 {overcommitted}")
+    # Skip the first minute, which starts with an empty window
+    assert sum(overcommitted[1:]) > 1.5 * sum(conservative[1:])
+    assert sum(overcommitted[1:]) <= 20_000 * 9
+
+
+def test_overcommit_debt_on_refilling_buckets(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = {"t": 100.0}
+    monkeypatch.setattr(time, "monotonic", lambda: now["t"])
+    # 6000 tpm refills 100 tokens per second with a 100 token burst
+    limit = ModelRateLimit(model_names=["m"], tpm=6000, algorithm="token_bucket", overcommit=2)
+    request_id = limit.acquire_sync(100, 100)
+    assert limit._buckets["total"].level == 0
+    limit.record_actual_usage_sync(request_id, 100, 100)
+    assert limit._buckets["total"].level == -100
+
+
+def test_overcommit_rejected_with_backend(tmp_path) -> None:
+    with pytest.raises(ValueError, match="overcommit"):
+        ModelRateLimit(
+            model_names=["m"], rpm=1, overcommit=2, backend=SQLiteRateLimitBackend(tmp_path / "limits.sqlite")
+        )
+
+
+@pytest.mark.asyncio
+async def test_reserve_capacity_timeout_leaves_queue_consistent() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=1)
+    holder = await limit.reserve_capacity(1, 1)
+    start = time.monotonic()
+    with pytest.raises(RateLimitTimeoutError, match="before the deadline"):
+        await limit.reserve_capacity(1, 1, timeout=0.1)
+    assert 0.1 <= time.monotonic() - start < 0.5
+    assert limit._queue_head(limit._waiters) is None
+
+    # A later waiter is not stuck behind the timed-out one
+    await holder._limiter._cancel_pending(holder.request_id)
+    with anyio.fail_after(1):
+        ctx = await limit.reserve_capacity(1, 1, timeout=0.5)
+    await ctx.record_usage(1, 1)
+
+
+def test_deadline_sync_and_through_hierarchy() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=1)
+    limit.acquire_sync(1, 1)
+    with pytest.raises(RateLimitTimeoutError, match="before the deadline"):
+        limit.reserve_capacity_sync(1, 1, deadline=time.monotonic() + 0.05)
+    assert limit._queue_head(limit._waiters) is None
+
+    limiter, *_ = _hierarchy()
+    limiter.reserve_capacity_sync("p/a", 1, 1)
+    limiter.reserve_capacity_sync("p/a", 1, 1)
+    with pytest.raises(RateLimitTimeoutError, match="before the deadline"):
+        limiter.reserve_capacity_sync("p/b", 1, 1, timeout=0.05)
+    with pytest.raises(RateLimitTimeoutError, match="before the deadline"):
+        limiter.await_capacity_sync("p/b", 1, 1, timeout=0.05)
+
+
+def test_estimate_wait_walks_the_window(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = {"t": 100.0}
+    monkeypatch.setattr(time, "monotonic", lambda: now["t"])
+    limit = ModelRateLimit(model_names=["m"], rpm=10, otpm=1000)
+    assert limit.estimate_wait(0, 500) == 0
+    for output_tokens in (300, 300, 300):
+        limit.record_actual_usage_sync(limit.acquire_sync(0, output_tokens), 0, output_tokens)
+        now["t"] += 10
+    # 900 of 1000 used: 500 more fits once the first two completions expire at t=170
+    assert limit.estimate_wait(0, 500) == pytest.approx(40.0)
+    assert limit.estimate_wait(0, 100) == 0
+    assert limit.estimate_wait(0, 2000) == math.inf
+
+    # An in-flight reservation is assumed to complete now
+    limit.acquire_sync(0, 100)
+    assert limit.estimate_wait(0, 1000) == pytest.approx(60.0)
+
+    limiter = RateLimiter([limit])
+    now["t"] += 40.01
+    assert limiter.estimate_wait("m", 0, 500) == 0
+    assert limiter.reserve_capacity_sync("m", 0, 500, timeout=0) is not None
+
+
+def test_estimate_wait_is_a_lower_bound_under_saturated_concurrency(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = {"t": 100.0}
+    monkeypatch.setattr(time, "monotonic", lambda: now["t"])
+    limit = ModelRateLimit(model_names=["m"], rpm=2, max_concurrency=2, pending_timeout_seconds=30)
+    first = limit.acquire_sync(1, 1)
+    now["t"] += 10
+    limit.acquire_sync(1, 1)
+    limiter = RateLimiter([limit])
+
+    # Both slots are taken; a slot may free at any moment, so only the window counts
+    assert not limit.has_capacity(1, 1)
+    assert limit.concurrency_saturated
+    assert limiter.concurrency_saturated("m")
+    assert limit.estimate_wait(1, 1) == pytest.approx(60.0)
+    limit._cancel_pending_sync(first)
+    assert not limit.concurrency_saturated
+    assert limit.estimate_wait(1, 1) == 0
+
+    limit.rpm = 100
+    limit.acquire_sync(1, 1)
+    assert limit.concurrency_saturated
+    assert limit.estimate_wait(1, 1) == 0
+
+
+def test_estimate_wait_bucketed_and_refilling(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = {"t": 100.0}
+    monkeypatch.setattr(time, "monotonic", lambda: now["t"])
+    bucketed = ModelRateLimit(model_names=["m"], rpm=1, window_mode="bucketed", bucket_seconds=10)
+    bucketed.record_actual_usage_sync(bucketed.acquire_sync(1, 1), 1, 1)
+    # The completion at t=100 sits in the slot expiring at 170
+    assert bucketed.estimate_wait(1, 1) == pytest.approx(70.0)
+
+    refilling = ModelRateLimit(model_names=["m"], rpm=60, algorithm="token_bucket")
+    refilling.acquire_sync(1, 1)
+    assert refilling.estimate_wait(1, 1) == pytest.approx(1.0)
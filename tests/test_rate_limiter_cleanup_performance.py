@@ -0,0 +1,68 @@
+import time
+
+from bulkllm.rate_limiter import ModelRateLimit
+
+
+def _full_scan_cleanup(limit: ModelRateLimit) -> None:
+    """The previous expiry strategy: scan every in-flight request."""
+    cutoff_time = time.monotonic() - limit.pending_timeout_seconds
+    for request_id, req in list(limit._pending_requests.items()):
+        if req.lock_acquisition_timestamp < cutoff_time:
+            del limit._pending_requests[request_id]
+
+
+class _CountingDict(dict):
+    """A dict that counts ``get`` calls, i.e. the pending records the age index looks at."""
+
+    lookups = 0
+
+    def get(self, key, default=None):
+        self.lookups += 1
+        return super().get(key, default)
+
+
+def _time_per_call(fn, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls
+
+
+def test_pending_expiry_scales_with_expired_not_in_flight() -> None:
+    in_flight = 5_000
+    calls = 1_000
+    limit = ModelRateLimit(model_names=["m"])
+    request_ids = [limit.acquire_sync(1, 1) for _ in range(in_flight * 2)]
+    # Complete every other request so the age index has stale entries to skip.
+    for request_id in request_ids[::2]:
+        limit.record_actual_usage_sync(request_id, 1, 1)
+
+    pending = limit._pending_requests = _CountingDict(limit._pending_requests)
+
+    indexed = _time_per_call(limit._cleanup_old_requests, calls)
+    lookups = pending.lookups
+    full_scan = _time_per_call(lambda: _full_scan_cleanup(limit), calls)
+
+    print(
+        f"Pending expiry with {len(limit._pending_requests)} in flight: "
+        f"indexed {indexed * 1e6:.2f}us/call, full scan {full_scan * 1e6:.2f}us/call "
+        f"({full_scan / indexed:.0f}x), {lookups} records examined over {calls} calls"
+    )
+    assert len(limit._pending_requests) == in_flight
+    # Each call looks only at the oldest in-flight request, however many are pending
+    assert lookups == calls
+
+
+def test_pending_expiry_removes_only_expired_prefix() -> None:
+    limit = ModelRateLimit(model_names=["m"], pending_timeout_seconds=60)
+    old_ids = [limit.acquire_sync(1, 1) for _ in range(3)]
+    for request_id in old_ids:
+        limit._pending_requests[request_id].lock_acquisition_timestamp -= 120
+    limit.record_actual_usage_sync(old_ids[1], 1, 1)
+    fresh_id = limit.acquire_sync(1, 1)
+
+    limit._cleanup_old_requests()
+
+    assert list(limit._pending_requests) == [fresh_id]
+    assert limit._pending_input_tokens == 1
+    assert limit._pending_by_age[0] == fresh_id
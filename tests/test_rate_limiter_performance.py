@@ -1,8 +1,44 @@
+import threading
 import time
+import tracemalloc
+import uuid
+from dataclasses import dataclass
 
 import anyio
 
-from bulkllm.rate_limiter import ModelRateLimit
+from bulkllm.rate_limiter import _UNLIMITED_CONTEXT, ModelRateLimit, RateLimiter, Request
+
+
+class _CountingLock:
+    """An ``RLock`` that counts how often it is entered, so lock traffic can be asserted exactly."""
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self.entries = 0
+
+    def __enter__(self) -> bool:
+        self.entries += 1
+        return self._lock.__enter__()
+
+    def __exit__(self, *exc_info) -> None:
+        self._lock.__exit__(*exc_info)
+
+
+def _counted(limit: ModelRateLimit) -> _CountingLock:
+    limit._lock = _CountingLock()
+    return limit._lock
+
+
+class _CountingPattern:
+    """Wrap a compiled pattern and count ``match`` calls."""
+
+    def __init__(self, pattern) -> None:
+        self.pattern = pattern
+        self.calls = 0
+
+    def match(self, name: str):
+        self.calls += 1
+        return self.pattern.match(name)
 
 
 async def _benchmark(concurrency: int, duration: float) -> dict[str, float]:
@@ -44,3 +80,175 @@ def test_rate_limiter_performance() -> None:
         f"with peak pending {stats['max_pending']} using {concurrency} workers."
     )
     print(f"Throughput: {rps:.2f} tasks/sec")
+
+
+def test_reserve_many_amortizes_locking() -> None:
+    n = 5_000
+    limit = ModelRateLimit(model_names=["m"], rpm=10 * n)
+    lock = _counted(limit)
+    start = time.perf_counter()
+    contexts = [limit.reserve_capacity_sync(1, 1) for _ in range(n)]
+    single = time.perf_counter() - start
+    single_locks = lock.entries
+    limit._cancel_many_sync([ctx.request_id for ctx in contexts])
+
+    lock.entries = 0
+    start = time.perf_counter()
+    batch = limit.reserve_many_sync([(1, 1)] * n)
+    bulk = time.perf_counter() - start
+    bulk_locks = lock.entries
+    batch.release_sync()
+
+    print(
+        f"reserve_capacity_sync: {single / n * 1e6:.1f}us/request over {single_locks} lock entries, "
+        f"reserve_many_sync: {bulk / n * 1e6:.1f}us/request over {bulk_locks}"
+    )
+    assert len(batch) == n
+    assert single_locks >= n
+    assert bulk_locks == 1
+
+
+def test_routing_10k_distinct_model_names() -> None:
+    limiter = RateLimiter()
+    for vendor in range(40):
+        limiter.add_rate_limit(ModelRateLimit(model_names=[f"^vendor{vendor}/.*$"], is_regex=True, rpm=100))
+    names = [f"openrouter/vendor{i % 50}/model-{i}" + (":free" if i % 3 == 0 else "") for i in range(4_000)]
+    names += [f"vendor{i % 50}/model-{i}" for i in range(3_000)]
+    names += [f"selfhosted/model-{i}" for i in range(3_000)]
+
+    sequential_matches = 0
+
+    def sequential(name: str) -> ModelRateLimit:
+        nonlocal sequential_matches
+        for pattern, limit in limiter.regex_patterns:
+            sequential_matches += 1
+            if pattern.match(name):
+                return limit
+        return limiter.default_rate_limit
+
+    start = time.perf_counter()
+    expected = [limiter.model_limit_lookup.get(n) or sequential(n) for n in names]
+    baseline = time.perf_counter() - start
+
+    limiter._match_regex("")  # compile the combined pattern so its calls can be counted
+    combined = limiter._combined_pattern = _CountingPattern(limiter._combined_pattern)
+    start = time.perf_counter()
+    cold = [limiter.get_rate_limit_for_model(n) for n in names]
+    first_pass = time.perf_counter() - start
+    cold_matches = combined.calls
+    hot = names[-limiter.route_cache_size :]
+    start = time.perf_counter()
+    for n in hot:
+        limiter.get_rate_limit_for_model(n)
+    memo_pass = (time.perf_counter() - start) / len(hot) * len(names)
+
+    print(
+        f"10k names: sequential {baseline * 1e3:.1f}ms ({sequential_matches} matches), "
+        f"combined {first_pass * 1e3:.1f}ms ({cold_matches} matches), memoised {memo_pass * 1e3:.1f}ms"
+    )
+    assert cold == expected
+    assert len(limiter._routes) <= limiter.route_cache_size
+    # One combined match per unseen name instead of one per pattern, and none once memoised
+    assert cold_matches == len(names)
+    assert sequential_matches > 10 * len(names)
+    assert combined.calls == cold_matches
+
+
+def test_unlimited_fast_path_skips_bookkeeping() -> None:
+    n = 5_000
+
+    def run(limit: ModelRateLimit) -> tuple[float, int]:
+        lock = _counted(limit)
+        start = time.perf_counter()
+        for _ in range(n):
+            with limit.reserve_capacity_sync(1, 1) as ctx:
+                ctx.record_usage_sync(1, 1)
+        return (time.perf_counter() - start) / n, lock.entries
+
+    unlimited = ModelRateLimit(model_names=["m"])
+    (fast, fast_locks), (tracked, tracked_locks) = (
+        run(unlimited),
+        run(ModelRateLimit(model_names=["m"], max_concurrency=n)),
+    )
+    print(f"unlimited: {fast * 1e6:.2f}us/request, tracked: {tracked * 1e6:.2f}us/request")
+    # The unlimited path hands out a shared context without touching the lock or any request records
+    assert unlimited.reserve_capacity_sync(1, 1) is _UNLIMITED_CONTEXT
+    assert fast_locks == 0
+    assert tracked_locks >= 2 * n
+    assert not unlimited._pending_requests
+    assert unlimited._completed_request_count == 0
+
+
+@dataclass
+class _UuidRequest:
+    """The previous record layout: a plain dataclass keyed by a uuid4 string."""
+
+    id: str
+    lock_acquisition_timestamp: float | None
+    request_completion_timestamp: float | None
+    input_tokens: int
+    output_tokens: int
+
+
+def _traced_bytes(build) -> int:
+    tracemalloc.start()
+    try:
+        kept = build()  # noqa: F841 - keep the result alive while measuring
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def test_compact_request_records() -> None:
+    n = 10_000
+    now = time.monotonic()
+
+    def uuid_records() -> dict[str, _UuidRequest]:
+        return {(k := str(uuid.uuid4())): _UuidRequest(k, now, None, 1, 1) for _ in range(n)}
+
+    def compact_records() -> dict[int, Request]:
+        return {i: Request(i, now, None, 1, 1) for i in range(n)}
+
+    old, new = _traced_bytes(uuid_records), _traced_bytes(compact_records)
+    print(f"{n} pending records: uuid/dataclass {old / n:.0f}B each, int/slots {new / n:.0f}B each")
+    assert new * 1.5 < old
+
+    # Steady state at 50k rpm: records are recycled, so the limiter stops allocating
+    limit = ModelRateLimit(model_names=["m"], rpm=50_000, window_mode="bucketed")
+    start = time.perf_counter()
+    for _ in range(5_000):
+        limit.record_actual_usage_sync(limit.acquire_sync(1, 1), 1, 1)
+    rps = 5_000 / (time.perf_counter() - start)
+    tracemalloc.start()
+    for _ in range(1_000):
+        limit.record_actual_usage_sync(limit.acquire_sync(1, 1), 1, 1)
+    growth = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"50k rpm limit: {rps:.0f} requests/s, {growth / 1_000:.1f}B retained per request")
+    assert growth / 1_000 < 16
+
+
+def test_async_path_costs_no_more_than_sync() -> None:
+    # Both paths share one thread lock, so the async wrappers add no lock overhead of their own
+    n = 5_000
+
+    def sync_run() -> tuple[float, int]:
+        limit = ModelRateLimit(model_names=["m"], rpm=10 * n)
+        lock = _counted(limit)
+        start = time.perf_counter()
+        for _ in range(n):
+            limit.reserve_capacity_sync(1, 1).record_usage_sync(1, 1)
+        return (time.perf_counter() - start) / n, lock.entries
+
+    async def async_run() -> tuple[float, int]:
+        limit = ModelRateLimit(model_names=["m"], rpm=10 * n)
+        lock = _counted(limit)
+        start = time.perf_counter()
+        for _ in range(n):
+            await (await limit.reserve_capacity(1, 1)).record_usage(1, 1)
+        return (time.perf_counter() - start) / n, lock.entries
+
+    sync_cost, sync_locks = sync_run()
+    async_cost, async_locks = anyio.run(async_run)
+    print(f"reserve+record: sync {sync_cost * 1e6:.1f}us, async {async_cost * 1e6:.1f}us")
+    assert async_locks == sync_locks
@@ -0,0 +1,155 @@
+import threading
+import time
+
+import anyio
+import anyio.lowlevel
+
+from bulkllm.rate_limiter import ModelRateLimit, RateLimiter
+
+
+class _InFlight:
+    """Counts callers between reservation and release, remembering the peak."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+        self.done = 0
+
+    def enter(self) -> None:
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def leave(self) -> None:
+        with self.lock:
+            self.current -= 1
+            self.done += 1
+
+
+def _hammer(limiter: RateLimiter, model: str, sync_threads: int, loops: int, tasks_per_loop: int, rounds: int):
+    """Reserve and record *rounds* times from sync threads and from several event loops at once."""
+    in_flight = _InFlight()
+    errors: list[BaseException] = []
+
+    def sync_worker() -> None:
+        for _ in range(rounds):
+            with limiter.reserve_capacity_sync(model, 1, 1) as ctx:
+                in_flight.enter()
+                time.sleep(0)
+                in_flight.leave()
+                ctx.record_usage_sync(1, 1)
+
+    async def async_worker() -> None:
+        for _ in range(rounds):
+            async with await limiter.reserve_capacity(model, 1, 1) as ctx:
+                in_flight.enter()
+                await anyio.lowlevel.checkpoint()
+                in_flight.leave()
+                await ctx.record_usage(1, 1)
+
+    async def loop_main() -> None:
+        async with anyio.create_task_group() as tg:
+            for _ in range(tasks_per_loop):
+                tg.start_soon(async_worker)
+
+    def guarded(fn) -> None:
+        try:
+            fn()
+        except BaseException as exc:  # noqa: BLE001 - surfaced by the assertion below
+            errors.append(exc)
+
+    threads = [threading.Thread(target=guarded, args=(sync_worker,)) for _ in range(sync_threads)]
+    threads += [threading.Thread(target=guarded, args=(lambda: anyio.run(loop_main),)) for _ in range(loops)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+    elapsed = time.perf_counter() - start
+    assert not any(thread.is_alive() for thread in threads), "workers deadlocked"
+    assert not errors, errors
+    return in_flight, elapsed
+
+
+def test_sync_threads_and_event_loops_share_concurrency_cap() -> None:
+    limit = ModelRateLimit(model_names=["m"], max_concurrency=3)
+    in_flight, elapsed = _hammer(RateLimiter([limit]), "m", sync_threads=4, loops=3, tasks_per_loop=4, rounds=150)
+    total = (4 + 3 * 4) * 150
+    print(f"{total} mixed reservations in {elapsed:.2f}s ({total / elapsed:.0f}/s)")
+    assert in_flight.done == total
+    assert in_flight.peak <= 3
+    assert not limit._pending_requests
+    assert not limit._waiters or all(waiter.cancelled for waiter in limit._waiters)
+    assert limit._completed_request_count == total
+    assert limit.current_input_tokens_in_window == total
+
+
+def test_hierarchy_books_stay_consistent_under_mixed_load() -> None:
+    a = ModelRateLimit(model_names=["p/a"], max_concurrency=2)
+    provider = ModelRateLimit(model_names=["p/.*"], is_regex=True, level="provider", max_concurrency=4)
+    limiter = RateLimiter([a, provider])
+    _hammer(limiter, "p/a", sync_threads=3, loops=2, tasks_per_loop=3, rounds=100)
+    total = (3 + 2 * 3) * 100
+    assert a._completed_request_count == provider._completed_request_count == total
+    assert not a._pending_requests
+    assert not provider._pending_requests
+
+
+def test_window_limit_is_exact_across_threads_and_loops() -> None:
+    limit = ModelRateLimit(model_names=["m"], rpm=500)
+    granted: list[int] = []
+    barrier = threading.Barrier(6)
+
+    def sync_worker() -> None:
+        barrier.wait()
+        granted.extend(request_id for _ in range(200) if (request_id := limit.acquire_sync(1, 1)) is not None)
+
+    async def async_worker() -> None:
+        for _ in range(100):
+            if (request_id := await limit.acquire(1, 1)) is not None:
+                granted.append(request_id)
+            await anyio.lowlevel.checkpoint()
+
+    async def loop_main() -> None:
+        barrier.wait()
+        async with anyio.create_task_group() as tg:
+            for _ in range(2):
+                tg.start_soon(async_worker)
+
+    threads = [threading.Thread(target=sync_worker) for _ in range(3)]
+    threads += [threading.Thread(target=anyio.run, args=(loop_main,)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    assert len(granted) == len(set(granted)) == 500
+    assert len(limit._pending_requests) == 500
+
+
+def test_sync_release_wakes_async_waiter_on_another_thread() -> None:
+    limit = ModelRateLimit(model_names=["m"], max_concurrency=1)
+    holder = limit.reserve_capacity_sync(1, 1)
+    parked = threading.Event()
+    waited: dict[str, float] = {}
+
+    async def waiter() -> None:
+        async with anyio.create_task_group() as tg:
+
+            async def reserve() -> None:
+                ctx = await limit.reserve_capacity(1, 1)
+                waited["released_after"] = time.monotonic() - waited["release_at"]
+                await ctx.record_usage(1, 1)
+
+            tg.start_soon(reserve)
+            await anyio.sleep(0.05)
+            parked.set()
+
+    thread = threading.Thread(target=anyio.run, args=(waiter,))
+    thread.start()
+    assert parked.wait(5)
+    waited["release_at"] = time.monotonic()
+    holder.record_usage_sync(1, 1)
+    thread.join(timeout=5)
+    # Woken by the release itself rather than the MAX_WAIT_SECONDS poll
+    assert waited["released_after"] < 0.2
@@ -0,0 +1,265 @@
+import asyncio
+import threading
+
+import litellm
+import pytest
+from litellm.caching.disk_cache import DiskCache
+
+from bulkllm import response_cache
+from bulkllm.response_cache import ShardedSQLiteCache, TieredCache
+from bulkllm.usage_tracker import UsageTracker
+
+
+def _response(text: str) -> dict:
+    return {"timestamp": 1.0, "response": {"choices": [{"message": {"content": text}}]}}
+
+
+def test_round_trip_compresses_large_payloads_and_counts_lookups(tmp_path):
+    cache = ShardedSQLiteCache(tmp_path, shards=4)
+    value = _response("word " * 2_000)
+    cache.set_cache("ab" * 32, value)
+
+    assert cache.get_cache("ab" * 32) == value
+    assert cache.get_cache("cd" * 32) is None
+    assert cache.total_bytes() < len(str(value)) / 10
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.sets) == (1, 1, 1)
+    assert stats.hit_ratio == 0.5
+    assert stats.snapshot()["mean_get_ms"] > 0
+
+
+def test_keys_are_spread_across_shard_files_by_prefix(tmp_path):
+    cache = ShardedSQLiteCache(tmp_path, shards=4)
+    for prefix in range(4):
+        cache.set_cache(f"{prefix:08x}" + "0" * 56, prefix)
+    cache.set_cache("not-a-hex-key", "x")
+
+    counts = []
+    for pool in cache._pools:
+        with pool.connection() as conn:
+            counts.append(conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0])
+    assert sum(counts) == 5
+    assert all(count >= 1 for count in counts)
+    assert cache.get_cache("not-a-hex-key") == "x"
+    # Reopening the directory finds the same entries
+    assert ShardedSQLiteCache(tmp_path, shards=4).get_cache("00000002" + "0" * 56) == 2
+
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    now = [1_000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ShardedSQLiteCache(tmp_path, shards=1, default_ttl=60)
+    cache.set_cache("default", 1)
+    cache.set_cache("short", 2, ttl=10)
+    cache.set_cache("forever", 3, ttl=None)
+
+    now[0] += 30
+    assert [cache.get_cache(key) for key in ("default", "short", "forever")] == [1, None, 3]
+    now[0] += 60
+    assert [cache.get_cache(key) for key in ("default", "short", "forever")] == [None, None, 3]
+    assert cache.stats().expirations == 2
+    with cache._pools[0].connection() as conn:
+        assert cache.total_bytes() == conn.execute("SELECT SUM(size) FROM entries").fetchone()[0]
+
+
+def test_size_budget_evicts_least_recently_read(tmp_path, monkeypatch):
+    now = [1_000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ShardedSQLiteCache(tmp_path, shards=1, max_bytes=None, touch_interval=0)
+    payload = "x" * 90
+    cache.set_cache("key-0", payload)
+    entry = cache.total_bytes()
+    cache.max_bytes = 10 * entry + entry // 2
+    for i in range(1, 10):
+        now[0] += 1
+        cache.set_cache(f"key-{i}", payload)
+    now[0] += 1
+    cache.get_cache("key-0")
+    now[0] += 1
+
+    cache.set_cache("key-10", payload)
+
+    # 11 entries overflow the budget; the two least recently read go
+    assert cache.total_bytes() == 9 * entry
+    assert cache.get_cache("key-0") == payload
+    assert cache.get_cache("key-1") is None
+    assert cache.get_cache("key-2") is None
+    assert cache.get_cache("key-10") == payload
+    assert cache.stats().evictions == 2
+
+
+def test_misses_are_copied_from_the_fallback_cache(tmp_path):
+    legacy = DiskCache(disk_cache_dir=str(tmp_path / "legacy"))
+    legacy.set_cache("key", _response("old"))
+    cache = ShardedSQLiteCache(tmp_path / "new", fallback=legacy)
+
+    assert cache.get_cache("key") == _response("old")
+    legacy.flush_cache()
+    assert cache.get_cache("key") == _response("old")
+    assert cache.stats().fallback_hits == 1
+
+
+def test_increment_delete_and_flush(tmp_path):
+    cache = ShardedSQLiteCache(tmp_path, shards=2)
+    assert cache.increment_cache("counter", 2) == 2
+    assert cache.increment_cache("counter", 3) == 5
+    cache.delete_cache("counter")
+    assert cache.get_cache("counter") is None
+    cache.batch_get_cache(["a", "b"])
+    cache.set_cache("a", 1)
+    cache.flush_cache()
+    assert cache.batch_get_cache(["a"]) == [None]
+    assert cache.total_bytes() == 0
+
+
+def test_shard_count_is_validated(tmp_path):
+    with pytest.raises(ValueError, match="shards must be between 1 and 256"):
+        ShardedSQLiteCache(tmp_path, shards=0)
+    with pytest.raises(ValueError, match="connections_per_shard must be positive"):
+        ShardedSQLiteCache(tmp_path, connections_per_shard=0)
+
+
+def test_many_threads_share_a_bounded_set_of_connections(tmp_path, monkeypatch):
+    opened = []
+    connect = response_cache.sqlite3.connect
+    monkeypatch.setattr(response_cache.sqlite3, "connect", lambda *a, **kw: opened.append(a[0]) or connect(*a, **kw))
+    cache = ShardedSQLiteCache(tmp_path, shards=4, connections_per_shard=2)
+    barrier = threading.Barrier(32)
+
+    def work(n: int) -> None:
+        barrier.wait()
+        for i in range(20):
+            key = f"{(n * 20 + i) % 64:08x}" + "0" * 56
+            cache.set_cache(key, i)
+            cache.get_cache(key)
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 32 threads never open more than two connections per shard
+    assert len(opened) <= 4 * 2
+    assert all(pool.opened <= 2 for pool in cache._pools)
+    assert cache.stats().sets == 32 * 20
+    cache.close()
+    assert all(pool.opened == 0 for pool in cache._pools)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_async_gets_open_only_the_shards_they_touch(tmp_path):
+    cache = ShardedSQLiteCache(tmp_path, shards=16)
+    cache.set_cache("00000000" + "0" * 56, "hit")
+    cache.close()
+
+    await asyncio.gather(*(cache.async_get_cache("00000000" + "0" * 56) for _ in range(200)))
+
+    assert cache._pools[0].opened <= cache._pools[0].size
+    assert sum(pool.opened for pool in cache._pools[1:]) == 0
+
+
+@pytest.mark.asyncio
+async def test_async_methods_back_a_litellm_cache(tmp_path):
+    cache = litellm.Cache(type="local")
+    cache.cache = ShardedSQLiteCache(tmp_path)
+    request = {"model": "openai/gpt-4o", "messages": [{"role": "user", "content": "hi"}]}
+    response = litellm.ModelResponse(model="openai/gpt-4o", choices=[{"message": {"content": "hello"}}])
+
+    await cache.async_add_cache(response, **request)
+    cached = await cache.async_get_cache(**request)
+
+    assert cached["choices"][0]["message"]["content"] == "hello"
+    assert await cache.cache.async_increment("n", 4) == 4
+    await cache.cache.async_set_cache_pipeline([("a", 1), ("b", 2)])
+    assert await cache.cache.async_batch_get_cache(["a", "b", "c"]) == [1, 2, None]
+
+
+def test_tiered_cache_serves_repeats_from_memory(tmp_path, monkeypatch):
+    backend = ShardedSQLiteCache(tmp_path)
+    backend.set_cache("warm", _response("from disk"))
+    cache = TieredCache(backend)
+    backend_reads = []
+    original_get = backend.get_cache
+    monkeypatch.setattr(backend, "get_cache", lambda key, **kw: backend_reads.append(key) or original_get(key, **kw))
+
+    with UsageTracker("run") as tracker:
+        assert [cache.get_cache("warm") for _ in range(3)] == [_response("from disk")] * 3
+        assert cache.get_cache("cold") is None
+        cache.set_cache("new", _response("written"))
+        assert cache.get_cache("new") == _response("written")
+
+    # Only the first read of "warm" and the miss reach the backend; writes go through to it
+    assert backend_reads == ["warm", "cold"]
+    assert backend.stats().sets == 2
+    assert original_get("new") == _response("written")
+    stats = cache.stats()
+    assert (stats["memory"].hits, stats["memory"].misses) == (3, 2)
+    assert (stats["backend"].hits, stats["backend"].misses, stats["backend"].sets) == (1, 1, 1)
+    # Five lookups: three answered from memory, one from the backend, one miss
+    assert tracker.cache_snapshot() == {
+        "hits": 4,
+        "misses": 1,
+        "hit_ratio": 0.8,
+        "tiers": {"backend": {"hits": 1, "hit_ratio": 0.2}, "memory": {"hits": 3, "hit_ratio": 0.6}},
+    }
+
+
+def test_tiered_cache_bounds_entries_and_bytes(tmp_path):
+    cache = TieredCache(ShardedSQLiteCache(tmp_path), max_entries=3, max_bytes=1_000)
+    for i in range(4):
+        cache.set_cache(f"k{i}", i)
+    cache.get_cache("k1")
+    cache.set_cache("k4", 4)
+
+    assert list(cache._entries) == ["k3", "k1", "k4"]
+    cache.set_cache("big", "x" * 800)
+    assert cache.memory_bytes <= 1_000
+    assert list(cache._entries)[-1] == "big"
+    cache.set_cache("huge", "x" * 2_000)
+    assert "huge" not in cache._entries
+    # Evicted and oversized entries are still in the backend
+    assert cache.get_cache("huge") == "x" * 2_000
+    assert "huge" not in cache._entries
+    assert cache.get_cache("k0") == 0
+    assert cache.stats()["memory"].evictions == 4
+
+
+def test_tiered_cache_honours_ttl_and_deletes_both_tiers(tmp_path, monkeypatch):
+    now = [1_000.0]
+    monkeypatch.setattr(response_cache.time, "monotonic", lambda: now[0])
+    backend = ShardedSQLiteCache(tmp_path)
+    cache = TieredCache(backend, ttl=100)
+    cache.set_cache("short", 1, ttl=10)
+    cache.set_cache("long", 2)
+
+    now[0] += 50
+    assert cache._recall("short") == (False, None)
+    assert cache._recall("long") == (True, 2)
+    now[0] += 60
+    assert cache._recall("long") == (False, None)
+    assert cache.stats()["memory"].expirations == 2
+
+    cache.set_cache("gone", 3)
+    cache.delete_cache("gone")
+    assert cache.get_cache("gone") is None
+    cache.set_cache("a", 1)
+    cache.flush_cache()
+    assert cache.get_cache("a") is None
+    assert cache.memory_bytes == 0
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_async_memory_hits_skip_the_backend(tmp_path, monkeypatch):
+    cache = TieredCache(ShardedSQLiteCache(tmp_path))
+    await cache.async_set_cache("k", {"v": 1})
+
+    async def fail(*args, **kwargs):
+        raise AssertionError("memory hit went to the backend")
+
+    monkeypatch.setattr(cache.backend, "async_get_cache", fail)
+    assert await cache.async_get_cache("k") == {"v": 1}
+    await cache.async_set_cache_pipeline([("a", 1), ("b", 2)])
+    assert await cache.async_batch_get_cache(["a", "b"]) == [1, 2]
+    assert await cache.async_increment("n", 2) == 2
+    assert cache._recall("n") == (True, 2)
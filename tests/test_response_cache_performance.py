@@ -0,0 +1,91 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from pathlib import Path
+
+from litellm.caching.disk_cache import DiskCache
+
+from bulkllm.response_cache import ShardedSQLiteCache, TieredCache
+
+_WORDS = ["the", "model", "answer", "is", "because", "therefore", "step", "result", "value", "we"]
+
+
+def _cached_response(rng: random.Random, i: int) -> dict:
+    """A value shaped like the ones litellm stores: a timestamp and a JSON-encoded ModelResponse."""
+    content = " ".join(rng.choice(_WORDS) for _ in range(500))
+    response = {
+        "id": f"chatcmpl-{i}",
+        "model": "openai/gpt-4o",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": 120, "completion_tokens": 500, "total_tokens": 620},
+    }
+    return {"timestamp": time.time(), "response": json.dumps(response)}
+
+
+def _disk_size(path: Path) -> int:
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+def _bench(cache, keys: list[str], values: list[dict], readers: int, reads: int) -> tuple[float, float]:
+    """Return (writes/s, reads/s) for filling *cache* then reading it from *readers* threads."""
+    start = time.perf_counter()
+    for key, value in zip(keys, values, strict=True):
+        cache.set_cache(key, value)
+    writes = len(keys) / (time.perf_counter() - start)
+
+    def reader(seed: int) -> None:
+        rng = random.Random(seed)
+        for _ in range(reads // readers):
+            assert cache.get_cache(rng.choice(keys)) is not None
+
+    threads = [threading.Thread(target=reader, args=(seed,)) for seed in range(readers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return writes, reads / (time.perf_counter() - start)
+
+
+def test_sharded_cache_against_diskcache(tmp_path) -> None:
+    rng = random.Random(0)
+    keys = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(1_000)]
+    values = [_cached_response(rng, i) for i in range(len(keys))]
+    disk = DiskCache(disk_cache_dir=str(tmp_path / "disk"))
+    sharded = ShardedSQLiteCache(tmp_path / "sharded")
+
+    disk_writes, disk_reads = _bench(disk, keys, values, readers=4, reads=10_000)
+    sharded_writes, sharded_reads = _bench(sharded, keys, values, readers=4, reads=10_000)
+    disk.disk_cache.close()
+    for pool in sharded._pools:
+        with pool.connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    disk_bytes = _disk_size(tmp_path / "disk")
+    sharded_bytes = _disk_size(tmp_path / "sharded")
+
+    print(
+        f"diskcache: {disk_writes:.0f} writes/s, {disk_reads:.0f} reads/s, {disk_bytes / 1e6:.1f}MB; "
+        f"sharded: {sharded_writes:.0f} writes/s, {sharded_reads:.0f} reads/s, {sharded_bytes / 1e6:.1f}MB"
+    )
+    print(sharded.stats().snapshot())
+    assert sharded.stats().hits == 10_000
+    assert sharded_bytes * 2 < disk_bytes
+
+
+def test_memory_tier_serves_repeated_reads_faster_than_disk(tmp_path) -> None:
+    rng = random.Random(0)
+    keys = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(500)]
+    values = [_cached_response(rng, i) for i in range(len(keys))]
+    sharded = ShardedSQLiteCache(tmp_path / "sharded")
+    tiered = TieredCache(ShardedSQLiteCache(tmp_path / "tiered"))
+
+    _, disk_reads = _bench(sharded, keys, values, readers=4, reads=10_000)
+    _, memory_reads = _bench(tiered, keys, values, readers=4, reads=10_000)
+
+    print(f"sharded: {disk_reads:.0f} reads/s; with memory tier: {memory_reads:.0f} reads/s")
+    stats = tiered.stats()
+    assert stats["memory"].hits == 10_000
+    assert stats["backend"].hits + stats["backend"].misses == 0
+    assert memory_reads > 5 * disk_reads
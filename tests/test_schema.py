@@ -25,6 +25,13 @@ def test_llmconfig_md5_and_kwargs():
     assert kwargs["temperature"] == 0.1
     assert kwargs["max_tokens"] == 100
     assert kwargs["stream"] is False
+    assert "stream_options" not in kwargs
+    assert "estimate_key" not in kwargs
+    assert cfg1.bulkllm_kwargs() == {**kwargs, "estimate_key": "s1"}
+
+    stream_kwargs = cfg1.completion_kwargs(stream=True)
+    assert stream_kwargs["stream"] is True
+    assert stream_kwargs["stream_options"] == {"include_usage": True}
 
 
 def test_llmconfig_verbosity_hash_and_kwargs_passthrough():
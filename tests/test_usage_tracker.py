@@ -1,3 +1,4 @@
+import threading
 from types import SimpleNamespace
 from typing import Any, cast
 
@@ -5,8 +6,10 @@ import pytest
 
 from bulkllm.usage_tracker import (
     GLOBAL_TRACKER,
+    UsageRecord,
     UsageTracker,
     convert_litellm_usage_to_usage_record,
+    track_cache_lookup,
     track_usage,
 )
 
@@ -18,6 +21,7 @@ class Dummy(SimpleNamespace):
 @pytest.fixture(autouse=True)
 def _clear_global_tracker() -> None:
     GLOBAL_TRACKER._aggregates.clear()
+    GLOBAL_TRACKER._cache_lookups.clear()
 
 
 def test_convert_usage_no_details():
@@ -101,3 +105,48 @@ def test_usage_tracker_snapshot() -> None:
     assert snap["b"]["input_text_tokens"]["total"] == 5
     assert snap["b"]["output_text_tokens"]["total"] == 6
     assert snap["b"]["tokens_total"]["total"] == 11
+
+
+def test_cache_lookups_reach_every_active_tracker() -> None:
+    assert UsageTracker("empty").cache_snapshot() == {"hits": 0, "misses": 0, "hit_ratio": 0.0, "tiers": {}}
+    with UsageTracker("outer") as outer:
+        track_cache_lookup(None)
+        track_cache_lookup("backend")
+        with UsageTracker("inner") as inner:
+            track_cache_lookup("memory")
+    assert outer.cache_snapshot() == {
+        "hits": 2,
+        "misses": 1,
+        "hit_ratio": 2 / 3,
+        "tiers": {"backend": {"hits": 1, "hit_ratio": 1 / 3}, "memory": {"hits": 1, "hit_ratio": 1 / 3}},
+    }
+    assert inner.cache_snapshot() == {
+        "hits": 1,
+        "misses": 0,
+        "hit_ratio": 1.0,
+        "tiers": {"memory": {"hits": 1, "hit_ratio": 1.0}},
+    }
+    assert GLOBAL_TRACKER.cache_snapshot()["tiers"]["memory"]["hits"] == 1
+    # Cache lookups are kept apart from the per-model usage snapshot
+    assert outer.snapshot() == {}
+
+
+def test_threads_without_a_copied_context_record_globally() -> None:
+    thread = threading.Thread(target=track_cache_lookup, args=("memory",))
+    thread.start()
+    thread.join()
+    assert GLOBAL_TRACKER.cache_snapshot()["tiers"] == {"memory": {"hits": 1, "hit_ratio": 1.0}}
+
+
+def test_streaming_latencies_are_aggregated() -> None:
+    tracker = UsageTracker("stream")
+    with tracker:
+        for ttft, itl in ((120.4, 15.0), (80.0, 25.0)):
+            record = UsageRecord(model="m", time_ms=500, time_to_first_token_ms=ttft, inter_token_latency_ms=itl)
+            track_usage("m", record=record)
+        track_usage("m", record=UsageRecord(model="m", time_ms=400))
+    stats = tracker.aggregate_stats()["m"].stats
+    assert stats["time_to_first_token_ms"].count == 2
+    assert stats["time_to_first_token_ms"].max == 120.4
+    assert stats["inter_token_latency_ms"].total == 40.0
+    assert record.model_dump()["time_to_first_token_ms"] == 80.0